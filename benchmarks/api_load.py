@@ -0,0 +1,396 @@
+"""
+Load benchmark for the API hot paths.
+
+Seeds a synthetic catalogue (N images x M annotations x P polygon points)
+through POST /images/bulk. It then drives a concurrent mix of requests:
+- list (GET /images),
+- upload (POST /images),
+- annotate (POST /annotations/batch),
+- resize (PUT /images/{key}/file).
+It reports throughput and latency percentiles per operation as JSON.
+Everything it created is deleted again unless --keep is given.
+
+In process, through httpx.ASGITransport (no server needed):
+
+    python benchmarks/api_load.py --images 500 --annotations 5 --points 64
+
+Against a running server, or one started here with uvicorn:
+
+    python benchmarks/api_load.py --url http://127.0.0.1:8000
+    python benchmarks/api_load.py --serve --workers 4
+
+To catch regressions, save a report and compare later runs with it. The
+exit status is 1 when a p50 or p99 got worse by more than the tolerance:
+
+    python benchmarks/api_load.py --output base.json
+    python benchmarks/api_load.py --baseline base.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional
+
+import httpx
+
+try:
+    from .percentiles import percentile
+except ImportError:  # run as a script
+    from percentiles import percentile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+OPERATIONS = ("list", "upload", "annotate", "resize")
+# Operations compared against a baseline, and the figures compared
+GUARDED_FIGURES = ("p50", "p99")
+
+
+class LoadConfig(NamedTuple):
+    images: int = 200
+    annotations: int = 5
+    points: int = 32
+    image_size: int = 256
+    concurrency: int = 8
+    requests: int = 500
+    # Stop after this many seconds instead, if set
+    duration: Optional[float] = None
+    # Relative weight of each operation in the mix
+    mix: Dict[str, int] = {"list": 60, "upload": 10, "annotate": 20, "resize": 10}
+    page_size: int = 50
+    seed_batch: int = 50
+    seed: int = 0
+
+
+def make_image(run_id: str, i: int, size: int) -> bytes:
+    """A JPEG whose colour (so content hash) is unique to this run and index."""
+    from PIL import Image as PILImage
+
+    digest = hashlib.sha256(f"{run_id}:{i}".encode()).digest()
+    buf = BytesIO()
+    PILImage.new("RGB", (size, size), color=tuple(digest[:3])).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def make_polygon(rng: random.Random, points: int, size: int) -> dict:
+    """A jittered circle of `points` vertices inside a size x size image."""
+    cx, cy, radius = rng.uniform(0.3, 0.7) * size, rng.uniform(0.3, 0.7) * size, size * 0.2
+    return {"points": [
+        [
+            round(cx + radius * rng.uniform(0.8, 1.0) * math.cos(2 * math.pi * k / points), 2),
+            round(cy + radius * rng.uniform(0.8, 1.0) * math.sin(2 * math.pi * k / points), 2),
+        ]
+        for k in range(points)
+    ]}
+
+
+def image_form(config: LoadConfig, client_id: str, rng: random.Random) -> dict:
+    return {
+        "client_id": client_id,
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": f"hw{rng.randrange(10)}",
+        "ml_tag": rng.choice(["TRAIN", "TEST", "LIVE"]),
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": index, "instrument": f"instr{rng.randrange(20)}",
+             "polygon": make_polygon(rng, config.points, config.image_size)}
+            for index in range(config.annotations)
+        ],
+    }
+
+
+class Recorder:
+    """Latency and outcome of every request, by operation."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, operation: str, seconds: float, status: int) -> None:
+        self.latencies[operation].append(seconds * 1000)
+        self.statuses[operation][status] += 1
+        if status >= 400:
+            self.errors[operation] += 1
+
+    def report(self, elapsed: float) -> dict:
+        operations = {}
+        for operation, latencies in sorted(self.latencies.items()):
+            operations[operation] = {
+                "requests": len(latencies),
+                "errors": self.errors[operation],
+                "statuses": {str(status): n for status, n in sorted(self.statuses[operation].items())},
+                "throughput_rps": round(len(latencies) / elapsed, 1),
+                "p50": round(percentile(latencies, 0.50), 2),
+                "p90": round(percentile(latencies, 0.90), 2),
+                "p99": round(percentile(latencies, 0.99), 2),
+                "mean": round(statistics.mean(latencies), 2),
+                "max": round(max(latencies), 2),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / elapsed, 1) if elapsed else None,
+            "operations": operations,
+        }
+
+
+async def seed_catalogue(client: httpx.AsyncClient, config: LoadConfig, run_id: str, client_id: str) -> List[str]:
+    """Create config.images images through the bulk endpoint; returns their keys."""
+    rng = random.Random(config.seed)
+    keys = []
+    for start in range(0, config.images, config.seed_batch):
+        batch = range(start, min(start + config.seed_batch, config.images))
+        manifest, files = [], []
+        for i in batch:
+            filename = f"bench_{run_id}_{i}.jpg"
+            manifest.append({**image_form(config, client_id, rng), "filename": filename})
+            files.append(("image_files", (filename, make_image(run_id, i, config.image_size), "image/jpeg")))
+        response = await client.post("/images/bulk", data={"manifest": json.dumps(manifest)}, files=files)
+        response.raise_for_status()
+        keys += [r["image_key"] for r in response.json()["results"] if r["status"] == "created"]
+    return keys
+
+
+async def run_workload(client: httpx.AsyncClient, config: LoadConfig, keys: List[str],
+                       run_id: str, client_id: str, uploaded: List[str]) -> dict:
+    recorder = Recorder()
+    weights = [config.mix.get(operation, 0) for operation in OPERATIONS]
+    issued = 0
+    started = time.perf_counter()
+    deadline = started + config.duration if config.duration else None
+
+    def more() -> bool:
+        if deadline is not None:
+            return time.perf_counter() < deadline
+        return issued < config.requests
+
+    async def request(operation: str, rng: random.Random) -> int:
+        if operation == "list":
+            params = {"client_id": client_id, "limit": config.page_size}
+            if rng.random() < 0.3:
+                # A filtered listing, as the dashboard does
+                params["ml_tag"] = rng.choice(["TRAIN", "TEST", "LIVE"])
+            return (await client.get("/images", params=params)).status_code
+        if operation == "upload":
+            filename = f"bench_{run_id}_u{uuid.uuid4().hex}.jpg"
+            files = {
+                "image_file": (filename, make_image(run_id, rng.randrange(1 << 30), config.image_size), "image/jpeg"),
+                "image_form": (None, json.dumps(image_form(config, client_id, rng))),
+            }
+            response = await client.post("/images", files=files)
+            if response.status_code == 200:
+                uploaded.append(filename)
+            return response.status_code
+        key = rng.choice(keys)
+        if operation == "annotate":
+            upserts = [
+                {"image_key": key, "index": rng.randrange(config.annotations + 5),
+                 "instrument": f"instr{rng.randrange(20)}",
+                 "polygon": make_polygon(rng, config.points, config.image_size)}
+                for _ in range(rng.randint(1, 5))
+            ]
+            # One batch may not name an annotation twice
+            upserts = list({(u["image_key"], u["index"]): u for u in upserts}.values())
+            return (await client.post("/annotations/batch", json={"upsert": upserts})).status_code
+        params = {"scale": rng.choice([0.25, 0.5, 0.75]), "quality": rng.choice([60, 75, 90])}
+        return (await client.put(f"/images/{key}/file", params=params)).status_code
+
+    async def worker(n: int) -> None:
+        nonlocal issued
+        rng = random.Random(config.seed * 1000 + n)
+        while more():
+            issued += 1
+            operation = rng.choices(OPERATIONS, weights)[0]
+            if operation != "upload" and operation != "list" and not keys:
+                continue
+            began = time.perf_counter()
+            try:
+                status = await request(operation, rng)
+            except httpx.HTTPError:
+                status = 599
+            recorder.record(operation, time.perf_counter() - began, status)
+
+    await asyncio.gather(*(worker(n) for n in range(config.concurrency)))
+    return recorder.report(time.perf_counter() - started)
+
+
+async def cleanup(client: httpx.AsyncClient, keys: List[str], concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def remove(key: str) -> None:
+        async with semaphore:
+            await client.delete(f"/images/{key}")
+
+    await asyncio.gather(*(remove(key) for key in keys))
+
+
+async def run_benchmark(client: httpx.AsyncClient, config: LoadConfig, keep: bool = False) -> dict:
+    """Seed, run the workload and clean up; returns the report."""
+    run_id = uuid.uuid4().hex[:8]
+    client_id = f"bench-{run_id}"
+    uploaded: List[str] = []
+    seed_started = time.perf_counter()
+    keys = await seed_catalogue(client, config, run_id, client_id)
+    seed_elapsed = time.perf_counter() - seed_started
+    try:
+        workload = await run_workload(client, config, keys, run_id, client_id, uploaded)
+    finally:
+        if not keep:
+            await cleanup(client, keys + uploaded, config.concurrency)
+    return {
+        "run_id": run_id,
+        "config": config._asdict(),
+        "seed": {"images": len(keys), "elapsed_s": round(seed_elapsed, 2),
+                 "images_per_s": round(len(keys) / seed_elapsed, 1) if seed_elapsed else None},
+        **workload,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Latency figures that got worse than the baseline by more than `tolerance` (0.2 = 20%)."""
+    regressions = []
+    for operation, figures in report["operations"].items():
+        before = baseline.get("operations", {}).get(operation)
+        if not before:
+            continue
+        for figure in GUARDED_FIGURES:
+            if before[figure] and figures[figure] > before[figure] * (1 + tolerance):
+                regressions.append(
+                    f"{operation} {figure}: {figures[figure]} ms vs {before[figure]} ms baseline"
+                )
+    return regressions
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while True:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Server at {url} did not come up")
+            await asyncio.sleep(0.2)
+
+
+async def run(args, config: LoadConfig) -> dict:
+    timeout = httpx.Timeout(60.0)
+    limits = httpx.Limits(max_connections=config.concurrency * 2)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+            return {"target": args.url, **await run_benchmark(client, config, args.keep)}
+
+    from app.main import app
+
+    # ASGITransport does not run lifespan events; run startup (schema) here
+    await app.router.startup()
+    try:
+        # Unhandled errors count as 500s, as they would behind a server
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            return {"target": "in-process", **await run_benchmark(client, config, args.keep)}
+    finally:
+        await app.router.shutdown()
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        operation, _, weight = part.partition("=")
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation!r}; use {', '.join(OPERATIONS)}")
+        mix[operation] = int(weight)
+    return mix
+
+
+def main() -> None:
+    defaults = LoadConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the API hot paths.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Benchmark a running server at this base URL")
+    target.add_argument("--serve", action="store_true", help="Start uvicorn on a free port and benchmark it")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers with --serve")
+    parser.add_argument("--images", type=int, default=defaults.images, help="Images to seed")
+    parser.add_argument("--annotations", type=int, default=defaults.annotations, help="Annotations per image")
+    parser.add_argument("--points", type=int, default=defaults.points, help="Points per polygon")
+    parser.add_argument("--image-size", type=int, default=defaults.image_size, help="Image width and height")
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=defaults.requests, help="Requests in the workload")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of --requests")
+    parser.add_argument("--mix", type=parse_mix, default=defaults.mix,
+                        help="Operation weights, e.g. list=60,upload=10,annotate=20,resize=10")
+    parser.add_argument("--sync-transforms", action="store_true",
+                        help="Resize in the request (IMAGE_TRANSFORM_MODE=sync) rather than queue a job; "
+                             "applies in process and with --serve")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Random seed")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded and uploaded images")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="Report to compare with; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    config = LoadConfig(
+        images=args.images, annotations=args.annotations, points=args.points, image_size=args.image_size,
+        concurrency=args.concurrency, requests=args.requests, duration=args.duration, mix=args.mix,
+        seed=args.seed,
+    )
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    if args.sync_transforms:
+        os.environ["IMAGE_TRANSFORM_MODE"] = "sync"
+
+    server = None
+    if args.serve:
+        args.url = f"http://127.0.0.1:{free_port()}"
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", args.url.rsplit(":", 1)[1], "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=os.path.join(ROOT, "src"),
+        )
+    try:
+        if server:
+            asyncio.run(wait_until_up(args.url))
+        report = asyncio.run(run(args, config))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("Warning: the baseline was run with a different configuration", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Cold-start benchmark for the Lambda handler.
+
+Starts `--runs` fresh Python processes. Each one imports app.main the way the
+Lambda runtime does (the init phase) and answers one invocation with a sample
+event (the first invoke). The report gives p50/p99/mean/max of both, plus the
+startup phases from app.startup, and can be written as JSON to track over time:
+
+    python benchmarks/cold_start.py --runs 30 --output cold_start.json
+
+Processes run with AWS_LAMBDA_FUNCTION_NAME set, so they take the Lambda
+defaults: no schema creation, thread image pool, synchronous transforms. The
+default event (event.json, GET /health) needs no database.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+try:
+    from .percentiles import percentile
+except ImportError:  # run as a script
+    from percentiles import percentile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CHILD = r"""
+import json, sys, time, types
+started = time.perf_counter()
+from app.main import handler
+from app.startup import profile
+init_ms = (time.perf_counter() - started) * 1000
+event = json.load(open(sys.argv[1]))
+started = time.perf_counter()
+response = handler(event, types.SimpleNamespace(aws_request_id="cold-start-benchmark"))
+first_invoke_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    "init_ms": init_ms,
+    "first_invoke_ms": first_invoke_ms,
+    "status": response["statusCode"],
+    "phases": profile.report()["phases"],
+}))
+"""
+
+
+def summarize(values) -> dict:
+    return {
+        "p50": round(percentile(values, 0.50), 1),
+        "p99": round(percentile(values, 0.99), 1),
+        "mean": round(statistics.mean(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+def run_once(event_path: str, env: dict) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, event_path],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    # The app may print during import; the measurement is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure Lambda handler cold starts.")
+    parser.add_argument("--runs", type=int, default=20, help="Fresh processes to start")
+    parser.add_argument("--event", default=os.path.join(ROOT, "event.json"), help="Lambda event to invoke with")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.join(ROOT, "src"), env.get("PYTHONPATH")]))
+    env.setdefault("AWS_LAMBDA_FUNCTION_NAME", "cold-start-benchmark")
+
+    # One throwaway run so bytecode is compiled, as it is in the deployed image
+    run_once(args.event, env)
+    runs = [run_once(args.event, env) for _ in range(args.runs)]
+
+    phases = sorted({phase for run in runs for phase in run["phases"]})
+    report = {
+        "runs": args.runs,
+        "python": sys.version.split()[0],
+        "statuses": sorted({run["status"] for run in runs}),
+        "init_ms": summarize([run["init_ms"] for run in runs]),
+        "first_invoke_ms": summarize([run["first_invoke_ms"] for run in runs]),
+        "phases_ms": {
+            phase: summarize([run["phases"][phase] for run in runs if phase in run["phases"]])
+            for phase in phases
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,8 @@ import NewImageModal from './components/NewImageModal';
 import UpdateImage from './components/UpdateImage';
 import NewAnnotationModal from './components/NewAnnotationModal';
 import UpdateAnnotationModal from './components/UpdateAnnotationModal';
-import { Image } from './types';
+import { Image, ImageChanges } from './types';
+import { applyImageChanges } from './imageSync';
 import { TopBar } from './components/TopBar';
 import { ImagesGrid } from './components/ImagesGrid';
 
@@ -18,14 +19,45 @@ function App() {
   const [isAnnotationModalOpen, setIsAnnotationModalOpen] = useState(false);
   const [isUpdateAnnotationModalOpen, setIsUpdateAnnotationModalOpen] = useState(false);
 
+  const [syncToken, setSyncToken] = useState<string | null>(null);
+
+  // GET /images is paged: follow X-Next-Cursor until the last page. The
+  // first page's ETag is the sync token, as it was read before any page.
+  const loadImages = async () => {
+    try {
+      const all: Image[] = [];
+      let token: string | null = null;
+      let cursor: string | undefined;
+      do {
+        const res = await axios.get<Image[]>('http://localhost:8000/images', { params: { cursor } });
+        all.push(...res.data);
+        token = token ?? res.headers['etag'] ?? null;
+        cursor = res.headers['x-next-cursor'] || undefined;
+      } while (cursor);
+      setImages(all);
+      setSyncToken(token);
+    } catch (err) {
+      console.error(err);
+    }
+  };
+
+  // Fetch only what changed since the last load, falling back to a full
+  // reload when there is no token yet or the server asks for one (410).
   const fetchImages = () => {
-    axios.get<Image[]>('http://localhost:8000/images')
-      .then(res => setImages(res.data))
-      .catch(err => console.error(err));
+    if (!syncToken) {
+      loadImages();
+      return;
+    }
+    axios.get<ImageChanges>('http://localhost:8000/images/changes', { params: { since: syncToken } })
+      .then(res => {
+        setImages(prev => applyImageChanges(prev, res.data));
+        setSyncToken(res.data.token);
+      })
+      .catch(() => loadImages());
   };
 
   useEffect(() => {
-    fetchImages();
+    loadImages();
   }, []);
 
   const handleDelete = (imageKey: string) => {
@@ -87,11 +119,7 @@ function App() {
       <NewImageModal 
         isOpen={isModalOpen} 
         onClose={() => setIsModalOpen(false)} 
-        onCreated={() => {
-            axios.get<Image[]>("http://localhost:8000/images")
-              .then(res => setImages(res.data))
-              .catch(err => console.error(err));
-          }}
+        onCreated={() => fetchImages()}
         />
 
       {isUpdateModalOpen && selectedImageKey && (
@@ -23,7 +23,14 @@ export function ImageCard({
 
   return (
     <div className="bg-white shadow rounded p-4">
-      <img src={`http://localhost:8000${image.image_key}`} alt="" className="rounded" />
+      <a href={`http://localhost:8000${image.image_key}`} target="_blank" rel="noreferrer">
+        <img
+          src={`http://localhost:8000/images/${encodeURIComponent(image.image_key.replace("/static/images/", ""))}/thumbnail?w=400&h=400`}
+          alt=""
+          loading="lazy"
+          className="rounded"
+        />
+      </a>
       <div className="mt-2 text-sm space-y-1">
         <p
           className="text-sm overflow-hidden whitespace-nowrap text-ellipsis"
@@ -13,10 +13,20 @@ const UpdateImage: React.FC<UpdateImageProps> = ({ imageKey, onClose }) => {
   const [dimensions, setDimensions] = useState<{ width: number; height: number } | null>(null);
   const [error, setError] = useState("");
 
+  // New transforms run as background jobs: poll until the job is done
+  const waitForJob = async (location: string) => {
+    for (;;) {
+      const { data: job } = await axios.get(`http://localhost:8000${location}`);
+      if (job.status === "succeeded") return job;
+      if (job.status === "failed") throw new Error(job.error || "The image update failed");
+      await new Promise((resolve) => setTimeout(resolve, 500));
+    }
+  };
+
   const updateImage = async () => {
     setError("");
     try {
-      const response = await axios.put(
+      let response = await axios.put(
         `http://localhost:8000/images/${encodeURIComponent(imageKey)}/file`,
         null,
         {
@@ -24,11 +34,18 @@ const UpdateImage: React.FC<UpdateImageProps> = ({ imageKey, onClose }) => {
           responseType: 'blob',
         }
       );
+      if (response.status === 202) {
+        const job = await waitForJob(response.headers.location);
+        response = await axios.get(`http://localhost:8000${imageKey}`, {
+          params: { v: job.result.version_id },
+          responseType: 'blob',
+        });
+      }
       const updatedUrl = URL.createObjectURL(response.data as Blob);
       setImageUrl(updatedUrl);
       setDimensions(null); // Reset dimensions so new image dimensions are updated correctly
     } catch (err: any) {
-      setError(err.response?.data?.detail || "An error occurred");
+      setError(err.response?.data?.detail || err.message || "An error occurred");
     }
   };
 
@@ -0,0 +1,39 @@
+import { Image, ImageChanges } from './types';
+
+const IMAGE_PREFIX = '/static/images/';
+
+// Merge a GET /images/changes delta into the loaded list: deletions first,
+// then updated images and annotations.
+export function applyImageChanges(images: Image[], changes: ImageChanges): Image[] {
+  const deletedImages = new Set(changes.deleted_images.map(key => IMAGE_PREFIX + key));
+  const byKey = new Map<string, Image>();
+  for (const image of images) {
+    if (!deletedImages.has(image.image_key)) {
+      byKey.set(image.image_key, { ...image, annotations: [...image.annotations] });
+    }
+  }
+
+  for (const { image_key, index } of changes.deleted_annotations) {
+    const image = byKey.get(IMAGE_PREFIX + image_key);
+    if (image) {
+      image.annotations = image.annotations.filter(ann => ann.index !== index);
+    }
+  }
+
+  for (const changed of changes.images) {
+    const key = IMAGE_PREFIX + changed.image_key;
+    byKey.set(key, { ...changed, image_key: key, annotations: byKey.get(key)?.annotations ?? [] });
+  }
+
+  for (const { image_key, ...annotation } of changes.annotations) {
+    const image = byKey.get(IMAGE_PREFIX + image_key);
+    if (image) {
+      image.annotations = [
+        ...image.annotations.filter(ann => ann.index !== annotation.index),
+        annotation,
+      ].sort((a, b) => a.index - b.index);
+    }
+  }
+
+  return [...byKey.values()];
+}
@@ -1,8 +1,13 @@
 import { StrictMode } from 'react'
 import { createRoot } from 'react-dom/client'
+import axios from 'axios'
 import './index.css'
 import App from './App.tsx'
 
+// The API is on another origin: send and keep its cookies, including the
+// read-your-writes cookie that routes our reads to the writer after a write.
+axios.defaults.withCredentials = true
+
 createRoot(document.getElementById('root')!).render(
   <StrictMode>
     <App />
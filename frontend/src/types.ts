@@ -14,4 +14,16 @@ export interface Annotation {
     user_id?: string;
     annotations: Annotation[];
   }
-  
\ No newline at end of file
+  
+  export interface AnnotationChange extends Annotation {
+    image_key: string;
+  }
+
+  // Response of GET /images/changes
+  export interface ImageChanges {
+    token: string;
+    images: Omit<Image, 'annotations'>[];
+    annotations: AnnotationChange[];
+    deleted_images: string[];
+    deleted_annotations: { image_key: string; index: number }[];
+  }
@@ -0,0 +1,124 @@
+# cache.py
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Entries kept in each process, and how long (seconds) they are kept. Keys
+# carry the change counter, so entries never need invalidating: the TTLs
+# only bound how long entries of superseded states take up memory.
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "1024"))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "5"))
+# Optional cache shared by every worker (and Lambda container), reached over
+# the Redis protocol: Redis, Valkey or ElastiCache.
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+CACHE_SHARED_TTL = int(os.getenv("CACHE_SHARED_TTL", "60"))
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "scalpel:")
+
+
+class TTLCache:
+    """In-process LRU of at most `max_entries` values, each expiring after `ttl` seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ReadCache:
+    """
+    Two-level cache of serialised read responses: a TTLCache per process in
+    front of an optional shared layer with the Redis API (`get`, `set`).
+
+    Callers key entries by the change counter value their response was
+    built at (see `cached_read_key` in main), so a write never deletes
+    anything: it takes a new counter value, and every later lookup, for
+    any image, uses keys no earlier entry has. The shared layer is best
+    effort: when it fails, reads fall through to the database.
+    """
+
+    def __init__(self, local: TTLCache, shared=None, shared_ttl: int = CACHE_SHARED_TTL,
+                 prefix: str = CACHE_KEY_PREFIX):
+        self.local = local
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.prefix = prefix
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.shared_errors = 0
+
+    async def _shared(self, method: str, *args, **kwargs):
+        if self.shared is None:
+            return None
+        try:
+            return await getattr(self.shared, method)(*args, **kwargs)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning("Shared cache %s failed: %s", method, e)
+            return None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        value = await self._shared("get", self.prefix + key)
+        if value is not None:
+            self.shared_hits += 1
+            self.local.set(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: bytes) -> None:
+        self.local.set(key, value)
+        await self._shared("set", self.prefix + key, value, ex=self.shared_ttl)
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.shared_hits + self.misses
+        return {
+            "shared": self.shared is not None,
+            "local_entries": len(self.local),
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.local_hits + self.shared_hits) / lookups, 3) if lookups else None,
+            "shared_errors": self.shared_errors,
+        }
+
+
+def cache_from_env() -> ReadCache:
+    """Build the read cache, with the shared layer if CACHE_REDIS_URL is set."""
+    shared = None
+    if CACHE_REDIS_URL:
+        import redis.asyncio  # optional dependency, only needed with a shared cache
+
+        shared = redis.asyncio.from_url(CACHE_REDIS_URL)
+    return ReadCache(TTLCache(CACHE_LOCAL_MAX_ENTRIES, CACHE_LOCAL_TTL), shared)
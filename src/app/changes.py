@@ -0,0 +1,101 @@
+# changes.py
+import os
+from typing import Iterable, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Annotation, ChangeCounter, Image, Tombstone
+
+# Counter shared by images and their annotations (everything GET /images returns).
+IMAGES_COUNTER = "images"
+# Most rows (per kind) one GET /images/changes answers before asking the
+# client to reload the full list instead.
+CHANGES_MAX_ROWS = int(os.getenv("IMAGES_CHANGES_MAX_ROWS", "5000"))
+
+
+async def next_change(db: AsyncSession, name: str = IMAGES_COUNTER) -> int:
+    """
+    Take the next change counter value for the current transaction.
+
+    This locks the counter row until commit, so call it once per
+    transaction, as late as possible: after any storage I/O and blob
+    references (`acquire_blob` / `release_blob`), right before the image
+    and annotation rows are written. Every writer then locks blob rows,
+    the counter and image rows in that order, and holds the counter only
+    for its final statements.
+    """
+    stmt = insert(ChangeCounter).values(name=name, value=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ChangeCounter.name],
+        set_={"value": ChangeCounter.value + 1},
+    ).returning(ChangeCounter.value)
+    return (await db.execute(stmt)).scalar_one()
+
+
+async def current_change(db: AsyncSession, name: str = IMAGES_COUNTER) -> int:
+    """Last committed change counter value (0 before the first change)."""
+    result = await db.execute(select(ChangeCounter.value).where(ChangeCounter.name == name))
+    return result.scalar_one_or_none() or 0
+
+
+def weak_etag(change: int) -> str:
+    return f'W/"{IMAGES_COUNTER}-{change}"'
+
+
+async def record_tombstones(
+    db: AsyncSession,
+    change_seq: int,
+    image_keys: Iterable[str] = (),
+    annotation_keys: Iterable[Tuple[str, int]] = (),
+) -> None:
+    """Record deleted images (with all their annotations) and deleted annotations."""
+    rows = [{"image_key": key, "index": None, "change_seq": change_seq} for key in image_keys]
+    rows += [{"image_key": key, "index": index, "change_seq": change_seq} for key, index in annotation_keys]
+    if rows:
+        await db.execute(insert(Tombstone).values(rows))
+
+
+async def load_changes(db: AsyncSession, since: int) -> dict:
+    """
+    Images, annotations and deletions committed after counter value `since`,
+    up to the current value, which is returned as the next token.
+
+    Deletions are listed separately and should be applied before the
+    upserts: a key deleted and then re-created appears in both.
+    """
+    token = await current_change(db)
+    if since > token:
+        raise HTTPException(status_code=400, detail="Unknown change token.")
+
+    def window(column):
+        return (column > since) & (column <= token)
+
+    def limited(query):
+        return query.limit(CHANGES_MAX_ROWS + 1)
+
+    images = (await db.execute(limited(
+        select(Image).where(window(Image.change_seq)).order_by(Image.change_seq)
+    ))).scalars().all()
+    annotations = (await db.execute(limited(
+        select(Annotation).where(window(Annotation.change_seq)).order_by(Annotation.change_seq)
+    ))).scalars().all()
+    tombstones = (await db.execute(limited(
+        select(Tombstone).where(window(Tombstone.change_seq)).order_by(Tombstone.change_seq)
+    ))).scalars().all()
+
+    if max(len(images), len(annotations), len(tombstones)) > CHANGES_MAX_ROWS:
+        # Cheaper for the client to reload the list than to replay this many changes
+        raise HTTPException(status_code=410, detail="Too many changes since this token; reload the image list.")
+
+    return {
+        "token": str(token),
+        "images": images,
+        "annotations": annotations,
+        "deleted_images": [t.image_key for t in tombstones if t.index is None],
+        "deleted_annotations": [
+            {"image_key": t.image_key, "index": t.index} for t in tombstones if t.index is not None
+        ],
+    }
@@ -0,0 +1,250 @@
+# derivatives.py
+import functools
+import hashlib
+import os
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import timed_phase
+
+# Output formats a derivative can be encoded as, mapped to Pillow format names.
+DERIVATIVE_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "avif": "AVIF"}
+
+
+class QualityTier(NamedTuple):
+    """How a served image is derived from its source, as in PUT /images/{key}/file."""
+    scale: float
+    quality: int
+
+
+def parse_quality_tiers(spec: str) -> Dict[str, QualityTier]:
+    """Parse "name=scale:quality,..." (e.g. "full=1:80,preview=0.5:70")."""
+    tiers = {}
+    for part in spec.split(","):
+        name, _, settings = part.strip().partition("=")
+        if not name or not settings:
+            continue
+        scale, _, quality = settings.partition(":")
+        tier = QualityTier(float(scale), int(quality or 80))
+        if not 0 < tier.scale <= 1 or not 1 <= tier.quality <= 100:
+            raise ValueError(f"Invalid quality tier {part.strip()!r}")
+        tiers[name.strip()] = tier
+    return tiers
+
+
+def _register_plugins() -> None:
+    try:
+        import pillow_avif  # noqa: F401  (optional: AVIF for Pillow builds without it)
+    except ImportError:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def can_encode(output_format: str) -> bool:
+    """True if this Pillow build can write `output_format` (AVIF needs libavif)."""
+    from PIL import Image as PILImage  # imported on first use, off the cold-start path
+
+    _register_plugins()
+    PILImage.init()
+    return DERIVATIVE_FORMATS.get(output_format) in PILImage.SAVE
+
+
+def negotiate_format(accept: Optional[str], offered: Sequence[str]) -> Optional[str]:
+    """
+    Pick the format (of `offered`, in order of preference) the Accept header
+    rates highest, or None if it lists none of them. Only explicit types
+    count: browsers send image/* and */* whatever they decode.
+    """
+    best, best_q = None, 0.0
+    for item in (accept or "").split(","):
+        media_range, *params = [piece.strip() for piece in item.split(";")]
+        media_range = media_range.lower()
+        if not media_range.startswith("image/") or media_range[6:] not in offered:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        output_format = media_range[6:]
+        if q > best_q or (q == best_q and best and offered.index(output_format) < offered.index(best)):
+            best, best_q = output_format, q
+    return best
+
+
+def derivative_key(source_key: str, **params) -> str:
+    """
+    Stable cache key for a derivative of the object stored under `source_key`.
+
+    Source keys of content-addressed images embed the content hash, so the
+    key changes whenever the original does and can double as a strong ETag.
+    """
+    parts = [source_key] + [f"{name}={params[name]}" for name in sorted(params)]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def make_thumbnail(data: bytes, width: int, height: int, output_format: str, quality: int) -> bytes:
+    """
+    Downscale an encoded image to fit within width x height.
+
+    For JPEG sources `draft()` lets the decoder downscale by a power of two
+    while decoding (far less work than a full decode); `thumbnail()` then
+    uses `reduce()` for the remaining integer factor before the final
+    resampling pass.
+    """
+    from PIL import Image as PILImage  # imported on first use, off the cold-start path
+
+    with PILImage.open(BytesIO(data)) as img:
+        with timed_phase("decode"):
+            img.draft("RGB", (width, height))
+            img.load()
+        with timed_phase("resize"):
+            img.thumbnail((width, height), PILImage.Resampling.LANCZOS, reducing_gap=3.0)
+        pil_format = DERIVATIVE_FORMATS[output_format]
+        with timed_phase("encode"):
+            if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            buf = BytesIO()
+            if pil_format == "PNG":
+                img.save(buf, format=pil_format, optimize=True)
+            else:
+                img.save(buf, format=pil_format, quality=quality)
+        return buf.getvalue()
+
+
+def transform_image(data: bytes, scale: float, quality: int) -> Tuple[bytes, str]:
+    """
+    Rescale an encoded image and re-encode it in its original format
+    (quality only applies to JPEG). Returns (encoded bytes, Pillow format).
+    """
+    from PIL import Image as PILImage  # imported on first use, off the cold-start path
+
+    with PILImage.open(BytesIO(data)) as img:
+        # Read the format before resizing: resized copies no longer carry it.
+        image_format = img.format if img.format else "JPEG"
+        with timed_phase("decode"):
+            img.load()
+        if scale != 1.0:
+            with timed_phase("resize"):
+                new_size = (max(int(img.width * scale), 1), max(int(img.height * scale), 1))
+                img = img.resize(new_size, PILImage.Resampling.LANCZOS)
+
+        with timed_phase("encode"):
+            buf = BytesIO()
+            if image_format.upper() == "JPEG":
+                img.save(buf, format=image_format, quality=quality)
+            else:
+                img.save(buf, format=image_format)  # Save PNG as is
+        return buf.getvalue(), image_format
+
+
+def transcode_image(data: bytes, output_format: str, scale: float, quality: int) -> bytes:
+    """
+    Rescale an encoded image and encode it as `output_format`, keeping
+    transparency where the format has it (quality does not apply to PNG).
+    """
+    from PIL import Image as PILImage  # imported on first use, off the cold-start path
+
+    if output_format == "avif":
+        _register_plugins()
+    with PILImage.open(BytesIO(data)) as img:
+        size = (max(int(img.width * scale), 1), max(int(img.height * scale), 1))
+        with timed_phase("decode"):
+            img.draft("RGB", size)
+            img.load()
+        if img.size != size:
+            with timed_phase("resize"):
+                img = img.resize(size, PILImage.Resampling.LANCZOS)
+        pil_format = DERIVATIVE_FORMATS[output_format]
+        with timed_phase("encode"):
+            if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            elif pil_format != "PNG" and img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info or img.mode.endswith("A") else "RGB")
+            buf = BytesIO()
+            if pil_format == "PNG":
+                img.save(buf, format=pil_format, optimize=True)
+            else:
+                img.save(buf, format=pil_format, quality=quality)
+        return buf.getvalue()
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class DiskLRUCache:
+    """
+    Size-bounded cache of files on local disk, evicting least recently used
+    entries once the total exceeds `max_bytes`.
+
+    Recency is tracked in memory and seeded from file access times on start,
+    so a restart keeps the warm set. Each worker process keeps its own index;
+    an entry evicted by another worker is simply a miss here.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if ".tmp-" in name:
+                    os.unlink(path)
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_atime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the path of a cached entry (marking it recently used), or None."""
+        if key not in self._entries:
+            return None
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.total_bytes -= self._entries.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        os.utime(path)
+        return path
+
+    async def put(self, key: str, data: bytes) -> str:
+        path = self.path(key)
+        await run_in_threadpool(_write_atomically, path, data)
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key)
+        self._entries[key] = len(data)
+        self.total_bytes += len(data)
+        self._evict()
+        return path
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            path = self.path(key)
+            if os.path.exists(path):
+                os.unlink(path)
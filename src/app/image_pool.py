@@ -0,0 +1,132 @@
+# image_pool.py
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional
+
+from fastapi import HTTPException
+
+from .metrics import collect_phases, observe_image_op, start_phases
+
+# "process" or "thread". Lambda has no /dev/shm for multiprocessing, so it
+# defaults to threads there; everywhere else CPU-bound Pillow work gets its
+# own processes and never holds the event loop's GIL.
+IMAGE_POOL_KIND = os.getenv(
+    "IMAGE_POOL_KIND", "thread" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "process"
+)
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(os.cpu_count() or 1)))
+# Jobs allowed to be queued or running before new ones are refused with 503.
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", str(IMAGE_POOL_WORKERS * 4)))
+
+
+class JobTiming(NamedTuple):
+    queued_ms: float
+    run_ms: float
+
+
+def _timed_call(fn: Callable, args: tuple):
+    """Run `fn` in the worker and report how long the call, and each phase it timed, took."""
+    start_phases()
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000, collect_phases()
+
+
+class ImagePool:
+    """
+    Bounded executor for image transforms.
+
+    At most `max_pending` jobs may be queued or running; beyond that `run`
+    fails fast with 503 so a burst of resizes cannot pile up unbounded work
+    (and memory) behind the workers. Each job's queue wait and run time are
+    returned to the caller and aggregated in `stats()`.
+    """
+
+    def __init__(self, kind: str = IMAGE_POOL_KIND, max_workers: int = IMAGE_POOL_WORKERS,
+                 max_pending: int = IMAGE_POOL_MAX_PENDING):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown IMAGE_POOL_KIND: {kind!r}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self._recent: "deque[JobTiming]" = deque(maxlen=1000)
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        # Created on first use so importing the app never starts processes.
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="image-pool"
+                )
+        return self._executor
+
+    async def run(self, fn: Callable, *args: Any):
+        """Run `fn(*args)` in the pool and return (result, JobTiming)."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Image processing is at capacity, retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, run_ms, phases = await loop.run_in_executor(self.executor, _timed_call, fn, args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        total_ms = (time.perf_counter() - submitted) * 1000
+        timing = JobTiming(queued_ms=max(total_ms - run_ms, 0.0), run_ms=run_ms)
+        self.completed += 1
+        self._recent.append(timing)
+        observe_image_op(fn.__name__, timing.queued_ms, timing.run_ms, phases, args, result)
+        return result, timing
+
+    def stats(self) -> dict:
+        run_times = sorted(t.run_ms for t in self._recent)
+        queue_times = sorted(t.queued_ms for t in self._recent)
+
+        def percentile(values, q):
+            return round(values[min(int(len(values) * q), len(values) - 1)], 2) if values else None
+
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "run_ms_p50": percentile(run_times, 0.50),
+            "run_ms_p95": percentile(run_times, 0.95),
+            "queued_ms_p50": percentile(queue_times, 0.50),
+            "queued_ms_p95": percentile(queue_times, 0.95),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def server_timing(timing: JobTiming) -> str:
+    """Format a job's timing as a Server-Timing header value."""
+    return f"queue;dur={timing.queued_ms:.1f}, transform;dur={timing.run_ms:.1f}"
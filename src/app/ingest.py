@@ -0,0 +1,381 @@
+# ingest.py
+import asyncio
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import zipfile
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .changes import next_change
+from .database import parameter_batches
+from .geometry import polygon_columns
+from .models import Annotation, Blob, Image, Location, User
+from .schemas import BulkImageItem, BulkImageResult
+from .stats import annotation_stat_deltas, apply_stat_deltas, image_stat_deltas
+from .storage import BlobStore, StagedBlob, discard_unreferenced_blob, release_blob
+from .uploads import MAX_BULK_UPLOAD_BYTES, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, upload_too_large
+
+# Name of the manifest when it is shipped inside the archive.
+MANIFEST_NAME = "manifest.json"
+# Files moved into the blob store concurrently once the batch is recorded.
+BULK_PLACE_CONCURRENCY = int(os.getenv("BULK_PLACE_CONCURRENCY", "8"))
+# Most files one batch may stage, and their total size once extracted: an
+# archive of many small (or highly compressed) members stays within these
+# even though each member is under the per-file limit.
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "10000"))
+BULK_MAX_TOTAL_BYTES = int(os.getenv("BULK_MAX_TOTAL_BYTES", str(MAX_BULK_UPLOAD_BYTES)))
+
+
+def too_many_files(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"The batch exceeds the maximum of {limit} files.")
+
+
+def batch_too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"The batch's files exceed the maximum total of {limit} bytes.")
+
+
+class BulkEntry(NamedTuple):
+    """One manifest item whose file has been staged and is ready to record."""
+    image_key: str
+    image_in: BulkImageItem
+    blob: StagedBlob
+
+
+def parse_manifest(raw) -> List[BulkImageItem]:
+    """
+    Parse a manifest: a JSON array of image forms (as accepted by
+    POST /images), each with the `filename` of its file in the batch.
+    """
+    try:
+        items = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON in manifest: {str(e)}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="The manifest must be a JSON array of images.")
+    try:
+        return [BulkImageItem(**item) for item in items]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error parsing manifest: {str(e)}")
+
+
+def _copy_to_staging(source, directory: str, max_bytes: int, too_large: Optional[HTTPException] = None) -> StagedBlob:
+    """
+    Copy a file object into a staging file in `directory`, hashing it on the
+    way; raises `too_large` (413 by default) past `max_bytes`.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large or upload_too_large(max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return StagedBlob(tmp_path=tmp_path, sha256=digest.hexdigest(), size=size)
+
+
+def _archive_members(archive) -> Iterator[Tuple[str, int, object]]:
+    """Yield (basename, declared size, open file) for each regular file of a zip or tar."""
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as member:
+                        yield os.path.basename(info.filename), info.file_size, member
+        return
+    archive.seek(0)
+    try:
+        tf = tarfile.open(fileobj=archive, mode="r:*")
+    except tarfile.TarError as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable archive (expected zip or tar): {str(e)}")
+    with tf:
+        for info in tf:
+            if info.isfile():
+                yield os.path.basename(info.name), info.size, tf.extractfile(info)
+
+
+def stage_archive(
+    archive,
+    directory: str,
+    max_bytes: Optional[int] = None,
+    max_files: Optional[int] = None,
+    max_total_bytes: Optional[int] = None,
+) -> Tuple[Optional[bytes], Dict[str, StagedBlob]]:
+    """
+    Stage every file of a zip or tar archive into `directory`, keyed by
+    basename, and return (manifest bytes if the archive carries one, staged files).
+
+    Blocking: run it in the thread pool. Members are read one at a time and
+    sizes are checked before extraction, so a large (or hostile) archive
+    never has to fit in memory; the number of files and their total size
+    are capped as well as each file's size.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    max_files = max_files or BULK_MAX_FILES
+    max_total_bytes = max_total_bytes or BULK_MAX_TOTAL_BYTES
+    os.makedirs(directory, exist_ok=True)
+    manifest = None
+    staged: Dict[str, StagedBlob] = {}
+    total_bytes = 0
+    try:
+        for name, declared_size, member in _archive_members(archive):
+            if name == MANIFEST_NAME:
+                manifest = member.read(MAX_UPLOAD_BYTES)
+                continue
+            if not name or name.startswith("."):
+                continue
+            if len(staged) >= max_files:
+                raise too_many_files(max_files)
+            remaining = max_total_bytes - total_bytes
+            if max_bytes <= remaining:
+                limit, too_large = max_bytes, upload_too_large(max_bytes)
+            else:
+                limit, too_large = remaining, batch_too_large(max_total_bytes)
+            if declared_size > limit:
+                raise too_large
+            if name in staged:
+                raise HTTPException(status_code=400, detail=f"Duplicate file name in archive: {name}")
+            staged[name] = _copy_to_staging(member, directory, limit, too_large)
+            total_bytes += staged[name].size
+    except BaseException:
+        for blob in staged.values():
+            os.unlink(blob.tmp_path)
+        raise
+    return manifest, staged
+
+
+async def reference_batch(db: AsyncSession, entries: List[BulkEntry], statuses: Dict[str, str]) -> List[BulkEntry]:
+    """
+    Prepare a batch of staged images for `record_batch` in a few statements:
+    one lookup of existing keys, then one upsert each for locations, users
+    and blob references (split only to stay within the bind parameter
+    limit). Keys that already exist are set to "exists" in `statuses`; the
+    other entries are returned, their files still to be placed.
+    """
+    if not entries:
+        return []
+
+    keys = [entry.image_key for entry in entries]
+    result = await db.execute(select(Image.image_key).where(Image.image_key.in_(keys)))
+    for key in result.scalars():
+        statuses[key] = "exists"
+    entries = [entry for entry in entries if entry.image_key not in statuses]
+    if not entries:
+        return []
+
+    # Referenced locations and users are created with placeholder details
+    # when missing, as POST /images does, in one statement per table.
+    location_ids = sorted({e.image_in.location_id for e in entries if e.image_in.location_id})
+    location_rows = [
+        {"id": location_id, "address": "Default Address", "country": "Default Country", "town": "Default Town"}
+        for location_id in location_ids
+    ]
+    for rows in parameter_batches(location_rows):
+        await db.execute(insert(Location).values(rows).on_conflict_do_nothing(index_elements=[Location.id]))
+    user_ids = sorted({e.image_in.user_id for e in entries if e.image_in.user_id})
+    user_rows = [
+        {"id": user_id, "first_name": "Default", "last_name": "User", "role": "default_role"}
+        for user_id in user_ids
+    ]
+    for rows in parameter_batches(user_rows):
+        await db.execute(insert(User).values(rows).on_conflict_do_nothing(index_elements=[User.id]))
+
+    # One reference per image. Rows are locked in hash order so concurrent
+    # batches sharing content cannot deadlock.
+    references = Counter(entry.blob.sha256 for entry in entries)
+    sizes = {entry.blob.sha256: entry.blob.size for entry in entries}
+    blob_rows = [
+        {"sha256": sha256, "size": sizes[sha256], "ref_count": references[sha256]}
+        for sha256 in sorted(references)
+    ]
+    for rows in parameter_batches(blob_rows):
+        blob_insert = insert(Blob).values(rows)
+        await db.execute(blob_insert.on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": Blob.ref_count + blob_insert.excluded.ref_count},
+        ))
+    return entries
+
+
+async def record_batch(
+    db: AsyncSession, entries: List[BulkEntry], change: int, statuses: Dict[str, str]
+) -> List[str]:
+    """
+    Insert referenced, placed `entries` (see `reference_batch`) and their
+    annotations as multi-row INSERT ... ON CONFLICT, stamped with `change`.
+
+    Sets each key's status ("created", or "exists" if a concurrent request
+    inserted it first) and returns the hashes whose last reference that
+    dropped, to remove once committed. Nothing is committed.
+    """
+    image_rows = [
+        {
+            "image_key": entry.image_key,
+            "client_id": entry.image_in.client_id,
+            "created_at": entry.image_in.created_at.replace(tzinfo=None),
+            "hardware_id": entry.image_in.hardware_id,
+            "ml_tag": entry.image_in.ml_tag.value if entry.image_in.ml_tag else None,
+            "location_id": entry.image_in.location_id,
+            "user_id": entry.image_in.user_id,
+            "content_hash": entry.blob.sha256,
+            "change_seq": change,
+        }
+        for entry in entries
+    ]
+    # Executed as multi-row VALUES pages (SQLAlchemy's insertmanyvalues).
+    result = await db.execute(
+        insert(Image).on_conflict_do_nothing(index_elements=[Image.image_key]).returning(Image.image_key),
+        image_rows,
+    )
+    created = set(result.scalars())
+
+    released = []
+    for entry in entries:
+        if entry.image_key in created:
+            statuses[entry.image_key] = "created"
+        else:
+            # Inserted by a concurrent request since the lookup
+            statuses[entry.image_key] = "exists"
+            if await release_blob(db, entry.blob.sha256):
+                released.append(entry.blob.sha256)
+
+    annotation_rows = [
+        {
+            "image_key": entry.image_key,
+            "index": ann.index,
+            "instrument": ann.instrument,
+            **polygon_columns(ann.polygon.points),
+            "change_seq": change,
+        }
+        for entry in entries
+        if entry.image_key in created
+        for ann in entry.image_in.annotations or []
+    ]
+    if annotation_rows:
+        await db.execute(insert(Annotation), annotation_rows)
+    return released
+
+
+def _has_duplicate_indexes(item: BulkImageItem) -> bool:
+    indexes = [ann.index for ann in item.annotations or []]
+    return len(indexes) != len(set(indexes))
+
+
+async def place_blobs(blob_store: BlobStore, blobs: List[StagedBlob]) -> None:
+    """Move staged files to their content addresses, a few at a time."""
+    semaphore = asyncio.Semaphore(BULK_PLACE_CONCURRENCY)
+
+    async def place(blob: StagedBlob) -> None:
+        async with semaphore:
+            await blob_store.place(blob)
+
+    await asyncio.gather(*(place(blob) for blob in blobs))
+
+
+async def ingest_batch(
+    db: AsyncSession,
+    blob_store: BlobStore,
+    items: List[BulkImageItem],
+    staged: Dict[str, StagedBlob],
+) -> List[BulkImageResult]:
+    """
+    Record manifest `items` against their staged files (keyed by filename)
+    and commit, returning one result per manifest item followed by one per
+    file the manifest does not mention. Files are matched by basename. All
+    staged files are consumed.
+    """
+    results: Dict[int, BulkImageResult] = {}
+    entries: List[BulkEntry] = []
+    seen_keys = set()
+    used_files = set()
+    try:
+        for position, item in enumerate(items):
+            image_key = os.path.basename(item.filename)
+            blob = staged.get(image_key)
+            if blob is None:
+                results[position] = BulkImageResult(
+                    filename=item.filename, status="error", detail="No file with this name in the batch."
+                )
+            elif image_key in seen_keys:
+                results[position] = BulkImageResult(
+                    filename=item.filename, image_key=image_key, status="error",
+                    detail="Image key appears more than once in the manifest.",
+                )
+            elif _has_duplicate_indexes(item):
+                results[position] = BulkImageResult(
+                    filename=item.filename, image_key=image_key, status="error",
+                    detail="Annotation index appears more than once for this image.",
+                )
+            else:
+                seen_keys.add(image_key)
+                used_files.add(image_key)
+                entries.append(BulkEntry(image_key=image_key, image_in=item, blob=blob))
+
+        statuses: Dict[str, str] = {}
+        placed: List[str] = []
+        try:
+            entries_new = await reference_batch(db, entries, statuses)
+            # Several images may share content: place each blob once.
+            to_place = {}
+            for entry in entries_new:
+                to_place.setdefault(entry.blob.sha256, entry.blob)
+            placed = list(to_place)
+            await place_blobs(blob_store, list(to_place.values()))
+
+            released = []
+            if entries_new:
+                # Taken after the uploads: the counter stays locked until commit
+                change = await next_change(db)
+                released = await record_batch(db, entries_new, change, statuses)
+                created_items = [entry.image_in for entry in entries_new if statuses[entry.image_key] == "created"]
+                await apply_stat_deltas(db, image_stat_deltas(created_items) + annotation_stat_deltas(
+                    ann.instrument for item in created_items for ann in item.annotations or []
+                ))
+            await db.commit()
+        except Exception:
+            # Nothing references the placed files: remove them again unless
+            # other images share them.
+            await db.rollback()
+            for sha256 in placed:
+                await discard_unreferenced_blob(db, blob_store, sha256)
+            raise
+        for sha256 in released:
+            await discard_unreferenced_blob(db, blob_store, sha256)
+    finally:
+        for blob in staged.values():
+            blob_store.discard(blob)
+
+    detail = {"exists": "Image key already exists.", "created": None}
+    entry_results = iter(entries)
+    ordered = []
+    for position, item in enumerate(items):
+        if position in results:
+            ordered.append(results[position])
+            continue
+        entry = next(entry_results)
+        status = statuses[entry.image_key]
+        ordered.append(BulkImageResult(
+            filename=item.filename, image_key=entry.image_key, status=status, detail=detail[status]
+        ))
+    for filename in staged:
+        if filename not in used_files:
+            ordered.append(BulkImageResult(filename=filename, status="error", detail="File is not in the manifest."))
+    return ordered
@@ -0,0 +1,209 @@
+# jobs.py
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Jobs one worker process runs at the same time.
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# Seconds an idle worker waits before looking for new jobs again.
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Seconds a claimed job may run before another worker may take it over
+# (its worker is presumed dead). Keep it well above the longest job.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Delay before the first retry of a failed job, doubled for each later one.
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+
+JobHandler = Callable[[dict], Awaitable[dict]]
+_handlers: Dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    """Register the coroutine running jobs of `kind`: params dict in, JSON result dict out."""
+    def register(fn: JobHandler) -> JobHandler:
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+async def enqueue_job(
+    db: AsyncSession, kind: str, params: dict, idempotency_key: Optional[str] = None
+) -> Tuple[Job, bool]:
+    """
+    Queue a job in the current transaction and return (job, created).
+
+    With an idempotency key already used, nothing is queued and the
+    existing job is returned instead; reusing a key for a different request
+    is rejected with 422.
+    """
+    stmt = insert(Job).values(
+        kind=kind, params=params, status="queued", idempotency_key=idempotency_key,
+        attempts=0, max_attempts=JOB_MAX_ATTEMPTS,
+    )
+    if idempotency_key is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Job.idempotency_key])
+    job_id = (await db.execute(stmt.returning(Job.id))).scalar_one_or_none()
+    if job_id is not None:
+        return await db.get(Job, job_id), True
+
+    job = (await db.execute(select(Job).where(Job.idempotency_key == idempotency_key))).scalar_one()
+    if job.kind != kind or job.params != params:
+        raise HTTPException(status_code=422, detail="This Idempotency-Key was already used for a different request.")
+    return job, False
+
+
+async def claim_jobs(db: AsyncSession, limit: int) -> List[Job]:
+    """
+    Take up to `limit` runnable jobs, oldest first, and commit.
+
+    Runnable means queued and due, or running past its lease with attempts
+    left. A job past its lease on its last attempt most likely took its
+    worker down with it (out of memory, say), so it is marked failed instead
+    of being run again. Rows another worker is claiming at the same moment
+    are skipped (SKIP LOCKED) rather than waited for, so any number of
+    workers can poll the same table.
+    """
+    now = func.now()
+    await db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.locked_until < now, Job.attempts >= Job.max_attempts)
+        .values(
+            status="failed", locked_until=None, finished_at=now,
+            error="Lease expired on the last attempt: the worker stopped while running the job.",
+        )
+        .execution_options(synchronize_session=False)
+    )
+    runnable = (
+        select(Job.id)
+        .where(or_(
+            and_(Job.status == "queued", Job.run_after <= now),
+            and_(Job.status == "running", Job.locked_until < now, Job.attempts < Job.max_attempts),
+        ))
+        .order_by(Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(Job)
+        .where(Job.id.in_(runnable.scalar_subquery()))
+        .values(
+            status="running",
+            attempts=Job.attempts + 1,
+            started_at=now,
+            locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+        )
+        .returning(Job)
+        .execution_options(synchronize_session=False)
+    )
+    jobs = sorted(result.scalars().all(), key=lambda job: job.id)
+    await db.commit()
+    return jobs
+
+
+def _claimed(job: Job):
+    # Only the worker holding the current claim may record the outcome
+    return (Job.id == job.id) & (Job.status == "running") & (Job.attempts == job.attempts)
+
+
+async def complete_job(db: AsyncSession, job: Job, result: dict) -> None:
+    await db.execute(
+        update(Job).where(_claimed(job))
+        .values(status="succeeded", result=result, error=None, locked_until=None, finished_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def fail_job(db: AsyncSession, job: Job, error: str, retry: bool = True) -> None:
+    """Queue the job again after a backoff delay, or mark it failed once out of attempts."""
+    if retry and job.attempts < job.max_attempts:
+        delay = timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+        values = {"status": "queued", "run_after": func.now() + delay}
+    else:
+        values = {"status": "failed", "finished_at": func.now()}
+    await db.execute(
+        update(Job).where(_claimed(job))
+        .values(error=error, locked_until=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+class JobWorker:
+    """
+    Runs queued jobs, at most `concurrency` at a time, each with its own
+    session. Workers coordinate only through the job table, so they scale
+    out by starting more processes (python -m app.worker).
+    """
+
+    def __init__(self, session_factory, concurrency: int = JOB_WORKER_CONCURRENCY,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.completed = 0
+        self.failed = 0
+
+    async def run_job(self, job: Job) -> None:
+        handler = _handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise HTTPException(status_code=400, detail=f"No handler for job kind {job.kind!r}.")
+            result = await handler(job.params)
+        except Exception as e:
+            # Client errors (unknown image, bad parameters) will not go away on retry
+            retry = not (isinstance(e, HTTPException) and e.status_code < 500)
+            detail = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+            logger.warning("Job %s (%s) attempt %s failed: %s", job.id, job.kind, job.attempts, detail)
+            self.failed += 1
+            async with self.session_factory() as db:
+                await fail_job(db, job, str(detail), retry=retry)
+            return
+        self.completed += 1
+        async with self.session_factory() as db:
+            await complete_job(db, job, result)
+
+    async def run_once(self) -> int:
+        """Claim up to `concurrency` jobs, run them concurrently, and return how many ran."""
+        async with self.session_factory() as db:
+            jobs = await claim_jobs(db, self.concurrency)
+        await asyncio.gather(*(self.run_job(job) for job in jobs))
+        return len(jobs)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Keep every slot busy until `stop` is set, then let running jobs finish."""
+        running: Set[asyncio.Task] = set()
+        while not stop.is_set():
+            free = self.concurrency - len(running)
+            claimed = []
+            if free > 0:
+                try:
+                    async with self.session_factory() as db:
+                        claimed = await claim_jobs(db, free)
+                except Exception as e:
+                    logger.warning("Claiming jobs failed: %s", e)
+                for job in claimed:
+                    task = asyncio.create_task(self.run_job(job))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+            if claimed and len(running) < self.concurrency:
+                continue  # More may be waiting
+            # Wait for a free slot, a poll interval, or the stop signal
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait(
+                running | {stopping}, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED
+            )
+            stopping.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
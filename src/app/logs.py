@@ -0,0 +1,247 @@
+# logs.py
+"""
+Logging setup: one JSON object per line on stdout, written by a background
+thread. Loggers only put records on a queue (QueueHandler), so a request
+never waits for stdout or CloudWatch; a QueueListener formats and writes
+them.
+
+Every record carries the ID of the request it was logged in (taken from
+an X-Request-ID header, the Lambda request ID, or generated), which is
+also returned in the X-Request-ID response header. SQL statements are
+logged for a sample of executions and always when slow, instead of
+SQLAlchemy's echo.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger overrides, e.g. "app.jobs=DEBUG,uvicorn.access=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json" for log collectors, "text" for reading in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# One line per request (method, route, status, duration) on the app.access logger.
+LOG_ACCESS = os.getenv("LOG_ACCESS", "true").lower() in ("1", "true", "yes")
+# Fraction of SQL statements logged (0 to 1); DB_ECHO=true logs them all.
+SQL_LOG_SAMPLE_RATE = float(os.getenv(
+    "SQL_LOG_SAMPLE_RATE",
+    "1" if os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes") else "0",
+))
+# Statements slower than this (ms) are always logged, as warnings (0 = never).
+SQL_LOG_SLOW_MS = float(os.getenv("SQL_LOG_SLOW_MS", "500"))
+REQUEST_ID_HEADER = "x-request-id"
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+sql_logger = logging.getLogger("app.sql")
+access_logger = logging.getLogger("app.access")
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request's ID, in the thread that logs them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s",
+                         datefmt="%Y-%m-%d %H:%M:%S")
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the listener with their message and traceback already
+    rendered (arguments and exceptions may not survive until it gets to
+    them), but leave the layout to the listener's formatter.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue: "Optional[queue.Queue]" = None
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level: str = LOG_LEVEL, levels: str = LOG_LEVELS, log_format: str = LOG_FORMAT) -> None:
+    """
+    Route every logger through a queue to one stdout writer thread.
+
+    Replaces the root logger's handlers (including those the Lambda runtime
+    installs) and can be called again to change the settings.
+    """
+    global _listener, _queue
+    stop_logging()
+    _queue = queue.Queue(-1)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(_queue, output)
+    _listener.start()
+
+    handler = _QueueHandler(_queue)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, logger_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+    # SQLAlchemy's own echo output is replaced by instrument_sql_logging
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+    if SQL_LOG_SAMPLE_RATE > 0 and sql_logger.getEffectiveLevel() > logging.INFO:
+        sql_logger.setLevel(logging.INFO)
+
+
+def flush_logs() -> None:
+    """Wait until every queued record has been written (end of a Lambda invocation)."""
+    if _queue is not None and _listener is not None:
+        _queue.join()
+
+
+def stop_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # Writes what is still queued
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["log_query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("log_query_started", None)
+    if started is None:
+        return
+    ms = (time.perf_counter() - started) * 1000
+    if 0 < SQL_LOG_SLOW_MS <= ms:
+        sql_logger.warning("Slow SQL statement", extra={"statement": statement, "duration_ms": round(ms, 2)})
+    elif SQL_LOG_SAMPLE_RATE > 0 and random.random() < SQL_LOG_SAMPLE_RATE:
+        sql_logger.info("SQL statement", extra={"statement": statement, "duration_ms": round(ms, 2)})
+
+
+def instrument_sql_logging(engine) -> None:
+    """Log sampled and slow statements run through `engine` (an AsyncEngine or Engine)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _request_id_for(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == REQUEST_ID_HEADER.encode():
+            candidate = value.decode("latin-1")
+            if _VALID_REQUEST_ID.match(candidate):
+                return candidate
+            break
+    # Under Mangum, the Lambda context's request ID ties logs to the invocation
+    context = scope.get("aws.context")
+    aws_request_id = getattr(context, "aws_request_id", None)
+    return aws_request_id or uuid.uuid4().hex
+
+
+class RequestIdMiddleware:
+    """
+    Give each request an ID for its log records, returned as X-Request-ID,
+    and log one access line per request when LOG_ACCESS is on.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _request_id_for(scope)
+        token = _request_id.set(request_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def id_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, id_send)
+        finally:
+            if LOG_ACCESS:
+                route = scope.get("route")
+                access_logger.info(
+                    "%s %s %s", scope["method"], scope["path"], status,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "route": getattr(route, "path", None),
+                        "status": status,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    },
+                )
+            _request_id.reset(token)
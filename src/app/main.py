@@ -1,31 +1,77 @@
 # main.py
+# First, so the startup profile covers every import below
+from .startup import STARTUP_PROFILE, profile as startup_profile
+
 from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
-from fastapi import Request
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse, RedirectResponse, PlainTextResponse
+from fastapi import Request, Response
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from collections import Counter
+from typing import List, Literal, NamedTuple, Optional, Tuple
 from datetime import datetime
 from sqlalchemy.orm import selectinload
-from PIL import Image as PILImage
-from sqlalchemy import select
-from io import BytesIO
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from starlette.concurrency import run_in_threadpool
+import base64
+import hashlib
+import mimetypes
 import os
+import tempfile
+from urllib.parse import quote, urlencode
 import logging
 import json
 
-from .database import engine, get_session
-from .models import Base, Image, Annotation, Location, User
+from .database import (
+    async_session, get_session, get_read_session, session_factory_for, pool_stats, ReadYourWritesMiddleware,
+    parameter_batches, wrote_recently,
+)
+from .models import Image, ImageVersion, Annotation, Job, Location, User, annotation_box
+from .geometry import POLYGON_COLUMNS, polygon_columns, unpack_points
+from .derivatives import (
+    DERIVATIVE_FORMATS, DiskLRUCache, QualityTier, can_encode, derivative_key, make_thumbnail,
+    negotiate_format, parse_quality_tiers, transcode_image, transform_image,
+)
+from .cache import cache_from_env
+from .changes import current_change, load_changes, next_change, record_tombstones, weak_etag
+from .trays import TrayIndexCache
+from .tray_models import (
+    VendorTrayManufacturer, VendorTrayManufacturerCreate, VendorTrayManufacturerRead,
+    TrayInstrumentMatch, TrayResolution,
+)
+from .stats import (
+    IMAGE_DIMENSIONS, annotation_stat_deltas, apply_stat_deltas, image_stat_deltas,
+    load_summary, stat_key,
+)
+from .schema import DB_CREATE_SCHEMA, create_schema
+from .image_pool import ImagePool, server_timing
+from .jobs import enqueue_job, job_handler
+from .logs import RequestIdMiddleware, configure_logging, flush_logs
+from .metrics import METRICS_ENABLED, GaugeFunction, MetricsMiddleware, registry as metrics_registry, setup_tracing
+from .ingest import BULK_MAX_FILES, ingest_batch, parse_manifest, stage_archive, too_many_files
+from .storage import (
+    BlobStore, StagedBlob, acquire_blob, discard_unreferenced_blob, release_blob, storage_from_env,
+)
+from .responses import SendfileResponse
+from .uploads import UploadSizeLimitMiddleware
 from app.schemas import (
     ImageCreate, ImageRead,
     AnnotationCreate, AnnotationRead,
-    ImageFilter, AnnotationUpdateRequest
+    ImageFilter, AnnotationUpdateRequest,
+    ImageVersionRead, BulkIngestResponse, ImageChangesResponse,
+    AnnotationBatchRequest, AnnotationBatchResult,
+    AnnotationMatch, AnnotationSearch, JobRead,
+    GroupCount, StatsSummary, InstrumentStats
 )
 
 from mangum import Mangum
 
+startup_profile.mark("imports")
 
 
 app = FastAPI(
@@ -36,12 +82,8 @@ app = FastAPI(
 )
 
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,  # Set the logging level (INFO, DEBUG, etc.)
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Configure logging: JSON lines written off the request path (see logs.py)
+configure_logging()
 
 # Create a logger instance for this module
 logger = logging.getLogger(__name__)
@@ -60,15 +102,80 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Location", "Content-Location", "X-Request-ID"],
 )
 
+# Reject oversized uploads before the multipart body is buffered
+app.add_middleware(UploadSizeLimitMiddleware)
+# Keep a client's reads on the writer for a moment after it writes
+app.add_middleware(ReadYourWritesMiddleware)
+# Wraps every middleware above, so request timings include them
+app.add_middleware(MetricsMiddleware)
+# Outermost (added last), so every log record of a request carries its ID,
+# metrics warnings included; its own work is outside the timings
+app.add_middleware(RequestIdMiddleware)
+
 
 # 1) Serve your backend uploads/static
 BASE_DIR = os.path.dirname(__file__)
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOAD_DIR = os.path.join(STATIC_DIR, "images")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
+# Uploaded images are stored content-addressed (sharded by SHA-256) in the
+# backend selected by STORAGE_BACKEND: UPLOAD_DIR locally, or S3 under Lambda.
+storage = storage_from_env(UPLOAD_DIR)
+blob_store = BlobStore(storage)
+
+# Thumbnails and other derivatives, cached on local disk (under /tmp by
+# default so it also works on Lambda) up to a size budget.
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "scalpel-derivatives"))
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+derivative_cache = DiskLRUCache(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES)
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "2048"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+# Formats /static/images may transcode to when the Accept header lists them,
+# most preferred first (those this Pillow build cannot write are skipped).
+IMAGE_NEGOTIATE_FORMATS = [name.strip() for name in os.getenv("IMAGE_NEGOTIATE_FORMATS", "avif,webp").split(",")
+                           if name.strip() in DERIVATIVE_FORMATS]
+# Scale and quality of the served image per ?tier=, as for PUT /images/{key}/file
+IMAGE_QUALITY_TIERS = parse_quality_tiers(os.getenv("IMAGE_QUALITY_TIERS", "full=1:80,preview=0.5:75,low=0.25:60"))
+IMAGE_DEFAULT_TIER = os.getenv("IMAGE_DEFAULT_TIER", "full")
+# Responses addressed by content (a hash in the URL) never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Pillow work (resizes, thumbnails) runs here rather than on the event loop
+image_pool = ImagePool()
+# "async": PUT /images/{key}/file queues new transforms as background jobs
+# (run by python -m app.worker) and answers 202; "sync" computes them in the
+# request. Lambda has no worker, so it defaults to sync there.
+IMAGE_TRANSFORM_MODE = os.getenv(
+    "IMAGE_TRANSFORM_MODE", "sync" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "async"
+)
+
+# Serialised image list pages, annotations and versions (see cached_read_key)
+read_cache = cache_from_env()
+
+# Per-tray instrument/alias lookup indexes, rebuilt when a tray's version changes
+tray_indexes = TrayIndexCache()
+
+# Pool and cache state, read when /metrics is scraped
+metrics_registry.register(GaugeFunction(
+    "image_pool_pending", "Image pool jobs queued or running.", lambda: image_pool.pending,
+))
+metrics_registry.register(GaugeFunction(
+    "db_pool_checked_out", "Writer connections checked out of the pool.",
+    lambda: pool_stats().get("checked_out"),
+))
+
+# Keyset pagination for GET /images
+DEFAULT_PAGE_SIZE = int(os.getenv("IMAGES_DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("IMAGES_MAX_PAGE_SIZE", "500"))
+# Most annotations changed by one POST /annotations/batch (upserts + deletes)
+ANNOTATION_BATCH_MAX = int(os.getenv("ANNOTATION_BATCH_MAX", "5000"))
+# Page size of GET /annotations/search
+ANNOTATION_SEARCH_MAX = int(os.getenv("ANNOTATION_SEARCH_MAX", "1000"))
+# Rows fetched per round trip by the streaming export cursor
+EXPORT_BATCH_SIZE = int(os.getenv("IMAGES_EXPORT_BATCH_SIZE", "1000"))
 
 
 
@@ -79,26 +186,67 @@ app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), na
 
 @app.on_event("startup")
 async def startup_event():
-    logger.info("Starting up the application and creating tables...")
     """
-    Create tables at startup (not recommended for production,
-    but convenient for a coding challenge).
+    Create tables at startup when DB_CREATE_SCHEMA is on (the default
+    outside Lambda). Production runs python -m app.schema at deploy
+    instead, keeping schema work off every cold start.
+    """
+    setup_tracing()
+    if DB_CREATE_SCHEMA:
+        logger.info("Starting up the application and creating tables...")
+        await create_schema()
+        startup_profile.mark("schema")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    image_pool.shutdown()
+
+
+
+class SavedUpload(NamedTuple):
+    image_key: str
+    blob: StagedBlob
+
+
+async def save_upload_file(upload_file: UploadFile) -> SavedUpload:
+    # Stream the file into the blob store (static/images), hashed on the way
+    # through and off the event loop. It is placed at its content address
+    # once the database records the reference (see create_image).
+    image_key = os.path.basename(upload_file.filename)
+    staged = await blob_store.stage_upload(upload_file)
+    return SavedUpload(image_key=image_key, blob=staged)
+
+
+def cached_read_key(request: Request, name: str, change: int, detail: str) -> Optional[str]:
+    """
+    Read cache key for a response built from the state at `change`: the
+    change counter read in the same session, before the response's rows.
+    Returns None (bypass the cache) for clients that have just written.
+
+    A replica that lags behind a write can then only fill the entry of the
+    older state it actually read, never the one later readers look up, and
+    since every write takes a new counter value nothing has to be
+    invalidated. Recent writers read from the writer and skip the cache.
     """
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if wrote_recently(request):
+        return None
+    return f"{name}:{change}:{detail}"
 
-print("Starting up the application and creating tables...")
 
+def original_storage_key(image: Image) -> str:
+    """Resolve the storage key holding an image's pristine original."""
+    if image.content_hash:
+        return blob_store.key(image.content_hash)
+    # Legacy images were stored flat under their filename
+    return image.image_key
 
 
-async def save_upload_file(upload_file: UploadFile) -> str:
-    # Save file in the UPLOAD_DIR (i.e., static/images)
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    file_location = os.path.join(UPLOAD_DIR, upload_file.filename)
-    with open(file_location, "wb") as file_object:
-        file_object.write(await upload_file.read())
-    # Return the URL path for the file so clients can access it via /static
-    return upload_file.filename
+def image_storage_key(image: Image) -> str:
+    """Resolve the storage key holding the bytes currently served for an image."""
+    if image.current_version:
+        return blob_store.key(image.current_version.content_hash)
+    return original_storage_key(image)
 
 
 # @app.get("/{full_path:path}")
@@ -135,6 +283,44 @@ async def health() -> dict:
     return {"status": "working"}
 
 
+@app.get("/health/image-pool", tags=["Health"])
+async def image_pool_health() -> dict:
+    """Load and per-job timing (queue wait, transform time) of the image pool."""
+    return image_pool.stats()
+
+
+@app.get("/health/cache", tags=["Health"])
+async def cache_health() -> dict:
+    """Hit/miss counters of the read cache."""
+    return read_cache.stats()
+
+
+@app.get("/health/db-pool", tags=["Health"])
+async def db_pool_health() -> dict:
+    """Engine profile, connection checkout wait times and pool saturation."""
+    return pool_stats()
+
+
+@app.get("/health/startup", tags=["Health"])
+async def startup_health() -> dict:
+    """How long this process took to start, by phase (and by import with STARTUP_PROFILE=1)."""
+    return startup_profile.report()
+
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics():
+    """Request latency, SQL and image pool metrics of this process, in the Prometheus text format."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/health/tray-index", tags=["Health"])
+async def tray_index_health() -> dict:
+    """Cached tray lookup indexes, lookups served from them and rebuilds."""
+    return tray_indexes.stats()
+
+
 # {
 #         "image_key": "3af9d8da-c689-48f5-bd87-afbfc999e590",  
 #         "client_id": "client01",
@@ -172,21 +358,17 @@ async def create_image(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error parsing image form data: {str(e)}")
     
-    # Save the uploaded file and get the file location to use as image_key
-    try:
-        image_key = await save_upload_file(image_file)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error saving image file: {str(e)}")
-    
+    # The key is the client's filename; check it before touching storage so
+    # an existing image is never overwritten.
+    image_key = os.path.basename(image_file.filename)
+    existing_image = await db.get(Image, image_key)
+    if existing_image:
+        raise HTTPException(status_code=409, detail="Image key already exists.")
+
     # Update the image data with the new image_key.
     # Using .copy(update={...}) ensures immutability is preserved.
     image_in = image_in.copy(update={"image_key": image_key})
     
-    # Optional: Check if an image with the same key already exists.
-    existing_image = await db.get(Image, image_in.image_key)
-    if existing_image:
-        raise HTTPException(status_code=400, detail="Image key already exists.")
-    
     # If a location_id is provided, ensure the location exists or create it.
     if image_in.location_id:
         location = await db.get(Location, image_in.location_id)
@@ -216,36 +398,124 @@ async def create_image(
             # Alternatively, uncomment the following line to raise an error instead:
             # raise HTTPException(status_code=400, detail="User does not exist. Please create the user first.")
     
-    # Create the new Image ORM instance using the data from the Pydantic model.
-    new_image = Image(
-        image_key=image_in.image_key,
-        client_id=image_in.client_id,
-        created_at=image_in.created_at.replace(tzinfo=None),
-        hardware_id=image_in.hardware_id,
-        ml_tag=image_in.ml_tag.value if image_in.ml_tag else None,
-        location_id=image_in.location_id,
-        user_id=image_in.user_id,
-    )
-    
-    # If there are annotations provided, add them to the image.
-    if image_in.annotations:
-        for ann in image_in.annotations:
-            annotation = Annotation(
-                image_key=image_in.image_key,
-                index=ann.index,
-                instrument=ann.instrument,
-                polygon=ann.polygon.dict()  # Convert Polygon to dict for JSON storage
-            )
-            new_image.annotations.append(annotation)
+    # Save the uploaded file (hashed into a staging file in the blob store)
+    try:
+        saved = await save_upload_file(image_file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error saving image file: {str(e)}")
+
+    # Reference the blob, then move the staged file to its content address
+    # (a no-op apart from the hash when the same bytes are already stored).
+    # The change counter comes after both, so no writer waits on the move.
+    try:
+        await acquire_blob(db, saved.blob.sha256, saved.blob.size)
+        await blob_store.place(saved.blob)
+
+        # Create the new Image ORM instance using the data from the Pydantic model.
+        change = await next_change(db)
+        new_image = Image(
+            image_key=image_in.image_key,
+            client_id=image_in.client_id,
+            created_at=image_in.created_at.replace(tzinfo=None),
+            hardware_id=image_in.hardware_id,
+            ml_tag=image_in.ml_tag.value if image_in.ml_tag else None,
+            location_id=image_in.location_id,
+            user_id=image_in.user_id,
+            content_hash=saved.blob.sha256,
+            change_seq=change,
+        )
     
-    db.add(new_image)
-    await db.commit()
+        # If there are annotations provided, add them to the image.
+        if image_in.annotations:
+            for ann in image_in.annotations:
+                annotation = Annotation(
+                    image_key=image_in.image_key,
+                    index=ann.index,
+                    instrument=ann.instrument,
+                    **polygon_columns(ann.polygon.points),  # JSON or packed, per POLYGON_STORAGE
+                    change_seq=change,
+                )
+                new_image.annotations.append(annotation)
+
+        await apply_stat_deltas(db, image_stat_deltas([new_image]) + annotation_stat_deltas(
+            ann.instrument for ann in new_image.annotations
+        ))
+        db.add(new_image)
+        await db.commit()
+    except Exception as e:
+        # Nothing references the file until the image commits: remove it
+        # again unless other images share it.
+        await db.rollback()
+        await discard_unreferenced_blob(db, blob_store, saved.blob.sha256)
+        if isinstance(e, IntegrityError) and await db.get(Image, image_key):
+            # Created concurrently since the check above
+            raise HTTPException(status_code=409, detail="Image key already exists.")
+        raise
+    finally:
+        blob_store.discard(saved.blob)
+
     # Optionally refresh if needed: await db.refresh(new_image)
     return new_image
 
 
 
 
+@app.post("/images/bulk", response_model=BulkIngestResponse)
+async def bulk_create_images(
+    manifest: Optional[str] = Form(None),
+    image_files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Create many images in one request.
+
+    Send the files either as repeated `image_files` parts or as one zip/tar
+    `archive`, plus a `manifest`: a JSON array of image forms (as for
+    POST /images) with the `filename` of each image's file. An archive may
+    carry the manifest itself as `manifest.json`. The batch is recorded with
+    a fixed number of statements, and each item is reported as created,
+    already existing, or rejected.
+    """
+    if (archive is None) == (not image_files):
+        raise HTTPException(status_code=400, detail="Send either image_files or an archive.")
+    items = parse_manifest(manifest) if manifest is not None else None
+
+    staged = {}
+    try:
+        if archive is not None:
+            archive_manifest, staged = await run_in_threadpool(
+                stage_archive, archive.file, blob_store.backend.staging_dir
+            )
+            if items is None and archive_manifest is not None:
+                items = parse_manifest(archive_manifest)
+        else:
+            for upload in image_files:
+                name = os.path.basename(upload.filename)
+                if name in staged:
+                    raise HTTPException(status_code=400, detail=f"Duplicate file name in batch: {name}")
+                if len(staged) >= BULK_MAX_FILES:
+                    raise too_many_files(BULK_MAX_FILES)
+                staged[name] = await blob_store.stage_upload(upload)
+        if items is None:
+            raise HTTPException(status_code=400, detail="A manifest is required.")
+    except BaseException:
+        for blob in staged.values():
+            blob_store.discard(blob)
+        raise
+
+    results = await ingest_batch(db, blob_store, items, staged)
+    return BulkIngestResponse(
+        created=sum(r.status == "created" for r in results),
+        existing=sum(r.status == "exists" for r in results),
+        failed=sum(r.status == "error" for r in results),
+        results=results,
+    )
+
+
+
 
 # 2. Create a new annotation for a given image
 
@@ -288,8 +558,10 @@ async def create_annotation(
         image_key=image_key,
         index=annotation_in.index,
         instrument=annotation_in.instrument,
-        polygon=annotation_in.polygon.dict()  # Convert Polygon to dict for JSON storage
+        **polygon_columns(annotation_in.polygon.points),  # JSON or packed, per POLYGON_STORAGE
+        change_seq=await next_change(db),
     )
+    await apply_stat_deltas(db, annotation_stat_deltas([new_annotation.instrument]))
     db.add(new_annotation)
     await db.commit()
     await db.refresh(new_annotation)
@@ -308,46 +580,523 @@ async def update_annotation(
     image_key = image_key.split("/static/images/")[-1]
 
 
-    print("Updating annotation...", image_key, annotation_index)
-    logging.info(f"Updating annotation: {image_key}, {annotation_index}")
+    logger.debug("Updating annotation %s of %s", annotation_index, image_key)
 
     annotation = await db.get(Annotation, (image_key, annotation_index))
     if not annotation:
         raise HTTPException(status_code=404, detail="Annotation not found.")
 
+    # Counter first: autoflush would otherwise lock the annotation row before it
+    change = await next_change(db)
+    previous_instrument = annotation.instrument
     annotation.instrument = annotation_update.instrument
-    annotation.polygon = annotation_update.polygon.dict()  # Convert Polygon to dict for JSON storage
+    for column, value in polygon_columns(annotation_update.polygon.points).items():
+        setattr(annotation, column, value)  # JSON or packed, per POLYGON_STORAGE
+    annotation.change_seq = change
+    # A Counter subtraction would drop the negative side, so combine with update
+    deltas = annotation_stat_deltas([annotation.instrument])
+    deltas.update(annotation_stat_deltas([previous_instrument], sign=-1))
+    await apply_stat_deltas(db, deltas)
     db.add(annotation)
     await db.commit()
     await db.refresh(annotation)
     return annotation
 
 
-@app.get("/images")
-async def list_images(db: AsyncSession = Depends(get_session)):
-    """Retrieve all images and dynamically reconstruct full image paths."""
-    query = select(Image).options(selectinload(Image.annotations))
+@app.post("/annotations/batch", response_model=AnnotationBatchResult)
+async def batch_annotations(
+    batch: AnnotationBatchRequest,
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Upsert and delete many annotations, across any number of images, in one
+    transaction.
+
+    Deletes run first, as a single DELETE ... RETURNING; upserts are then
+    written with INSERT ... ON CONFLICT DO UPDATE ... RETURNING (one
+    statement per few thousand rows, within the bind parameter limit), so
+    the stored rows come back without a refresh per annotation. Deleting an
+    annotation that does not exist is not an error: `deleted` lists what
+    was actually removed. The batch is rejected as a whole if it names an
+    unknown image or repeats an annotation.
+    """
+    if len(batch.upsert) + len(batch.delete) > ANNOTATION_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"A batch may change at most {ANNOTATION_BATCH_MAX} annotations.")
+
+    upserts = [ann.model_copy(update={"image_key": ann.image_key.split("/static/images/")[-1]}) for ann in batch.upsert]
+    deletes = [(key.image_key.split("/static/images/")[-1], key.index) for key in batch.delete]
+    upsert_keys = [(ann.image_key, ann.index) for ann in upserts]
+    # One statement cannot update the same row twice
+    if len(set(upsert_keys)) != len(upsert_keys) or len(set(deletes)) != len(deletes):
+        raise HTTPException(status_code=400, detail="Each annotation may appear at most once per operation.")
+
+    image_keys = {key for key, _ in upsert_keys} | {key for key, _ in deletes}
+    if image_keys:
+        result = await db.execute(select(Image.image_key).where(Image.image_key.in_(image_keys)))
+        missing = image_keys - set(result.scalars())
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Images not found: {', '.join(sorted(missing))}")
+
+    change = await next_change(db)
+    stat_deltas = Counter()
+    deleted = []
+    if deletes:
+        result = await db.execute(
+            delete(Annotation)
+            .where(tuple_(Annotation.image_key, Annotation.index).in_(deletes))
+            .returning(Annotation.image_key, Annotation.index, Annotation.instrument)
+        )
+        rows = result.all()
+        deleted = [{"image_key": row.image_key, "index": row.index} for row in rows]
+        stat_deltas.update(annotation_stat_deltas((row.instrument for row in rows), sign=-1))
+        await record_tombstones(db, change, annotation_keys=[(d["image_key"], d["index"]) for d in deleted])
+
+    upserted = []
+    if upserts:
+        # Instruments the upserts replace (stable: the counter lock is held)
+        result = await db.execute(
+            select(Annotation.instrument).where(tuple_(Annotation.image_key, Annotation.index).in_(upsert_keys))
+        )
+        stat_deltas.update(annotation_stat_deltas(result.scalars(), sign=-1))
+        stat_deltas.update(annotation_stat_deltas(ann.instrument for ann in upserts))
+        upsert_rows = [
+            {
+                "image_key": ann.image_key,
+                "index": ann.index,
+                "instrument": ann.instrument,
+                **polygon_columns(ann.polygon.points),  # JSON or packed, per POLYGON_STORAGE
+                "change_seq": change,
+            }
+            for ann in upserts
+        ]
+        # Split only as far as the bind parameter limit requires
+        for rows in parameter_batches(upsert_rows):
+            stmt = pg_insert(Annotation).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Annotation.image_key, Annotation.index],
+                set_={
+                    "instrument": stmt.excluded.instrument,
+                    **{column: stmt.excluded[column] for column in POLYGON_COLUMNS},
+                    "change_seq": stmt.excluded.change_seq,
+                    "updated_at": func.now(),
+                },
+            ).returning(
+                Annotation.image_key, Annotation.index, Annotation.instrument,
+                Annotation.polygon, Annotation.polygon_packed,
+            )
+            result = await db.execute(stmt)
+            upserted.extend(row._asdict() for row in result)
+
+    await apply_stat_deltas(db, stat_deltas)
+    await db.commit()
+    return AnnotationBatchResult(upserted=upserted, deleted=deleted)
+
+
+
+@app.get("/annotations/search", response_model=List[AnnotationMatch])
+async def search_annotations(
+    search: AnnotationSearch = Depends(),
+    limit: int = Query(100, ge=1, le=ANNOTATION_SEARCH_MAX, description="Most annotations returned"),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Find annotations by instrument, by bounding-box overlap with a region
+    (min_x, min_y, max_x, max_y) and by area range.
 
-    results = await db.execute(query.distinct())
-    images = results.scalars().unique().all()
+    Every filter runs against precomputed columns: instrument and area use
+    B-tree indexes, the region the GiST index on the bounding box, so no
+    polygon is decoded to answer the query.
+    """
+    region = (search.min_x, search.min_y, search.max_x, search.max_y)
+    if any(v is not None for v in region) and any(v is None for v in region):
+        raise HTTPException(status_code=400, detail="A region needs all of min_x, min_y, max_x and max_y.")
+
+    query = select(Annotation)
+    if search.instrument:
+        query = query.where(Annotation.instrument == search.instrument)
+    if search.min_area is not None:
+        query = query.where(Annotation.area >= search.min_area)
+    if search.max_area is not None:
+        query = query.where(Annotation.area <= search.max_area)
+    if region[0] is not None:
+        query = query.where(annotation_box().op("&&")(
+            func.box(func.point(search.min_x, search.min_y), func.point(search.max_x, search.max_y))
+        ))
+    query = query.order_by(Annotation.image_key, Annotation.index).limit(limit)
+
+    result = await db.execute(query)
+    return [AnnotationMatch.model_validate(annotation) for annotation in result.scalars().all()]
+
+
+@app.get("/stats/summary", response_model=StatsSummary)
+async def stats_summary(db: AsyncSession = Depends(get_read_session)):
+    """
+    Image counts per client, ML tag, hardware, location and user, and
+    annotation counts per instrument, for the whole catalogue.
 
-    # Modify each image to include the full URL dynamically
-    for image in images:
-        image.image_key = f"/static/images/{image.image_key}"  # ✅ Convert stored filename to full URL
+    Read from the summary table every write keeps current, so this is one
+    small query whatever the size of the catalogue.
+    """
+    summary = await load_summary(db)
+    return StatsSummary(
+        images=sum(summary.get("client_id", {}).values()),
+        dimensions={
+            dimension: [GroupCount(key=key, count=count) for key, count in counts.items()]
+            for dimension, counts in summary.items()
+        },
+    )
 
-    return images  # FastAPI automatically converts this to JSON
+
+@app.get("/stats/images", response_model=List[GroupCount])
+async def image_stats(
+    group_by: Literal[IMAGE_DIMENSIONS] = Query(..., description="Image column to count images by"),
+    filters: ImageFilter = Depends(),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Image counts per value of `group_by`, largest first. Without filters
+    they come from the summary table; filtered counts run as one GROUP BY.
+    """
+    if not filters.model_dump(exclude_none=True):
+        counts = (await load_summary(db)).get(group_by, {})
+        return [GroupCount(key=key, count=count) for key, count in counts.items()]
+
+    column = getattr(Image, group_by)
+    count = func.count().label("count")
+    query = apply_image_filter(select(column, count), filters).group_by(column).order_by(count.desc(), column)
+    result = await db.execute(query)
+    return [GroupCount(key=stat_key(key) or None, count=n) for key, n in result]
+
+
+@app.get("/stats/instruments", response_model=List[InstrumentStats])
+async def instrument_stats(
+    filters: ImageFilter = Depends(),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Per instrument: annotations, distinct images annotated and total
+    annotated area, over the images matching the filters, as one GROUP BY.
+    """
+    annotations = func.count().label("annotations")
+    query = apply_image_filter(
+        select(
+            Annotation.instrument,
+            annotations,
+            func.count(func.distinct(Annotation.image_key)).label("images"),
+            func.coalesce(func.sum(Annotation.area), 0.0).label("total_area"),
+        ).join(Image, Image.image_key == Annotation.image_key),
+        filters,
+    ).group_by(Annotation.instrument).order_by(annotations.desc(), Annotation.instrument)
+    result = await db.execute(query)
+    return [InstrumentStats.model_validate(row, from_attributes=True) for row in result]
+
+
+@app.post("/trays", response_model=VendorTrayManufacturerRead)
+async def create_tray(tray_in: VendorTrayManufacturerCreate, db: AsyncSession = Depends(get_session)):
+    if await db.get(VendorTrayManufacturer, tray_in.type):
+        raise HTTPException(status_code=409, detail="Tray type already exists.")
+    tray = VendorTrayManufacturer(**tray_in.model_dump())
+    db.add(tray)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Created concurrently since the check above
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Tray type already exists.")
+    return tray
 
 
+@app.get("/trays", response_model=List[VendorTrayManufacturerRead])
+async def list_trays(db: AsyncSession = Depends(get_read_session)):
+    result = await db.execute(select(VendorTrayManufacturer).order_by(VendorTrayManufacturer.type))
+    return result.scalars().all()
+
+
+@app.get("/trays/{tray_type}", response_model=VendorTrayManufacturerRead)
+async def get_tray(tray_type: str, db: AsyncSession = Depends(get_read_session)):
+    tray = await db.get(VendorTrayManufacturer, tray_type)
+    if not tray:
+        raise HTTPException(status_code=404, detail="Tray not found.")
+    return tray
+
+
+@app.put("/trays/{tray_type}", response_model=VendorTrayManufacturerRead)
+async def update_tray(
+    tray_type: str,
+    tray_in: VendorTrayManufacturerCreate,
+    db: AsyncSession = Depends(get_session)
+):
+    """Replace a tray's details. Its version goes up, so every cached lookup index is rebuilt."""
+    if tray_in.type != tray_type:
+        raise HTTPException(status_code=400, detail="The tray type cannot be changed.")
+    tray = await db.get(VendorTrayManufacturer, tray_type)
+    if not tray:
+        raise HTTPException(status_code=404, detail="Tray not found.")
+    for column, value in tray_in.model_dump(exclude={"type"}).items():
+        setattr(tray, column, value)
+    try:
+        await db.commit()
+    except StaleDataError:
+        raise HTTPException(status_code=409, detail="The tray was changed concurrently; retry.")
+    tray_indexes.discard(tray_type)
+    return tray
+
+
+@app.delete("/trays/{tray_type}")
+async def delete_tray(tray_type: str, db: AsyncSession = Depends(get_session)):
+    tray = await db.get(VendorTrayManufacturer, tray_type)
+    if not tray:
+        raise HTTPException(status_code=404, detail="Tray not found.")
+    await db.delete(tray)
+    await db.commit()
+    tray_indexes.discard(tray_type)
+    return {"detail": "Tray deleted successfully."}
+
+
+@app.get("/trays/{tray_type}/resolve", response_model=TrayResolution)
+async def resolve_tray_instruments(
+    tray_type: str,
+    name: List[str] = Query(..., description="Instrument names or aliases to resolve (repeatable)"),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Resolve instrument names and aliases (case and spacing insensitive) to
+    the tray's instrument names. Each name is one dict lookup in the tray's
+    cached index; the JSON columns are only read when the tray has changed.
+    """
+    index = await tray_indexes.get(db, tray_type)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Tray not found.")
+    return TrayResolution(
+        type=tray_type,
+        version=index.version,
+        matches=[TrayInstrumentMatch(name=n, instrument=index.resolve(n)) for n in name],
+    )
+
+
+def encode_cursor(created_at: datetime, image_key: str) -> str:
+    """Opaque keyset cursor for the (created_at, image_key) ordering."""
+    raw = json.dumps([created_at.isoformat(), image_key]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, image_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), image_key
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {str(e)}")
+
+
+def apply_image_filter(query, filters: ImageFilter):
+    """Translate an ImageFilter into WHERE clauses on the image table."""
+    if filters.client_id:
+        query = query.where(Image.client_id == filters.client_id)
+    if filters.hardware_id:
+        query = query.where(Image.hardware_id == filters.hardware_id)
+    if filters.ml_tag:
+        query = query.where(Image.ml_tag == filters.ml_tag.value)
+    if filters.location_id:
+        query = query.where(Image.location_id == filters.location_id)
+    if filters.user_id:
+        query = query.where(Image.user_id == filters.user_id)
+    if filters.created_from:
+        query = query.where(Image.created_at >= filters.created_from)
+    if filters.created_to:
+        query = query.where(Image.created_at <= filters.created_to)
+    return query
+
+
+image_list_adapter = TypeAdapter(List[ImageRead])
+annotation_list_adapter = TypeAdapter(List[AnnotationRead])
+version_list_adapter = TypeAdapter(List[ImageVersionRead])
+
+
+@app.get("/images", response_model=List[ImageRead])
+async def list_images(
+    request: Request,
+    filters: ImageFilter = Depends(),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Retrieve one page of images ordered by (created_at, image_key).
+
+    The cursor for the next page is returned in the X-Next-Cursor header;
+    it is absent on the last page. Pages are served from the read cache
+    until a write changes any image or annotation (see cached_read_key).
+
+    The weak ETag is the images change counter, so If-None-Match is
+    answered with 304 until anything in the catalogue changes; use
+    GET /images/changes to fetch just what did.
+    """
+    # Read before the page, so neither the ETag nor the cache key ever
+    # claims a newer state than the body
+    change = await current_change(db)
+    etag = weak_etag(change)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    page_params = json.dumps([filters.model_dump(mode="json"), cursor, limit], sort_keys=True)
+    cache_key = cached_read_key(request, "images", change, hashlib.sha256(page_params.encode()).hexdigest())
+    cached = await read_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        # Stored as "<next cursor>\n<body>"
+        next_cursor, body = cached.split(b"\n", 1)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Cache": "HIT"}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor.decode()
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    query = apply_image_filter(select(Image), filters)
+    if cursor:
+        created_at, image_key = decode_cursor(cursor)
+        query = query.where(tuple_(Image.created_at, Image.image_key) > tuple_(created_at, image_key))
+    query = (
+        query.options(selectinload(Image.annotations))
+        .order_by(Image.created_at, Image.image_key)
+        .limit(limit + 1)
+    )
+
+    results = await db.execute(query)
+    images = results.scalars().all()
+
+    next_cursor = ""
+    if len(images) > limit:
+        images = images[:limit]
+        last = images[-1]
+        next_cursor = encode_cursor(last.created_at, last.image_key)
+
+    # Reconstruct the full URL on the response model, never on the ORM instance
+    body = image_list_adapter.dump_json([
+        ImageRead.model_validate(image, from_attributes=True).model_copy(update={"image_key": f"/static/images/{image.image_key}"})
+        for image in images
+    ])
+    if cache_key:
+        await read_cache.set(cache_key, b"\n".join([next_cursor.encode(), body]))
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Cache": "MISS" if cache_key else "BYPASS"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+
+
+def export_image_row(image_row, annotations: list) -> dict:
+    """Build one exported image record from a raw column row."""
+    return {
+        "image_key": f"/static/images/{image_row.image_key}",
+        "client_id": image_row.client_id,
+        "created_at": image_row.created_at.isoformat(),
+        "hardware_id": image_row.hardware_id,
+        "ml_tag": image_row.ml_tag.value if image_row.ml_tag else None,
+        "location_id": image_row.location_id,
+        "user_id": image_row.user_id,
+        "annotations": annotations,
+    }
+
+
+async def iter_image_export(filters: ImageFilter, export_format: str, session_factory):
+    """
+    Stream the catalogue as serialised image records.
+
+    Images and their annotations are read as plain column rows through a
+    server-side cursor, ordered so that all annotations of an image are
+    adjacent; only one image is held in memory at a time. The session is
+    opened here rather than through get_session because the body is
+    produced after the endpoint has returned; `session_factory` is chosen
+    by the endpoint (replica or writer, see get_read_session).
+    """
+    query = apply_image_filter(
+        select(
+            Image.image_key, Image.client_id, Image.created_at, Image.hardware_id,
+            Image.ml_tag, Image.location_id, Image.user_id,
+            Annotation.index, Annotation.instrument, Annotation.polygon, Annotation.polygon_packed,
+        ).outerjoin(Annotation, Annotation.image_key == Image.image_key),
+        filters,
+    ).order_by(Image.created_at, Image.image_key, Annotation.index)
+
+    def frame(record: dict, first: bool) -> str:
+        line = json.dumps(record)
+        if export_format == "ndjson":
+            return line + "\n"
+        return line if first else "," + line
+
+    if export_format == "json":
+        yield "["
+
+    emitted = 0
+    current, annotations = None, []
+    async with session_factory() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for row in result:
+            if current is not None and row.image_key != current.image_key:
+                yield frame(export_image_row(current, annotations), emitted == 0)
+                emitted += 1
+                annotations = []
+            current = row
+            if row.index is not None:
+                annotations.append({
+                    "image_key": row.image_key,
+                    "index": row.index,
+                    "instrument": row.instrument,
+                    "polygon": row.polygon if row.polygon_packed is None else {
+                        "points": unpack_points(row.polygon_packed).tolist()
+                    },
+                })
+
+    if current is not None:
+        yield frame(export_image_row(current, annotations), emitted == 0)
+    if export_format == "json":
+        yield "]"
+
+
+@app.get("/images/changes", response_model=ImageChangesResponse)
+async def image_changes(
+    since: str = Query(..., description="Token from the previous call, or from the ETag of GET /images"),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Images and annotations created, updated or deleted since `since`.
+
+    Clients keep their copy of the list in sync by applying
+    `deleted_images` and `deleted_annotations` first, then the upserted
+    `images` and `annotations`, and passing the returned `token` next time.
+    410 means too much changed: reload GET /images instead.
+    """
+    try:
+        since_change = int(since.removeprefix('W/"images-').rstrip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid change token.")
+    return await load_changes(db, since_change)
+
+
+@app.get("/images/export")
+async def export_images(
+    request: Request,
+    filters: ImageFilter = Depends(),
+    format: str = Query("ndjson", pattern="^(ndjson|json)$", description="ndjson (one image per line) or json (a single array)"),
+):
+    """Stream every image matching the filters, with its annotations."""
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(iter_image_export(filters, format, session_factory_for(request)), media_type=media_type)
 
 
 # 6. Return the annotations of an image
 @app.get("/images/{image_key}/annotations", response_model=List[AnnotationRead])
 async def get_image_annotations(
+    request: Request,
     image_key: str,
-    db: AsyncSession = Depends(get_session)
+    db: AsyncSession = Depends(get_read_session)
 ):
     from sqlalchemy import select
 
+    cache_key = cached_read_key(request, "annotations", await current_change(db), image_key)
+    cached = await read_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
+
     image = await db.get(Image, image_key)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found.")
@@ -355,7 +1104,12 @@ async def get_image_annotations(
     query = select(Annotation).where(Annotation.image_key == image_key)
     results = await db.execute(query)
     annotations = results.scalars().all()
-    return annotations
+    body = annotation_list_adapter.dump_json(
+        [AnnotationRead.model_validate(annotation, from_attributes=True) for annotation in annotations]
+    )
+    if cache_key:
+        await read_cache.set(cache_key, body)
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS" if cache_key else "BYPASS"})
 
 
 
@@ -380,26 +1134,44 @@ async def get_image_annotations(
 
 @app.delete("/images/{image_key:path}")
 async def delete_image(image_key: str, db: AsyncSession = Depends(get_session)):
-    logger.info(f"Image key: {image_key}")
-    print("Image delete", image_key)
 
     # ✅ Extract only the filename (remove "/static/images/")
     image_key = image_key.split("/static/images/")[-1]
-    print("Image delete2", image_key)
+    logger.debug("Deleting image %s", image_key)
     
 
     # Retrieve the image record from the database using the provided key.
     result = await db.execute(select(Image).filter(Image.image_key == image_key))
     image = result.scalars().first()  # get the first matching image
 
-    print("Image retrieved:", image)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found in database.")
     
 
-    # ✅ Delete the image record from the database.
+    # ✅ Delete the image record (with its versions) from the database, then,
+    # once that has committed, each stored file no other image references.
+    result = await db.execute(select(ImageVersion.content_hash).where(ImageVersion.image_key == image_key))
+    content_hashes = [image.content_hash] + list(result.scalars().all())
+    result = await db.execute(select(Annotation.instrument).where(Annotation.image_key == image_key))
+    stat_deltas = image_stat_deltas([image], sign=-1)
+    stat_deltas.update(annotation_stat_deltas(result.scalars(), sign=-1))
+    # Blob rows, the counter, then the image row, as by every other writer;
+    # any other order deadlocks against concurrent creates or annotation writes.
+    # The image still references its blobs here, so emptied rows are left
+    # for purge_blob to remove.
+    released = [
+        content_hash for content_hash in content_hashes
+        if content_hash and await release_blob(db, content_hash, delete_row=False)
+    ]
+    change = await next_change(db)
     await db.delete(image)
+    await apply_stat_deltas(db, stat_deltas)
+    await record_tombstones(db, change, image_keys=[image_key])
     await db.commit()
+    # Outside the transaction: writers never wait on file deletes, and a
+    # failed commit leaves every file its rows point at in place.
+    for content_hash in released:
+        await discard_unreferenced_blob(db, blob_store, content_hash)
 
     return {"detail": "Image deleted successfully."}
 
@@ -408,12 +1180,22 @@ async def delete_image(image_key: str, db: AsyncSession = Depends(get_session)):
 
 @app.put("/images/{image_key:path}/file")
 async def update_image_file(
+    request: Request,
     image_key: str,
     scale: float = Query(1.0, gt=0.0, description="Scaling factor for the image (e.g., 0.5 for half size)"),
     quality: int = Query(75, ge=1, le=100, description="Quality for JPEG images (1-100)"),
     db: AsyncSession = Depends(get_session)
 ):
-
+    """
+    Serve a version of the image scaled and re-encoded from its original
+    from now on, and return it.
+
+    A version already stored with these parameters is switched to at once.
+    A new one is computed by a background job (IMAGE_TRANSFORM_MODE=async):
+    the response is then 202 with the job, to poll at its Location. An
+    Idempotency-Key header makes retries of the request return that job
+    instead of queueing another.
+    """
     image_key = image_key.split("/")[-1]
 
     # Ensure the image exists in the database
@@ -421,34 +1203,415 @@ async def update_image_file(
     if not image_obj:
         raise HTTPException(status_code=404, detail="Image not found in database.")
 
-    # ✅ Always reconstruct the correct file path
-    file_path = os.path.join(UPLOAD_DIR, image_key)  # Only add UPLOAD_DIR prefix
+    # ✅ Versions are always computed from the pristine original, so
+    # transforms never compound and the original is never overwritten.
+    original_key = original_storage_key(image_obj)
+
+    logger.debug("Transforming %s from %s", image_key, original_key)
 
-    print("File path resolved to:", file_path)
+    if not await storage.exists(original_key):
+        raise HTTPException(status_code=404, detail="Image file not found in storage.")
 
+    result = await db.execute(
+        select(ImageVersion).where(
+            ImageVersion.image_key == image_key,
+            ImageVersion.scale == scale,
+            ImageVersion.quality == quality,
+        )
+    )
+    version = result.scalar_one_or_none()
+    headers = {}
+    change = None
+    if version:
+        # Same parameters as before: serve the stored derivative as is
+        data = await storage.read_bytes(blob_store.key(version.content_hash))
+        headers["X-Cache"] = "HIT"
+    elif IMAGE_TRANSFORM_MODE == "async":
+        job, _ = await enqueue_job(
+            db, "image.transform", {"image_key": image_key, "scale": scale, "quality": quality},
+            idempotency_key=request.headers.get("Idempotency-Key"),
+        )
+        await db.commit()
+        return Response(
+            content=JobRead.model_validate(job).model_dump_json(),
+            status_code=202,
+            media_type="application/json",
+            headers={"Location": f"/jobs/{job.id}"},
+        )
+    else:
+        version, data, timing, change = await compute_image_version(db, image_obj, original_key, scale, quality)
+        headers["X-Cache"] = "MISS"
+        headers["Server-Timing"] = server_timing(timing)
+
+    await make_version_current(db, image_obj, version, original_key, change)
+    headers["X-Image-Version"] = str(version.id)
+    return Response(content=data, media_type=f"image/{version.format.lower()}", headers=headers)
+
+
+async def compute_image_version(
+    db: AsyncSession, image_obj: Image, original_key: str, scale: float, quality: int
+):
+    """
+    Transform the original in the image pool and store the result; returns
+    (ImageVersion, bytes, JobTiming, change counter value taken for it).
+    """
+    original = await storage.read_bytes(original_key)
+
+    # Apply scaling and quality changes in the image pool, off the event loop
+    (data, image_format), timing = await image_pool.run(transform_image, original, scale, quality)
+
+    # Blobs first (uploads included), then the counter, then the rows
+    original_hash = None if image_obj.content_hash else await store_blob_bytes(db, original)
+    content_hash = await store_blob_bytes(db, data)
+    change = await next_change(db)
+    if original_hash:
+        # Legacy flat file, adopted into the blob store as the original
+        image_obj.content_hash = original_hash
+    version = await record_image_version(db, image_obj, scale, quality, image_format, content_hash, len(data))
+    return version, data, timing, change
+
+
+async def make_version_current(
+    db: AsyncSession, image_obj: Image, version: ImageVersion, original_key: str, change: Optional[int] = None
+) -> None:
+    """Serve `version` in place of the original from now on, and commit."""
+    # Take the counter (unless this transaction already has) before touching
+    # the image row (autoflush would write it first), so this locks rows in
+    # the same order as every other writer.
+    if change is None:
+        change = await next_change(db)
+    # ✅ The original stays untouched; only the pointer moves
+    image_obj.current_version = version
+    image_obj.change_seq = change
+    await db.commit()
+    if original_key != original_storage_key(image_obj):
+        # Legacy flat file, now superseded by the content-addressed copy
+        await storage.delete(original_key)
+
+
+@job_handler("image.transform")
+async def run_image_transform(params: dict) -> dict:
+    """Background half of PUT /images/{key}/file: compute the version and make it current."""
+    async with async_session() as db:
+        image_obj = await db.get(Image, params["image_key"])
+        if not image_obj:
+            raise HTTPException(status_code=404, detail="Image not found in database.")
+        original_key = original_storage_key(image_obj)
+        if not await storage.exists(original_key):
+            raise HTTPException(status_code=404, detail="Image file not found in storage.")
+        version, _, timing, change = await compute_image_version(
+            db, image_obj, original_key, params["scale"], params["quality"]
+        )
+        await make_version_current(db, image_obj, version, original_key, change)
+        return {
+            "image_key": image_obj.image_key,
+            "version_id": version.id,
+            "format": version.format,
+            "size": version.size,
+            "queued_ms": round(timing.queued_ms, 1),
+            "run_ms": round(timing.run_ms, 1),
+        }
+
+
+@app.get("/jobs/{job_id}", response_model=JobRead)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_session)):
+    """Status of a background job, and its result once it has succeeded."""
+    # Read from the primary: a replica may not have seen the job progress yet
+    job = await db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+async def store_blob_bytes(db: AsyncSession, data: bytes) -> str:
+    """Reference in-memory content in the blob store (storing it if new); returns its hash."""
+    content_hash = hashlib.sha256(data).hexdigest()
+    await acquire_blob(db, content_hash, len(data))
+    await blob_store.put_bytes(content_hash, data)
+    return content_hash
+
+
+async def record_image_version(
+    db: AsyncSession, image: Image, scale: float, quality: int, image_format: str, content_hash: str, size: int
+) -> ImageVersion:
+    """Record a stored derivative (see `store_blob_bytes`) and its parameters as an ImageVersion."""
+    stmt = (
+        pg_insert(ImageVersion)
+        .values(
+            image_key=image.image_key, scale=scale, quality=quality,
+            format=image_format, content_hash=content_hash, size=size,
+        )
+        .on_conflict_do_nothing(constraint="uq_image_version_params")
+        .returning(ImageVersion.id)
+    )
+    if (await db.execute(stmt)).scalar_one_or_none() is None:
+        # A concurrent request stored the same parameters first; use theirs.
+        await release_blob(db, content_hash)
+
+    result = await db.execute(
+        select(ImageVersion).where(
+            ImageVersion.image_key == image.image_key,
+            ImageVersion.scale == scale,
+            ImageVersion.quality == quality,
+        )
+    )
+    return result.scalar_one()
+
+
+@app.get("/images/{image_key}/versions", response_model=List[ImageVersionRead])
+async def list_image_versions(request: Request, image_key: str, db: AsyncSession = Depends(get_read_session)):
+    """List the stored derivatives of an image and which one is served."""
+    cache_key = cached_read_key(request, "versions", await current_change(db), image_key)
+    cached = await read_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
+
+    image = await db.get(Image, image_key)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    result = await db.execute(
+        select(ImageVersion).where(ImageVersion.image_key == image_key).order_by(ImageVersion.id)
+    )
+    body = version_list_adapter.dump_json([
+        ImageVersionRead.model_validate(version).model_copy(
+            update={"current": version.id == image.current_version_id}
+        )
+        for version in result.scalars().all()
+    ])
+    if cache_key:
+        await read_cache.set(cache_key, body)
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS" if cache_key else "BYPASS"})
+
+
+@app.put("/images/{image_key}/versions/current")
+async def set_current_image_version(
+    image_key: str,
+    version_id: Optional[int] = Query(None, description="Version to serve; omit to serve the original again"),
+    db: AsyncSession = Depends(get_session)
+):
+    """Choose which stored version (or the original) is served for an image."""
+    image = await db.get(Image, image_key)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    version = None
+    if version_id is not None:
+        version = await db.get(ImageVersion, version_id)
+        if not version or version.image_key != image_key:
+            raise HTTPException(status_code=404, detail="Image version not found.")
+    change = await next_change(db)
+    image.current_version = version
+    image.change_seq = change
+    await db.commit()
+    return {"image_key": image_key, "current_version_id": version_id}
+
+
+@app.api_route("/static/images/{image_key}", methods=["GET", "HEAD"])
+async def get_image_file(
+    request: Request,
+    image_key: str,
+    sha256: Optional[str] = Query(
+        None, pattern="^[0-9a-f]{64}$",
+        description="Content hash of the bytes wanted (the ETag); makes the response immutable",
+    ),
+    tier: Optional[str] = Query(None, description="Quality tier (scale and quality) to serve, see IMAGE_QUALITY_TIERS"),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Serve an image's bytes by key, with Range and HEAD support.
+
+    The strong ETag is the SHA-256 of the bytes, taken from the database, so
+    If-None-Match is answered with 304 without touching storage. By key
+    alone the response must be revalidated, since transforms change what
+    the key serves. With ?sha256= (also given as Content-Location) it is
+    content-addressed and cached for good.
+
+    With local storage, clients whose Accept header lists AVIF or WebP get
+    the image transcoded to it, and ?tier= serves it scaled and re-encoded;
+    each such variant is generated once into the derivative cache, with its
+    own strong ETag. The stored original is never modified. Local files are
+    sent directly (zero-copy where the server supports it).
+
+    Remote storage always redirects to a presigned URL of the stored bytes,
+    without variants, so the bytes never pass through the API (or the
+    Lambda function).
+    """
+    quality_tier = IMAGE_QUALITY_TIERS.get(tier or IMAGE_DEFAULT_TIER)
+    if quality_tier is None:
+        raise HTTPException(status_code=400, detail=f"Unknown tier; one of: {', '.join(IMAGE_QUALITY_TIERS)}.")
+    image = await db.get(Image, image_key)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    storage_key = image_storage_key(image)
+    # Versions keep the original's format, so the key's extension holds for all
+    media_type = mimetypes.guess_type(image_key)[0] or "application/octet-stream"
+    content_hash = image.current_version.content_hash if image.current_version else image.content_hash
+
+    if sha256 is None:
+        headers = {"Cache-Control": "no-cache"}
+        if content_hash:
+            headers["Content-Location"] = f"/static/images/{quote(image_key)}?sha256={content_hash}"
+            if tier:
+                headers["Content-Location"] += f"&tier={quote(tier)}"
+    else:
+        content_hash, storage_key = sha256, await image_content_key(db, image, sha256)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+
+    # Variants are generated from local files only: from remote storage each
+    # would pull the original through the API to transcode and send it back
+    file_path = storage.local_path(storage_key)
+    if file_path is not None:
+        if IMAGE_NEGOTIATE_FORMATS:
+            headers["Vary"] = "Accept"
+        output_format = variant_format(request, media_type, quality_tier)
+        if output_format:
+            response = await serve_image_variant(request, storage_key, output_format, quality_tier, headers)
+            if response is not None:
+                return response
+
+    if content_hash:
+        headers["ETag"] = f'"{content_hash}"'
+        if etag_matches(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    if file_path is None:
+        return RedirectResponse(await storage.url(storage_key, media_type), status_code=307)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Image file not found on disk.")
+    return SendfileResponse(file_path, media_type=media_type, headers=headers)
 
-    # Open the image, apply scaling and quality changes
-    with PILImage.open(file_path) as img:
-        if scale != 1.0:
-            new_size = (int(img.width * scale), int(img.height * scale))
-            img = img.resize(new_size, PILImage.Resampling.LANCZOS)
-
-        buf = BytesIO()
-        image_format = img.format if img.format else "JPEG"
-        if image_format.upper() == "JPEG":
-            img.save(buf, format=image_format, quality=quality)
-        else:
-            img.save(buf, format=image_format)  # Save PNG as is
-        buf.seek(0)
 
-        # ✅ Overwrite the original file on disk
-        with open(file_path, "wb") as f:
-            f.write(buf.getbuffer())
-        buf.seek(0)
+async def image_content_key(db: AsyncSession, image: Image, sha256: str) -> str:
+    """
+    Storage key of the content `sha256` if it is the image's original or one
+    of its stored versions (current or not); 404 otherwise.
+    """
+    current_hash = image.current_version.content_hash if image.current_version else None
+    if sha256 not in (current_hash, image.content_hash):
+        # An earlier version of this image, if it is still stored
+        result = await db.execute(select(ImageVersion.id).where(
+            ImageVersion.image_key == image.image_key, ImageVersion.content_hash == sha256,
+        ).limit(1))
+        if result.scalar_one_or_none() is None:
+            raise HTTPException(status_code=404, detail="No such content for this image.")
+    return blob_store.key(sha256)
+
+
+def variant_format(request: Request, media_type: str, quality_tier: QualityTier) -> Optional[str]:
+    """
+    The format to serve an image of `media_type` in for this request, or
+    None when its stored bytes fit (no better format accepted, full scale).
+    """
+    source_format = media_type.split("/")[-1]
+    offered = [name for name in IMAGE_NEGOTIATE_FORMATS if can_encode(name)]
+    output_format = negotiate_format(request.headers.get("accept"), offered)
+    if output_format and output_format != source_format:
+        return output_format
+    if quality_tier.scale == 1:
+        return None
+    return source_format if source_format in DERIVATIVE_FORMATS else "png"
+
+
+async def serve_image_variant(
+    request: Request, storage_key: str, output_format: str, quality_tier: QualityTier, headers: dict
+) -> Optional[Response]:
+    """
+    Serve the locally stored image under `storage_key` transcoded and
+    scaled, generating it into the derivative cache on first request.
+    Returns None when a full-scale variant came out no smaller than the
+    stored file, which is then better served as is.
+    """
+    cache_key = derivative_key(
+        storage_key, kind="variant", format=output_format, scale=quality_tier.scale, quality=quality_tier.quality,
+    )
+    headers = {**headers, "ETag": f'"{cache_key}"'}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    cached_path = derivative_cache.get(cache_key)
+    if cached_path is None:
+        if not await storage.exists(storage_key):
+            raise HTTPException(status_code=404, detail="Image file not found in storage.")
+        data = await storage.read_bytes(storage_key)
+        variant, timing = await image_pool.run(
+            transcode_image, data, output_format, quality_tier.scale, quality_tier.quality,
+        )
+        cached_path = await derivative_cache.put(cache_key, variant)
+        headers["Server-Timing"] = server_timing(timing)
+
+    source_path = storage.local_path(storage_key)
+    if quality_tier.scale == 1 and os.path.exists(source_path):
+        if os.path.getsize(cached_path) >= os.path.getsize(source_path):
+            return None
+    return SendfileResponse(cached_path, media_type=f"image/{output_format}", headers=headers)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match lists `etag` (or is "*")."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@app.api_route("/images/{image_key}/thumbnail", methods=["GET", "HEAD"])
+async def get_image_thumbnail(
+    request: Request,
+    image_key: str,
+    w: int = Query(256, ge=1, le=THUMBNAIL_MAX_SIZE, description="Maximum width in pixels"),
+    h: int = Query(256, ge=1, le=THUMBNAIL_MAX_SIZE, description="Maximum height in pixels"),
+    format: str = Query("jpeg", pattern="^(jpeg|png|webp)$", description="Output format"),
+    sha256: Optional[str] = Query(
+        None, pattern="^[0-9a-f]{64}$",
+        description="Content hash of the image to downscale; makes the response immutable",
+    ),
+    db: AsyncSession = Depends(get_read_session)
+):
+    """
+    Serve a downscaled copy of an image that fits within w x h.
+
+    Thumbnails are generated once per (content, size, format) and kept in the
+    on-disk derivative cache. The ETag is derived from the content hash and
+    parameters, so revalidation never touches the original. As for
+    /static/images, the thumbnail by key follows transforms and must be
+    revalidated; with ?sha256= (given as Content-Location) it is cached
+    for good.
+    """
+    image = await db.get(Image, image_key)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found.")
 
-    return StreamingResponse(buf, media_type=f"image/{image_format.lower()}")
+    if sha256 is None:
+        storage_key = image_storage_key(image)
+        headers = {"Cache-Control": "no-cache"}
+        content_hash = image.current_version.content_hash if image.current_version else image.content_hash
+        if content_hash:
+            params = {"w": w, "h": h, "format": format, "sha256": content_hash}
+            headers["Content-Location"] = f"/images/{quote(image_key)}/thumbnail?{urlencode(params)}"
+    else:
+        storage_key = await image_content_key(db, image, sha256)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    cache_key = derivative_key(storage_key, kind="thumbnail", w=w, h=h, format=format, quality=THUMBNAIL_QUALITY)
+    headers["ETag"] = f'"{cache_key}"'
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = f"image/{format}"
+    cached_path = derivative_cache.get(cache_key)
+    if cached_path:
+        return SendfileResponse(cached_path, media_type=media_type, headers=headers)
+
+    if not await storage.exists(storage_key):
+        raise HTTPException(status_code=404, detail="Image file not found in storage.")
+    data = await storage.read_bytes(storage_key)
+    thumbnail, timing = await image_pool.run(make_thumbnail, data, w, h, format, THUMBNAIL_QUALITY)
+    await derivative_cache.put(cache_key, thumbnail)
+    headers["Server-Timing"] = server_timing(timing)
+    return Response(content=thumbnail, media_type=media_type, headers=headers)
+
+
+# Remaining backend static files. Mounted after the image route above so
+# that /static/images/{image_key} is resolved through the database.
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
 # 3) Serve SPA build at root
@@ -462,4 +1625,17 @@ async def spa_fallback(request: Request, full_path: str):
     return FileResponse(index)
 
 # Create a Mangum handler for AWS Lambda compatibility
-handler = Mangum(app)
+mangum_handler = Mangum(app)
+
+
+def handler(event, context):
+    """Lambda entry point. Queued log records are written before returning, as the container may be frozen after."""
+    try:
+        return mangum_handler(event, context)
+    finally:
+        flush_logs()
+
+startup_profile.mark("app setup")
+if STARTUP_PROFILE:
+    startup_profile.stop_timing_imports()
+    startup_profile.log()
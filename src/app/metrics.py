@@ -0,0 +1,382 @@
+# metrics.py
+"""
+Request metrics in the Prometheus text format, served at GET /metrics.
+
+MetricsMiddleware times every request by route template. SQLAlchemy events
+count the queries each request runs and the time it spends in them; the
+image pool reports Pillow decode/resize/encode times and bytes in and out.
+Each process keeps its own figures, so scrape every worker (or the one
+process per Lambda container).
+
+With OTEL_EXPORTER_OTLP_ENDPOINT set (and opentelemetry-sdk plus
+opentelemetry-exporter-otlp-proto-http installed) each request is also
+exported as a span, e.g. to a local collector at http://localhost:4318.
+"""
+import abc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Requests running more queries than this are logged as a warning (0 = never).
+METRICS_QUERY_WARN_THRESHOLD = int(os.getenv("METRICS_QUERY_WARN_THRESHOLD", "25"))
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "scalpel-api")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """(suffixed name, label names, label values, value) of every sample."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, values, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: (non-cumulative bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        samples = []
+        bucket_labels = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append((f"{self.name}_bucket", bucket_labels, key + (_format_value(bound),), cumulative))
+                samples.append((f"{self.name}_sum", self.labelnames, key, total))
+                samples.append((f"{self.name}_count", self.labelnames, key, count))
+        return samples
+
+
+class GaugeFunction(Metric):
+    """A gauge read at scrape time: `fn` returns a number, or {label values: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Callable, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, e)
+            return []
+        if isinstance(value, dict):
+            return [(self.name, self.labelnames, key, v) for key, v in sorted(value.items()) if v is not None]
+        return [] if value is None else [(self.name, (), (), value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "Requests answered, by route template and status.", ("method", "route", "status"),
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to the end of the response, by route template.", ("method", "route"),
+))
+db_queries_per_request = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements run while serving a request.", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+db_time_per_request = registry.register(Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements while serving a request.", ("method", "route"),
+))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Duration of single SQL statements (requests and background jobs).",
+))
+image_op_duration = registry.register(Histogram(
+    "image_op_duration_seconds", "Image pool work by operation and phase (queue, decode, resize, encode, total).",
+    ("op", "phase"),
+))
+image_bytes_read = registry.register(Histogram(
+    "image_op_bytes_read", "Encoded bytes handed to an image operation.", ("op",), buckets=BYTES_BUCKETS,
+))
+image_bytes_written = registry.register(Histogram(
+    "image_op_bytes_written", "Encoded bytes produced by an image operation.", ("op",), buckets=BYTES_BUCKETS,
+))
+
+
+class RequestStats:
+    """What the current request has done so far."""
+
+    __slots__ = ("db_queries", "db_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    db_query_duration.observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += seconds
+
+
+def instrument_engine(engine) -> None:
+    """Time every statement run through `engine` (an AsyncEngine or Engine)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# Phases timed inside the image pool's workers (processes or threads), and
+# handed back to the caller with the result.
+_phases = threading.local()
+
+
+@contextmanager
+def timed_phase(name: str):
+    """Add the time spent in the block to phase `name` of the current image operation."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = getattr(_phases, "timings", None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def start_phases() -> None:
+    _phases.timings = {}
+
+
+def collect_phases() -> Dict[str, float]:
+    """Phase timings (ms) recorded since start_phases(), and stop recording."""
+    timings = getattr(_phases, "timings", None) or {}
+    _phases.timings = None
+    return timings
+
+
+def _payload_size(value) -> Optional[int]:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, tuple) and value and isinstance(value[0], (bytes, bytearray, memoryview)):
+        return len(value[0])
+    return None
+
+
+def observe_image_op(op: str, queued_ms: float, run_ms: float, phases: Dict[str, float],
+                     args: tuple, result) -> None:
+    image_op_duration.observe(queued_ms / 1000, op=op, phase="queue")
+    image_op_duration.observe(run_ms / 1000, op=op, phase="total")
+    for phase, ms in phases.items():
+        image_op_duration.observe(ms / 1000, op=op, phase=phase)
+    read = sum(len(arg) for arg in args if isinstance(arg, (bytes, bytearray, memoryview)))
+    if read:
+        image_bytes_read.observe(read, op=op)
+    written = _payload_size(result)
+    if written is not None:
+        image_bytes_written.observe(written, op=op)
+
+
+# Set by setup_tracing(): the tracer, and the opentelemetry.trace module
+_tracer = None
+_trace = None
+
+
+def setup_tracing() -> None:
+    """Export a span per request over OTLP/HTTP when OTEL_EXPORTER_OTLP_ENDPOINT is set."""
+    global _tracer, _trace
+    if not OTEL_EXPORTER_OTLP_ENDPOINT or _tracer is not None:
+        return
+    try:
+        # Optional dependencies, only needed when exporting traces
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but OpenTelemetry is not installed (%s); "
+                       "install opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http", e)
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # The exporter reads the endpoint (and any headers) from the OTEL_* variables
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer, _trace = trace.get_tracer(__name__), trace
+    logger.info("Exporting traces to %s", OTEL_EXPORTER_OTLP_ENDPOINT)
+
+
+def route_label(scope) -> str:
+    """The matched route's path template, so label values stay bounded."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Record each request's duration, status and SQL work under its route
+    template, and add a Server-Timing header (db queries and time, time to
+    the response) so the breakdown also shows up in browser dev tools.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def timing_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = (
+                    f'db;desc="{stats.db_queries} queries";dur={stats.db_seconds * 1000:.1f}, '
+                    f"app;dur={(time.perf_counter() - started) * 1000:.1f}"
+                )
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header.encode())]}
+            await send(message)
+
+        span = None
+        if _tracer is not None:
+            span = _tracer.start_span(f"{scope['method']} {scope['path']}", kind=_trace.SpanKind.SERVER)
+        try:
+            with _trace.use_span(span, end_on_exit=False) if span is not None else nullcontext():
+                await self.app(scope, receive, timing_send)
+        finally:
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            method, route = scope["method"], route_label(scope)
+            http_requests.inc(method=method, route=route, status=str(status))
+            http_request_duration.observe(elapsed, method=method, route=route)
+            db_queries_per_request.observe(stats.db_queries, method=method, route=route)
+            db_time_per_request.observe(stats.db_seconds, method=method, route=route)
+            if 0 < METRICS_QUERY_WARN_THRESHOLD < stats.db_queries:
+                logger.warning("%s %s ran %s SQL statements (%.1f ms)",
+                               method, scope["path"], stats.db_queries, stats.db_seconds * 1000)
+            if span is not None:
+                span.update_name(f"{method} {route}")
+                span.set_attributes({
+                    "http.request.method": method,
+                    "http.route": route,
+                    "http.response.status_code": status,
+                    "db.query_count": stats.db_queries,
+                    "db.duration_ms": round(stats.db_seconds * 1000, 2),
+                })
+                span.end()
@@ -2,7 +2,8 @@
 import enum
 from datetime import datetime
 from sqlalchemy import (
-    Column, String, DateTime, ForeignKey, Integer, Enum, JSON
+    Column, String, DateTime, ForeignKey, Integer, BigInteger, Float, Enum, JSON, Index, LargeBinary,
+    UniqueConstraint, func
 )
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.ext.asyncio import AsyncAttrs
@@ -36,8 +37,28 @@ class User(Base):
     # Relationship to images (one user can own many images).
     images = relationship("Image", back_populates="user")
 
+class Blob(Base):
+    __tablename__ = "blob"
+
+    # Content-addressed file: the SHA-256 of the bytes is the storage key.
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    # Number of images pointing at this blob; the file is removed at zero.
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
 class Image(Base):
     __tablename__ = "image"
+    # Composite indexes matching the keyset order of GET /images, so that
+    # each page (optionally filtered by one of these columns) is a single
+    # bounded index-range scan instead of a sort over the whole table.
+    __table_args__ = (
+        Index("ix_image_created_at_key", "created_at", "image_key"),
+        Index("ix_image_client_created_key", "client_id", "created_at", "image_key"),
+        Index("ix_image_hardware_created_key", "hardware_id", "created_at", "image_key"),
+        Index("ix_image_location_created_key", "location_id", "created_at", "image_key"),
+        Index("ix_image_user_created_key", "user_id", "created_at", "image_key"),
+    )
 
     image_key = Column(String, primary_key=True, index=True)
     client_id = Column(String, nullable=False)
@@ -48,15 +69,59 @@ class Image(Base):
     
     location_id = Column(String, ForeignKey("location.id"), nullable=True)
     user_id = Column(String, ForeignKey("user.id"), nullable=True)
+    # SHA-256 of the stored file. Null for legacy images stored by filename.
+    # This is the pristine original: transforms never replace it.
+    content_hash = Column(String(64), ForeignKey("blob.sha256"), nullable=True, index=True)
+    # Version served in place of the original, if any (see ImageVersion).
+    current_version_id = Column(
+        Integer,
+        ForeignKey("image_version.id", use_alter=True, name="fk_image_current_version", ondelete="SET NULL"),
+        nullable=True,
+    )
+    # Change counter value of the last write to this row (see ChangeCounter).
+    change_seq = Column(BigInteger, nullable=False, server_default="0", index=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
     # Relationships
     location = relationship("Location", back_populates="images")
     user = relationship("User", back_populates="images")
     annotations = relationship("Annotation", back_populates="image",
                                cascade="all, delete-orphan")
+    versions = relationship("ImageVersion", back_populates="image",
+                            foreign_keys="ImageVersion.image_key",
+                            cascade="all, delete-orphan")
+    # Loaded with the image so the served content resolves without another query.
+    current_version = relationship("ImageVersion", foreign_keys=[current_version_id],
+                                   lazy="joined", post_update=True)
+
+class ImageVersion(Base):
+    __tablename__ = "image_version"
+    # One derivative per set of parameters, so repeating a transform reuses it.
+    __table_args__ = (
+        UniqueConstraint("image_key", "scale", "quality", name="uq_image_version_params"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    image_key = Column(String, ForeignKey("image.image_key", ondelete="CASCADE"), nullable=False)
+
+    # Parameters the derivative was computed with, always from the original.
+    scale = Column(Float, nullable=False)
+    quality = Column(Integer, nullable=False)
+    format = Column(String, nullable=False)
+
+    content_hash = Column(String(64), ForeignKey("blob.sha256"), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    image = relationship("Image", back_populates="versions", foreign_keys=[image_key])
 
 class Annotation(Base):
     __tablename__ = "annotation"
+    __table_args__ = (
+        # Instrument + area range filters of GET /annotations/search
+        Index("ix_annotation_instrument_area", "instrument", "area"),
+        Index("ix_annotation_area", "area"),
+    )
 
     # Composite primary key
     image_key = Column(String, ForeignKey("image.image_key"), primary_key=True)
@@ -65,6 +130,89 @@ class Annotation(Base):
     instrument = Column(String, nullable=False)
     # For storing polygon data as JSON. In Postgres, you could also use JSONB type.
     polygon = Column(JSON, nullable=True)
+    # The same points as packed little-endian float32 (x, y) pairs, used
+    # instead of `polygon` when POLYGON_STORAGE=packed (see geometry.py).
+    polygon_packed = Column(LargeBinary, nullable=True)
+    # Derived from the points on every write (geometry.polygon_columns);
+    # null bounding box for an empty polygon.
+    bbox_min_x = Column(Float, nullable=True)
+    bbox_min_y = Column(Float, nullable=True)
+    bbox_max_x = Column(Float, nullable=True)
+    bbox_max_y = Column(Float, nullable=True)
+    area = Column(Float, nullable=False, server_default="0")
+    # Change counter value of the last write to this row (see ChangeCounter).
+    change_seq = Column(BigInteger, nullable=False, server_default="0", index=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
     # Relationship back to Image
     image = relationship("Image", back_populates="annotations")
+
+
+def annotation_box():
+    """An annotation's bounding box as a Postgres box, the expression ix_annotation_bbox indexes."""
+    return func.box(
+        func.point(Annotation.bbox_min_x, Annotation.bbox_min_y),
+        func.point(Annotation.bbox_max_x, Annotation.bbox_max_y),
+    )
+
+# GiST index for bounding-box overlap (&&) queries on annotation_box(); Postgres only
+Index("ix_annotation_bbox", annotation_box(), postgresql_using="gist").ddl_if(dialect="postgresql")
+
+class ChangeCounter(Base):
+    __tablename__ = "change_counter"
+
+    # Incremented once by every transaction that changes images or
+    # annotations. The row stays locked until that transaction commits, so
+    # values are handed out in commit order and a client that has seen
+    # value N has seen every change up to N.
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+class Tombstone(Base):
+    __tablename__ = "tombstone"
+
+    # Record of a deleted image (index is null) or annotation, so clients
+    # syncing through GET /images/changes learn about deletions.
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    image_key = Column(String, nullable=False)
+    index = Column(Integer, nullable=True)
+    change_seq = Column(BigInteger, nullable=False, index=True)
+    deleted_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class StatCount(Base):
+    __tablename__ = "stat_count"
+
+    # Summary of the catalogue for dashboards: images per value of an image
+    # column (dimension "ml_tag", "hardware_id", ...) and annotations per
+    # instrument (dimension "instrument"). Kept current by every write in
+    # the same transaction (see stats.py); key is "" for images without a value.
+    dimension = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+class Job(Base):
+    __tablename__ = "job"
+    # Workers claim the oldest runnable job with FOR UPDATE SKIP LOCKED
+    # through this index (see jobs.py).
+    __table_args__ = (
+        Index("ix_job_status_run_after", "status", "run_after", "id"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    params = Column(JSON, nullable=False)
+    # "queued", "running", "succeeded" or "failed"
+    status = Column(String, nullable=False, default="queued")
+    # Client-chosen key: enqueueing again with it returns this job
+    idempotency_key = Column(String, nullable=True, unique=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # Not claimed before this time (retry backoff)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # A job still "running" after this lost its worker and is claimed again
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
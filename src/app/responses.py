@@ -0,0 +1,49 @@
+# responses.py
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+# ASGI extensions through which a server sends a file itself (e.g. with
+# sendfile(2)) instead of the app reading it and passing the bytes on.
+ZEROCOPY_SEND = "http.response.zerocopysend"
+PATH_SEND = "http.response.pathsend"
+
+
+class SendfileResponse(FileResponse):
+    """
+    FileResponse (Range, If-Range, HEAD) that hands the file over to the
+    server when it offers zero-copy sending: `http.response.zerocopysend`
+    for whole files and single ranges, or `http.response.pathsend` for
+    whole files. Under other servers the file is read in chunks as usual.
+    """
+
+    _zerocopy = False
+    _pathsend = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        self._zerocopy = ZEROCOPY_SEND in extensions
+        self._pathsend = PATH_SEND in extensions
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send: Send, send_header_only: bool) -> None:
+        if send_header_only or not (self._zerocopy or self._pathsend):
+            await super()._handle_simple(send, send_header_only)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self._pathsend:
+            await send({"type": PATH_SEND, "path": str(self.path)})
+        else:
+            with open(self.path, "rb") as file:
+                await send({"type": ZEROCOPY_SEND, "file": file, "more_body": False})
+
+    async def _handle_single_range(
+        self, send: Send, start: int, end: int, file_size: int, send_header_only: bool
+    ) -> None:
+        if send_header_only or not self._zerocopy:
+            await super()._handle_single_range(send, start, end, file_size, send_header_only)
+            return
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        with open(self.path, "rb") as file:
+            await send({"type": ZEROCOPY_SEND, "file": file, "offset": start, "count": end - start, "more_body": False})
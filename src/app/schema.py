@@ -0,0 +1,124 @@
+# schema.py
+"""
+Database schema setup: python -m app.schema
+
+Creates missing tables and indexes, adds the columns that later releases
+introduced to tables an existing database already has, fills the derived
+values those columns need (annotation bounding boxes and areas) and fills
+derived tables that predate their data (the stats summary). Every step is
+idempotent. Run it once per deploy, before the new code takes traffic; app
+processes only do it themselves when DB_CREATE_SCHEMA is on (the default
+outside Lambda), which keeps it off the cold-start path.
+"""
+import asyncio
+import os
+
+from sqlalchemy import and_, bindparam, select, text, tuple_
+
+from .database import async_session, get_engine
+from .geometry import bounding_box, polygon_area, validate_points
+from .models import Annotation, Base
+from .stats import rebuild_stats, stats_missing
+from . import tray_models  # noqa: F401  (registers the tray table on Base)
+
+DB_CREATE_SCHEMA = os.getenv(
+    "DB_CREATE_SCHEMA", "false" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "true"
+).lower() in ("1", "true", "yes")
+# Annotations whose bounding box and area are computed per round trip
+BACKFILL_BATCH_SIZE = int(os.getenv("SCHEMA_BACKFILL_BATCH_SIZE", "1000"))
+
+# Columns added to tables that existed before them. create_all never alters
+# an existing table, so these are added in place, after it has created any
+# table they reference. Defaults are the values the models write.
+ADDED_COLUMNS = [
+    ("image", "content_hash", "VARCHAR(64) REFERENCES blob (sha256)"),
+    ("image", "current_version_id",
+     "INTEGER CONSTRAINT fk_image_current_version REFERENCES image_version (id) ON DELETE SET NULL"),
+    ("image", "change_seq", "BIGINT NOT NULL DEFAULT 0"),
+    ("image", "updated_at", "TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()"),
+    ("annotation", "polygon_packed", "BYTEA"),
+    ("annotation", "bbox_min_x", "FLOAT"),
+    ("annotation", "bbox_min_y", "FLOAT"),
+    ("annotation", "bbox_max_x", "FLOAT"),
+    ("annotation", "bbox_max_y", "FLOAT"),
+    ("annotation", "area", "FLOAT NOT NULL DEFAULT 0"),
+    ("annotation", "change_seq", "BIGINT NOT NULL DEFAULT 0"),
+    ("annotation", "updated_at", "TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()"),
+    ("vendor_tray_manufacturers", "version", "INTEGER NOT NULL DEFAULT 1"),
+]
+
+
+_annotations = Annotation.__table__
+_GEOMETRY_UPDATE = (
+    _annotations.update()
+    .where(and_(_annotations.c.image_key == bindparam("key"), _annotations.c.index == bindparam("idx")))
+    .values({column: bindparam(column) for column in ("bbox_min_x", "bbox_min_y", "bbox_max_x", "bbox_max_y", "area")})
+)
+
+
+def _create_indexes(sync_conn) -> None:
+    # Indexes of tables create_all found already in place
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+async def backfill_annotation_geometry(conn) -> int:
+    """
+    Compute the bounding box and area of annotations stored before those
+    columns existed (JSON polygons with no box), in keyset-ordered batches.
+    Returns the number of annotations updated.
+    """
+    updated = 0
+    after = None
+    while True:
+        query = (
+            select(Annotation.image_key, Annotation.index, Annotation.polygon)
+            .where(Annotation.bbox_min_x.is_(None), Annotation.polygon.isnot(None))
+            .order_by(Annotation.image_key, Annotation.index)
+            .limit(BACKFILL_BATCH_SIZE)
+        )
+        if after is not None:
+            query = query.where(tuple_(Annotation.image_key, Annotation.index) > after)
+        rows = (await conn.execute(query)).all()
+        if not rows:
+            return updated
+        after = tuple_(rows[-1].image_key, rows[-1].index)
+        values = []
+        for row in rows:
+            try:
+                points = validate_points((row.polygon or {}).get("points", []))
+            except (AttributeError, ValueError):
+                continue  # Not a point list: left without a box, as an empty polygon
+            box = bounding_box(points)
+            if box is not None:
+                values.append({
+                    "key": row.image_key, "idx": row.index,
+                    "bbox_min_x": box[0], "bbox_min_y": box[1], "bbox_max_x": box[2], "bbox_max_y": box[3],
+                    "area": polygon_area(points),
+                })
+        if values:
+            await conn.execute(_GEOMETRY_UPDATE, values)
+            updated += len(values)
+
+
+async def upgrade_schema(conn) -> None:
+    """Bring the tables behind `conn` up to the models (create, add columns, index, backfill)."""
+    await conn.run_sync(Base.metadata.create_all)
+    for table, column, definition in ADDED_COLUMNS:
+        await conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS {column} {definition}'))
+    await conn.run_sync(_create_indexes)
+    await backfill_annotation_geometry(conn)
+
+
+async def create_schema() -> None:
+    async with get_engine().begin() as conn:
+        await upgrade_schema(conn)
+    # Fill the dashboard summary once for a catalogue created before it
+    async with async_session() as db:
+        if await stats_missing(db):
+            await rebuild_stats(db)
+
+
+if __name__ == "__main__":
+    asyncio.run(create_schema())
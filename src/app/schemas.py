@@ -1,16 +1,32 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, PlainSerializer, PlainValidator, WithJsonSchema, model_validator
+from typing import Annotated, Dict, List, Literal, Optional
 from datetime import datetime
 from enum import Enum
 
+import numpy as np
+
+from .geometry import unpack_points, validate_points
+
 # Reuse the MLTagEnum defined in models
 class MLTagEnum(str, Enum):
     TRAIN = "TRAIN"
     TEST = "TEST"
     LIVE = "LIVE"
 
+# [[x, y], ...] held as an (n, 2) NumPy array: validated in one batch
+# rather than float by float, and serialised back to nested lists.
+Points = Annotated[
+    np.ndarray,
+    PlainValidator(validate_points),
+    PlainSerializer(lambda points: points.tolist(), return_type=list),
+    WithJsonSchema({
+        "type": "array",
+        "items": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
+    }),
+]
+
 class Polygon(BaseModel):
-    points: List[List[float]]
+    points: Points
 
 class AnnotationCreate(BaseModel):
     index: int
@@ -20,12 +36,61 @@ class AnnotationCreate(BaseModel):
 class AnnotationRead(AnnotationCreate):
     image_key: str
 
+    @model_validator(mode="before")
+    @classmethod
+    def decode_packed_polygon(cls, data):
+        # Rows stored with POLYGON_STORAGE=packed carry their points in polygon_packed
+        packed = data.get("polygon_packed") if isinstance(data, dict) else getattr(data, "polygon_packed", None)
+        if packed is None:
+            return data
+        fields = data if isinstance(data, dict) else {
+            name: getattr(data, name) for name in cls.model_fields if hasattr(data, name)
+        }
+        return {**fields, "polygon": {"points": unpack_points(packed)}}
+
+class AnnotationMatch(AnnotationRead):
+    area: float
+    bbox_min_x: Optional[float] = None
+    bbox_min_y: Optional[float] = None
+    bbox_max_x: Optional[float] = None
+    bbox_max_y: Optional[float] = None
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class AnnotationSearch(BaseModel):
+    instrument: Optional[str] = None
+    # Region (all four, in image pixels) that the bounding box must overlap
+    min_x: Optional[float] = None
+    min_y: Optional[float] = None
+    max_x: Optional[float] = None
+    max_y: Optional[float] = None
+    min_area: Optional[float] = None
+    max_area: Optional[float] = None
+
 class AnnotationUpdateRequest(BaseModel):
     image_key: str
     annotation_index: int
     instrument: str
     polygon: Polygon
 
+class AnnotationKey(BaseModel):
+    image_key: str
+    index: int
+
+class AnnotationUpsert(AnnotationCreate):
+    image_key: str
+
+class AnnotationBatchRequest(BaseModel):
+    # Deletes are applied before upserts, in the same transaction
+    upsert: List[AnnotationUpsert] = Field(default_factory=list)
+    delete: List[AnnotationKey] = Field(default_factory=list)
+
+class AnnotationBatchResult(BaseModel):
+    upserted: List[AnnotationRead]
+    deleted: List[AnnotationKey]
+
 class ImageFilter(BaseModel):
     client_id: Optional[str] = None
     hardware_id: Optional[str] = None
@@ -54,3 +119,79 @@ class ImageRead(ImageBase):
     model_config = {
         "from_attributes": True
     }
+
+class ImageChange(ImageBase):
+    image_key: str
+    updated_at: datetime
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class ImageChangesResponse(BaseModel):
+    # Pass as `since` on the next call
+    token: str
+    images: List[ImageChange]
+    annotations: List[AnnotationRead]
+    deleted_images: List[str]
+    deleted_annotations: List[AnnotationKey]
+
+class ImageVersionRead(BaseModel):
+    id: int
+    scale: float
+    quality: int
+    format: str
+    size: int
+    created_at: datetime
+    current: bool = False
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class BulkImageItem(ImageCreate):
+    # Name of the image's file in the batch; its basename becomes the image_key
+    filename: str
+
+class BulkImageResult(BaseModel):
+    filename: str
+    image_key: Optional[str] = None
+    status: Literal["created", "exists", "error"]
+    detail: Optional[str] = None
+
+class BulkIngestResponse(BaseModel):
+    created: int
+    existing: int
+    failed: int
+    results: List[BulkImageResult]
+
+class GroupCount(BaseModel):
+    # None groups the rows without a value
+    key: Optional[str]
+    count: int
+
+class StatsSummary(BaseModel):
+    images: int
+    # Images per value of each image column, and annotations per "instrument"
+    dimensions: Dict[str, List[GroupCount]]
+
+class InstrumentStats(BaseModel):
+    instrument: str
+    annotations: int
+    images: int
+    total_area: float
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    attempts: int
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    model_config = {
+        "from_attributes": True
+    }
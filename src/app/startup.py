@@ -0,0 +1,90 @@
+# startup.py
+"""
+Cold-start accounting. main.py imports this first: it notes when the app
+began loading and splits the time until it is ready into phases (imports,
+app setup, schema). With STARTUP_PROFILE=1 it also times the modules
+imported on the way and logs the breakdown once the app is built.
+"""
+import builtins
+import importlib.util
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes")
+# Nesting depth (0 = imported by app code) down to which imports are timed.
+STARTUP_PROFILE_IMPORT_DEPTH = int(os.getenv("STARTUP_PROFILE_IMPORT_DEPTH", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """Durations of the startup phases and, when timing imports, of first imports."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+        # (module, nesting depth, ms including its own imports)
+        self.imports: List[Tuple[str, int, float]] = []
+        self._depth = 0
+        self._original_import = None
+
+    def mark(self, phase: str) -> None:
+        """Close `phase`: it took the time since the previous mark."""
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self._last) * 1000))
+        self._last = now
+
+    def time_imports(self, max_depth: int = STARTUP_PROFILE_IMPORT_DEPTH) -> None:
+        """Time every module imported for the first time from here on, until stop_timing_imports()."""
+        original = self._original_import = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            module = name
+            if level:
+                package = (globals or {}).get("__package__") or ""
+                try:
+                    module = importlib.util.resolve_name("." * level + name, package)
+                except (ImportError, ValueError):
+                    pass
+            if module in sys.modules or self._depth > max_depth:
+                return original(name, globals, locals, fromlist, level)
+            depth = self._depth
+            self._depth += 1
+            started = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                self._depth -= 1
+                self.imports.append((module, depth, (time.perf_counter() - started) * 1000))
+
+        builtins.__import__ = timed_import
+
+    def stop_timing_imports(self) -> None:
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def report(self, top: int = 20) -> dict:
+        slowest = sorted(self.imports, key=lambda entry: entry[2], reverse=True)[:top]
+        return {
+            "total_ms": round((self._last - self.started) * 1000, 1),
+            "phases": {phase: round(ms, 1) for phase, ms in self.phases},
+            "slowest_imports": [
+                {"module": module, "depth": depth, "ms": round(ms, 1)} for module, depth, ms in slowest
+            ],
+        }
+
+    def log(self) -> None:
+        report = self.report()
+        logger.info("Startup took %.1f ms: %s", report["total_ms"], report["phases"])
+        for entry in report["slowest_imports"]:
+            logger.info("  import %s%s: %.1f ms", "  " * entry["depth"], entry["module"], entry["ms"])
+
+
+profile = StartupProfile()
+if STARTUP_PROFILE:
+    profile.time_imports()
@@ -0,0 +1,110 @@
+# stats.py
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .changes import IMAGES_COUNTER
+from .models import Annotation, ChangeCounter, Image, StatCount
+
+# Image columns counted in the summary, in the order dashboards show them.
+IMAGE_DIMENSIONS = ("client_id", "ml_tag", "hardware_id", "location_id", "user_id")
+# Summary dimension counting annotations per instrument.
+INSTRUMENT_DIMENSION = "instrument"
+# Summary key of images without a value for a dimension.
+NONE_KEY = ""
+
+
+def stat_key(value) -> str:
+    """Summary key of a column value (enum members by value, NONE_KEY for None)."""
+    if value is None:
+        return NONE_KEY
+    return value.value if hasattr(value, "value") else str(value)
+
+
+def image_stat_deltas(images: Iterable, sign: int = 1) -> Counter:
+    """Summary changes for adding (sign=1) or removing (sign=-1) images (rows, ORM objects or forms)."""
+    deltas = Counter()
+    for image in images:
+        for dimension in IMAGE_DIMENSIONS:
+            deltas[dimension, stat_key(getattr(image, dimension))] += sign
+    return deltas
+
+
+def annotation_stat_deltas(instruments: Iterable[str], sign: int = 1) -> Counter:
+    """Summary changes for adding (sign=1) or removing (sign=-1) annotations with these instruments."""
+    deltas = Counter()
+    for instrument in instruments:
+        deltas[INSTRUMENT_DIMENSION, stat_key(instrument)] += sign
+    return deltas
+
+
+async def apply_stat_deltas(db: AsyncSession, deltas: Counter) -> None:
+    """
+    Add `deltas` to the summary in one statement, as part of the current
+    transaction. Call it after next_change: the counter row lock then
+    orders all summary updates the same way, so they cannot deadlock.
+    """
+    # Counter addition drops zero and negative totals, so filter explicitly
+    rows = [
+        {"dimension": dimension, "key": key, "count": delta}
+        for (dimension, key), delta in sorted(deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+    stmt = insert(StatCount).values(rows)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[StatCount.dimension, StatCount.key],
+        set_={"count": StatCount.count + stmt.excluded.count},
+    ))
+
+
+async def load_summary(db: AsyncSession) -> Dict[str, Dict[Optional[str], int]]:
+    """The whole summary, as {dimension: {key: count}} with None for NONE_KEY, in one query."""
+    result = await db.execute(
+        select(StatCount.dimension, StatCount.key, StatCount.count)
+        .where(StatCount.count > 0)
+        .order_by(StatCount.dimension, StatCount.count.desc(), StatCount.key)
+    )
+    summary: Dict[str, Dict[Optional[str], int]] = {}
+    for row in result:
+        summary.setdefault(row.dimension, {})[row.key or None] = row.count
+    return summary
+
+
+async def rebuild_stats(db: AsyncSession) -> None:
+    """
+    Recompute the summary from the catalogue with one GROUP BY per
+    dimension, replacing what is stored. Used to fill the summary for a
+    catalogue that predates it; commits.
+    """
+    # Hold the change counter row as writers do, without advancing it, so
+    # no write can change the catalogue between the scan and the commit.
+    await db.execute(
+        insert(ChangeCounter).values(name=IMAGES_COUNTER, value=0)
+        .on_conflict_do_nothing(index_elements=[ChangeCounter.name])
+    )
+    await db.execute(select(ChangeCounter.value).where(ChangeCounter.name == IMAGES_COUNTER).with_for_update())
+
+    rows: List[dict] = []
+    for dimension in IMAGE_DIMENSIONS:
+        column = getattr(Image, dimension)
+        result = await db.execute(select(column, func.count()).group_by(column))
+        rows += [{"dimension": dimension, "key": stat_key(value), "count": count} for value, count in result]
+    result = await db.execute(select(Annotation.instrument, func.count()).group_by(Annotation.instrument))
+    rows += [{"dimension": INSTRUMENT_DIMENSION, "key": stat_key(value), "count": count} for value, count in result]
+
+    await db.execute(StatCount.__table__.delete())
+    if rows:
+        await db.execute(insert(StatCount).values(rows))
+    await db.commit()
+
+
+async def stats_missing(db: AsyncSession) -> bool:
+    """Whether the catalogue has images but the summary has never been filled."""
+    has_stats = (await db.execute(select(StatCount.dimension).limit(1))).first() is not None
+    has_images = (await db.execute(select(Image.image_key).limit(1))).first() is not None
+    return has_images and not has_stats
@@ -0,0 +1,351 @@
+# storage.py
+import abc
+import logging
+import os
+import tempfile
+from typing import NamedTuple, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from .models import Blob
+from .uploads import stream_upload_to_tempfile
+
+logger = logging.getLogger(__name__)
+
+# Which backend holds image bytes: "local" (UPLOAD_DIR) or "s3".
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# Private bucket of its own: the SPA bucket is synced with --delete on deploy
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "scalpel-uploads-bucket")
+S3_PREFIX = os.getenv("S3_PREFIX", "uploads/")
+# Set to point at an S3-compatible stand-in (moto server, MinIO, ...).
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", "3600"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+# Files above the threshold are sent as multipart uploads of this part size.
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+
+
+def _write_file_atomically(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class StorageBackend(abc.ABC):
+    """
+    Where stored bytes live. Keys are relative, slash-separated paths such as
+    "ab/cd/<sha256>". Uploads are always staged in `staging_dir` on local disk
+    first and handed over with `put_file`.
+    """
+
+    staging_dir: str
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def put_file(self, key: str, path: str) -> None:
+        """Store a finished local file under `key`; the file is consumed."""
+        ...
+
+    @abc.abstractmethod
+    async def put_bytes(self, key: str, data: bytes) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def read_bytes(self, key: str) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path on this machine for serving `key` directly, or None if remote."""
+        return None
+
+    @abc.abstractmethod
+    async def url(self, key: str, content_type: Optional[str] = None) -> str:
+        """A URL clients can fetch `key` from without going through the API."""
+        ...
+
+
+class LocalStorage(StorageBackend):
+    """Files under a root directory; staging happens in the same directory so
+    placing a file is an atomic rename."""
+
+    def __init__(self, root: str, url_prefix: str = "/static/images/"):
+        self.root = root
+        self.staging_dir = root
+        self.url_prefix = url_prefix
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    async def put_file(self, key: str, path: str) -> None:
+        destination = self.local_path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+
+    async def put_bytes(self, key: str, data: bytes) -> None:
+        await run_in_threadpool(_write_file_atomically, self.local_path(key), data)
+
+    async def read_bytes(self, key: str) -> bytes:
+        return await run_in_threadpool(_read_file, self.local_path(key))
+
+    async def delete(self, key: str) -> None:
+        path = self.local_path(key)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    async def url(self, key: str, content_type: Optional[str] = None) -> str:
+        # The root is served as static files under url_prefix
+        return f"{self.url_prefix}{key}"
+
+
+class S3Storage(StorageBackend):
+    """
+    Objects in an S3 (or S3-compatible) bucket under `prefix`.
+
+    One boto3 client is shared per backend, with a connection pool sized by
+    S3_MAX_POOL_CONNECTIONS; boto3 calls are blocking so they run in the
+    thread pool. Large files go up as multipart uploads, and reads are meant
+    to be served by redirecting clients to presigned URLs.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", client=None, staging_dir: Optional[str] = None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.staging_dir = staging_dir or tempfile.gettempdir()
+        self._client = client
+        self._transfer_config = None
+
+    @property
+    def client(self):
+        # Built on first use: importing boto3 and creating a client is a large
+        # share of a cold start that only storage requests need to pay.
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=S3_ENDPOINT_URL,
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, retries={"mode": "standard"}),
+            )
+        return self._client
+
+    @property
+    def transfer_config(self):
+        if self._transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+
+            self._transfer_config = TransferConfig(
+                multipart_threshold=S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+                max_concurrency=4,
+            )
+        return self._transfer_config
+
+    @transfer_config.setter
+    def transfer_config(self, config) -> None:
+        self._transfer_config = config
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await run_in_threadpool(self.client.head_object, Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def put_file(self, key: str, path: str) -> None:
+        try:
+            await run_in_threadpool(
+                self.client.upload_file, path, self.bucket, self.object_key(key),
+                Config=self.transfer_config,
+            )
+        finally:
+            os.unlink(path)
+
+    async def put_bytes(self, key: str, data: bytes) -> None:
+        await run_in_threadpool(
+            self.client.put_object, Bucket=self.bucket, Key=self.object_key(key), Body=data
+        )
+
+    async def read_bytes(self, key: str) -> bytes:
+        def _get() -> bytes:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+            return response["Body"].read()
+
+        return await run_in_threadpool(_get)
+
+    async def delete(self, key: str) -> None:
+        await run_in_threadpool(self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+
+    async def url(self, key: str, content_type: Optional[str] = None) -> str:
+        params = {"Bucket": self.bucket, "Key": self.object_key(key)}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return await run_in_threadpool(
+            self.client.generate_presigned_url, "get_object",
+            Params=params, ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+
+
+def storage_from_env(local_root: str) -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(local_root)
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET_NAME, S3_PREFIX)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND!r}")
+
+
+class StagedBlob(NamedTuple):
+    """An upload that has been hashed into a staging file but not placed yet."""
+    tmp_path: str
+    sha256: str
+    size: int
+
+
+class BlobStore:
+    """
+    Content-addressed files in a storage backend, keyed by SHA-256 and
+    sharded into two levels of directories (ab/cd/abcd...) so no directory
+    grows unbounded.
+
+    Blobs are immutable once placed: storing content that already exists
+    costs one hash and no extra space. Which blobs are still referenced is
+    tracked in the `blob` table (see `acquire_blob` / `release_blob`).
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+
+    def key(self, sha256: str) -> str:
+        return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    async def exists(self, sha256: str) -> bool:
+        return await self.backend.exists(self.key(sha256))
+
+    async def stage_upload(self, upload_file: UploadFile) -> StagedBlob:
+        """Stream an upload into a local staging file and hash it."""
+        tmp_path, sha256, size = await stream_upload_to_tempfile(upload_file, self.backend.staging_dir)
+        return StagedBlob(tmp_path=tmp_path, sha256=sha256, size=size)
+
+    async def place(self, staged: StagedBlob) -> None:
+        """Move a staged upload to its content address, or drop it if already stored."""
+        if await self.exists(staged.sha256):
+            self.discard(staged)
+            return
+        await self.backend.put_file(self.key(staged.sha256), staged.tmp_path)
+
+    def discard(self, staged: StagedBlob) -> None:
+        if os.path.exists(staged.tmp_path):
+            os.unlink(staged.tmp_path)
+
+    async def put_bytes(self, sha256: str, data: bytes) -> None:
+        """Store in-memory content under its (already computed) hash."""
+        if await self.exists(sha256):
+            return
+        await self.backend.put_bytes(self.key(sha256), data)
+
+    async def delete(self, sha256: str) -> None:
+        await self.backend.delete(self.key(sha256))
+
+
+async def acquire_blob(db: AsyncSession, sha256: str, size: int) -> None:
+    """
+    Record one more reference to a blob, creating its row on first use.
+
+    Call this before placing the file: the upsert locks the row, so a
+    concurrent `release_blob` of the same content finishes (and removes its
+    file) before we write ours.
+    """
+    stmt = insert(Blob).values(sha256=sha256, size=size, ref_count=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Blob.sha256],
+        set_={"ref_count": Blob.ref_count + 1},
+    )
+    await db.execute(stmt)
+
+
+async def release_blob(db: AsyncSession, sha256: str, delete_row: bool = True) -> bool:
+    """
+    Drop one reference to a blob and return True if it was the last one, in
+    which case the row is deleted and the caller should remove the file
+    with `purge_blob` once this transaction has committed.
+
+    With `delete_row=False` an unreferenced row is left for `purge_blob`,
+    for callers that release before deleting the rows that point at it.
+    """
+    result = await db.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256)
+        .values(ref_count=Blob.ref_count - 1)
+        .returning(Blob.ref_count)
+    )
+    remaining = result.scalar_one_or_none()
+    if remaining is None or remaining > 0:
+        return False
+    if delete_row:
+        await db.execute(delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0))
+    return True
+
+
+async def purge_blob(db: AsyncSession, blob_store: BlobStore, sha256: str) -> bool:
+    """
+    Remove a blob's file if nothing references it any more, in a transaction
+    of its own; returns True if it was removed.
+
+    Run it after the transaction that released the last reference (or
+    rolled back the first) has ended, so a failed commit never leaves rows
+    pointing at a deleted file. The blob row is held locked while the file
+    is deleted: a concurrent `acquire_blob` of the same content waits, then
+    finds the file gone and stores it again.
+    """
+    await db.execute(insert(Blob).values(sha256=sha256, size=0, ref_count=0).on_conflict_do_nothing())
+    result = await db.execute(
+        delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0).returning(Blob.sha256)
+    )
+    if result.scalar_one_or_none() is None:
+        await db.rollback()
+        return False
+    await blob_store.delete(sha256)
+    await db.commit()
+    return True
+
+
+async def discard_unreferenced_blob(db: AsyncSession, blob_store: BlobStore, sha256: str) -> None:
+    """`purge_blob`, logging instead of raising: for cleanup after the work itself has ended."""
+    try:
+        await purge_blob(db, blob_store, sha256)
+    except Exception:
+        await db.rollback()
+        logger.warning("Could not remove unreferenced blob %s", sha256, exc_info=True)
@@ -1,10 +1,10 @@
-from sqlalchemy import Column, String, JSON
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, String, JSON
 
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
-Base = declarative_base()
+# Shared with models.py so create_all creates the tray table too
+from .models import Base
 
 class VendorTrayManufacturer(Base):
     __tablename__ = 'vendor_tray_manufacturers'
@@ -27,6 +27,12 @@ class VendorTrayManufacturer(Base):
     tray_notifications = Column(JSON, nullable=True)
     subgroups = Column(JSON, nullable=True)
 
+    # Incremented by every update (and checked by it, so concurrent updates
+    # cannot overwrite each other). Lookup indexes are cached per version.
+    version = Column(Integer, nullable=False)
+
+    __mapper_args__ = {"version_id_col": version}
+
 # Pydantic schemas for FastAPI
 class VendorTrayManufacturerBase(BaseModel):
     type: str
@@ -46,5 +52,18 @@ class VendorTrayManufacturerCreate(VendorTrayManufacturerBase):
     pass
 
 class VendorTrayManufacturerRead(VendorTrayManufacturerBase):
-    class Config:
-        orm_mode = True
+    version: int
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class TrayInstrumentMatch(BaseModel):
+    # Name as asked, and the tray instrument it resolves to (None if unknown)
+    name: str
+    instrument: Optional[str]
+
+class TrayResolution(BaseModel):
+    type: str
+    version: int
+    matches: List[TrayInstrumentMatch]
@@ -0,0 +1,100 @@
+# trays.py
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import TTLCache
+from .tray_models import VendorTrayManufacturer
+
+# Tray lookup indexes kept per process (least recently used dropped first).
+TRAY_INDEX_CACHE_SIZE = int(os.getenv("TRAY_INDEX_CACHE_SIZE", "256"))
+
+
+def normalize_name(name: str) -> str:
+    """Form in which instrument names and aliases are compared: case-folded, single-spaced."""
+    return " ".join(name.casefold().split())
+
+
+class TrayIndex(NamedTuple):
+    version: int
+    # Normalized instrument name or alias -> instrument name
+    instruments: Dict[str, str]
+
+    def resolve(self, name: str) -> Optional[str]:
+        return self.instruments.get(normalize_name(name))
+
+
+def _strings(value) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [item for item in value if isinstance(item, str)]
+    return []
+
+
+def build_tray_index(tray: VendorTrayManufacturer) -> TrayIndex:
+    """
+    Flatten a tray's JSON columns into one name -> instrument dict.
+
+    Instruments are the keys of `aliases` and `additional_instruments` and
+    the names listed under each entry of `levels` and `subgroups`. `aliases`
+    maps an instrument to one alias or a list of them. An instrument's own
+    name always wins over another instrument's alias.
+    """
+    names: List[str] = list(tray.aliases or {}) + list(tray.additional_instruments or {})
+    for grouping in (tray.levels, tray.subgroups):
+        for members in (grouping or {}).values():
+            names += _strings(members)
+
+    instruments: Dict[str, str] = {}
+    for instrument, aliases in (tray.aliases or {}).items():
+        for alias in _strings(aliases):
+            instruments.setdefault(normalize_name(alias), instrument)
+    for instrument in names:
+        instruments[normalize_name(instrument)] = instrument
+    return TrayIndex(version=tray.version, instruments=instruments)
+
+
+class TrayIndexCache:
+    """
+    Lookup indexes of recently used trays, each valid for one tray version.
+
+    A lookup reads only the tray's version (a primary key lookup, none of
+    the JSON columns); the index is rebuilt from the full row only when that
+    version has moved on, so every process picks up an update on its next
+    lookup without any invalidation message.
+    """
+
+    def __init__(self, max_entries: int = TRAY_INDEX_CACHE_SIZE):
+        self.indexes = TTLCache(max_entries, ttl=float("inf"))
+        self.hits = 0
+        self.builds = 0
+
+    async def get(self, db: AsyncSession, tray_type: str) -> Optional[TrayIndex]:
+        """The current index of a tray, or None if there is no such tray."""
+        version = (await db.execute(
+            select(VendorTrayManufacturer.version).where(VendorTrayManufacturer.type == tray_type)
+        )).scalar_one_or_none()
+        if version is None:
+            self.indexes.delete(tray_type)
+            return None
+        index = self.indexes.get(tray_type)
+        if index is not None and index.version == version:
+            self.hits += 1
+            return index
+
+        tray = await db.get(VendorTrayManufacturer, tray_type, populate_existing=True)
+        if tray is None:
+            return None
+        index = build_tray_index(tray)
+        self.builds += 1
+        self.indexes.set(tray_type, index)
+        return index
+
+    def discard(self, tray_type: str) -> None:
+        self.indexes.delete(tray_type)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.indexes), "hits": self.hits, "builds": self.builds}
@@ -0,0 +1,125 @@
+# uploads.py
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+# Largest single image accepted, in bytes (default 64 MiB).
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+# Allowance on top of MAX_UPLOAD_BYTES for the multipart framing and form fields.
+MAX_FORM_OVERHEAD_BYTES = int(os.getenv("MAX_FORM_OVERHEAD_BYTES", str(1024 * 1024)))
+# Largest request body accepted by the bulk ingestion endpoint (default 2 GiB).
+MAX_BULK_UPLOAD_BYTES = int(os.getenv("MAX_BULK_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Size of each read/hash/write step when copying an upload to disk.
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+def upload_too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds the maximum size of {limit} bytes.")
+
+
+def _write_chunk(file_object, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    file_object.write(chunk)
+
+
+def _sync_and_close(file_object) -> None:
+    file_object.flush()
+    os.fsync(file_object.fileno())
+    file_object.close()
+
+
+async def stream_upload_to_tempfile(
+    upload_file: UploadFile,
+    directory: str,
+    max_bytes: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> Tuple[str, str, int]:
+    """
+    Copy an upload into a new temporary file in `directory` in fixed-size
+    chunks and return its (temporary path, sha256 hex digest, size in bytes).
+
+    Hashing and disk writes run in the thread pool so the event loop is never
+    blocked. The caller owns the temporary file and must rename or remove it.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    if upload_file.size is not None and upload_file.size > max_bytes:
+        raise upload_too_large(max_bytes)
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        file_object = os.fdopen(fd, "wb")
+        try:
+            while True:
+                chunk = await upload_file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise upload_too_large(max_bytes)
+                await run_in_threadpool(_write_chunk, file_object, digest, chunk)
+        finally:
+            await run_in_threadpool(_sync_and_close, file_object)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject request bodies larger than `max_body_bytes` before they are parsed.
+
+    FastAPI buffers a whole multipart body before the endpoint runs, so the
+    limit has to be enforced here: a declared Content-Length over the limit is
+    answered with 413 without reading the body, and chunked bodies are
+    counted as they arrive and aborted as soon as they cross the limit.
+    Paths in `bulk_paths` carry many images per request and get
+    `max_bulk_body_bytes` instead; each image in them is still held to
+    MAX_UPLOAD_BYTES by the endpoint.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_UPLOAD_BYTES + MAX_FORM_OVERHEAD_BYTES,
+                 bulk_paths: tuple = ("/images/bulk",), max_bulk_body_bytes: int = MAX_BULK_UPLOAD_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.bulk_paths = bulk_paths
+        self.max_bulk_body_bytes = max_bulk_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_bulk_body_bytes if scope.get("path") in self.bulk_paths else self.max_body_bytes
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"detail": upload_too_large(limit).detail},
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise upload_too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,42 @@
+# worker.py
+"""
+Background job worker: python -m app.worker [--concurrency N]
+
+Run as many processes, on as many hosts, as the queue needs; they share
+work through the job table alone.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+
+from .database import async_session
+from .jobs import JOB_WORKER_CONCURRENCY, JobWorker
+from .logs import configure_logging
+from .main import app  # noqa: F401  (registers the job handlers)
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    worker = JobWorker(async_session, concurrency=concurrency)
+    logger.info("Job worker started with %s slots", concurrency)
+    await worker.run(stop)
+    logger.info("Job worker stopped: %s completed, %s failed", worker.completed, worker.failed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run queued background jobs.")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY,
+                        help="Jobs run at the same time by this process")
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(run_worker(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,57 @@
+# Private bucket for image blobs, kept apart from the SPA bucket: the SPA
+# deploy syncs that one with --delete, and CloudFront serves all of it.
+# Images are only ever read through presigned URLs the API hands out.
+resource "aws_s3_bucket" "uploads_bucket" {
+  bucket = "scalpel-uploads-bucket" # must be globally unique
+
+  tags = {
+    Name        = "Scalpel-Uploads"
+    Environment = "prod"
+  }
+}
+
+resource "aws_s3_bucket_ownership_controls" "uploads_disable_acls" {
+  bucket = aws_s3_bucket.uploads_bucket.id
+
+  rule {
+    object_ownership = "BucketOwnerEnforced"
+  }
+}
+
+resource "aws_s3_bucket_public_access_block" "uploads_public_block" {
+  bucket                  = aws_s3_bucket.uploads_bucket.id
+  block_public_acls       = true
+  ignore_public_acls      = true
+  block_public_policy     = true
+  restrict_public_buckets = true
+}
+
 resource "aws_iam_policy" "lambda_s3_upload" {
   name        = "scalpel-lambda-s3-upload"
-  description = "Allow Lambda to upload files to S3 /uploads/ path"
+  description = "Allow Lambda to store, read, list and delete image blobs under the S3 /uploads/ path"
   policy = jsonencode({
     Version = "2012-10-17",
     Statement = [
       {
         Effect = "Allow",
         Action = [
-          "s3:PutObject"
+          "s3:PutObject",
+          "s3:GetObject",
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload",
+          "s3:ListMultipartUploadParts"
         ],
-        Resource = "arn:aws:s3:::scalpel-frontend-bucket/uploads/*"
+        Resource = "${aws_s3_bucket.uploads_bucket.arn}/uploads/*"
+      },
+      {
+        # Without ListBucket, HEAD on a missing key answers 403 instead of 404
+        # and the storage backend cannot tell new content from a denied read.
+        Effect   = "Allow",
+        Action   = "s3:ListBucket",
+        Resource = aws_s3_bucket.uploads_bucket.arn,
+        Condition = {
+          StringLike = { "s3:prefix" = "uploads/*" }
+        }
       }
     ]
   })
@@ -63,8 +63,11 @@ resource "aws_lambda_function" "scalpel" {
   environment {
     variables = {
       DATABASE_URL = "postgresql+asyncpg://${var.db_username}:${var.db_password}@${aws_rds_cluster.aurora.endpoint}:${var.db_port}/${var.db_name}"
+      DATABASE_READ_URL = "postgresql+asyncpg://${var.db_username}:${var.db_password}@${aws_rds_cluster.aurora.reader_endpoint}:${var.db_port}/${var.db_name}"
       DEBUG        = "false"
-      S3_BUCKET_NAME = "scalpel-frontend-bucket"
+      S3_BUCKET_NAME = aws_s3_bucket.uploads_bucket.bucket
+      STORAGE_BACKEND = "s3"
+      S3_PREFIX      = "uploads/"
     }
   }
 }
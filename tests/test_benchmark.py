@@ -0,0 +1,27 @@
+import pytest
+from httpx import AsyncClient
+
+from app import main
+from benchmarks.api_load import LoadConfig, compare, run_benchmark
+
+
+@pytest.mark.asyncio
+async def test_load_benchmark_runs_mixed_workload_and_cleans_up(test_client: AsyncClient, db_session, monkeypatch):
+    """Test a small in-process benchmark run: every operation runs without errors and nothing is left behind."""
+    monkeypatch.setattr(main, "IMAGE_TRANSFORM_MODE", "sync")
+    config = LoadConfig(images=6, annotations=2, points=8, image_size=64, concurrency=3, requests=40,
+                        mix={"list": 1, "upload": 1, "annotate": 1, "resize": 1}, seed_batch=4)
+    report = await run_benchmark(test_client, config)
+
+    assert report["seed"]["images"] == 6
+    assert report["requests"] == 40 and report["errors"] == 0
+    assert set(report["operations"]) == {"list", "upload", "annotate", "resize"}
+    for figures in report["operations"].values():
+        assert 0 < figures["p50"] <= figures["p99"] <= figures["max"]
+
+    response = await test_client.get("/images", params={"client_id": f"bench-{report['run_id']}"})
+    assert response.json() == []
+
+    slower = {"operations": {op: {**f, "p99": f["p99"] * 2} for op, f in report["operations"].items()}}
+    assert compare(report, report, 0.2) == []
+    assert len(compare(slower, report, 0.2)) == 4
@@ -0,0 +1,126 @@
+import pytest
+import uuid
+import json
+import time
+from httpx import AsyncClient
+
+from app.cache import ReadCache, TTLCache
+
+
+class FakeSharedCache:
+    """In-memory stand-in for the Redis commands the shared cache layer uses."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used(monkeypatch):
+    """Test that local entries expire after the TTL and the coldest entry is evicted first."""
+    cache = TTLCache(max_entries=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None and len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_read_cache_shares_entries_between_workers():
+    """Test that two processes sharing a layer see each other's entries, and survive its failures."""
+    shared = FakeSharedCache()
+    worker_a = ReadCache(TTLCache(100, ttl=60), shared)
+    worker_b = ReadCache(TTLCache(100, ttl=60), shared)
+
+    await worker_a.set("annotations:1:x", b"[]")
+    assert await worker_b.get("annotations:1:x") == b"[]"
+    assert await worker_b.get("annotations:1:x") == b"[]"
+    assert (worker_b.shared_hits, worker_b.local_hits) == (1, 1)
+
+    # A write moves readers to keys of the next change counter value
+    assert await worker_a.get("annotations:2:x") is None
+    assert worker_a.stats()["misses"] == 1
+
+    async def unreachable(*args, **kwargs):
+        raise ConnectionError("shared cache down")
+
+    shared.get = unreachable
+    assert await worker_b.get("annotations:2:x") is None
+    assert worker_b.stats()["shared_errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_annotation_reads_are_cached_until_a_write(test_client: AsyncClient, db_session):
+    """Test that reads are served from the cache until a write, and bypass it for the writer."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    other_key = f"test_image_{uuid.uuid4().hex}.png"
+    for key in (image_key, other_key):
+        files = {
+            "image_file": (key, f"fake image data {key}".encode(), "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    # The writer reads past the cache (from the writer) while its cookie lasts
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert response.headers["x-cache"] == "BYPASS"
+    test_client.cookies.clear()
+
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert response.headers["x-cache"] == "MISS"
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert response.headers["x-cache"] == "HIT"
+    assert response.json()[0]["instrument"] == "instr1"
+    response = await test_client.get(f"/images/{other_key}/annotations")
+    response = await test_client.get(f"/images/{other_key}/annotations")
+    assert response.headers["x-cache"] == "HIT"
+
+    response = await test_client.put("/annotations/update", json={
+        "image_key": image_key, "annotation_index": 0, "instrument": "scalpel",
+        "polygon": {"points": [[0, 0]]},
+    })
+    assert response.status_code == 200
+    test_client.cookies.clear()
+
+    # The write took a new change counter value: entries of the old one are
+    # not used, for any image, not only the one written
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()[0]["instrument"] == "scalpel"
+    response = await test_client.get(f"/images/{other_key}/annotations")
+    assert response.headers["x-cache"] == "MISS"
+
+    # List pages are dropped by the same write
+    response = await test_client.get("/images", params={"client_id": "client01", "limit": 1})
+    response = await test_client.get("/images", params={"client_id": "client01", "limit": 1})
+    assert response.headers["x-cache"] == "HIT"
+    await test_client.delete(f"/images/{image_key}")
+    await test_client.delete(f"/images/{other_key}")
+    test_client.cookies.clear()
+    response = await test_client.get("/images", params={"client_id": "client01", "limit": 1})
+    assert response.headers["x-cache"] == "MISS"
+
+    stats = (await test_client.get("/health/cache")).json()
+    assert stats["local_hits"] >= 2 and stats["misses"] >= 3
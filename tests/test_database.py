@@ -0,0 +1,65 @@
+import pytest
+import uuid
+import json
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+pytest.importorskip("aiosqlite")
+
+from app.main import app
+from app.models import Base
+
+
+@pytest.fixture
+async def sqlite_replica(monkeypatch):
+    """Fixture to route replica reads to an empty in-memory SQLite database."""
+    from app import database
+
+    replica_engine = create_async_engine(
+        "sqlite+aiosqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+    )
+    async with replica_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(database, "read_session", sessionmaker(
+        bind=replica_engine, class_=AsyncSession, expire_on_commit=False
+    ))
+    yield
+    await replica_engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica_except_right_after_a_write(test_client: AsyncClient, db_session, sqlite_replica):
+    """Test that a writing client reads its own writes while others read the replica."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    assert "scalpel_last_write" in response.cookies
+
+    # A client that has not written reads the (empty) replica...
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as other_client:
+        response = await other_client.get(f"/images/{image_key}/annotations")
+        assert response.status_code == 404
+
+    # ...while the writer sees the image straight away
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert response.status_code == 200
+
+    await test_client.delete(f"/images/{image_key}")
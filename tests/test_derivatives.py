@@ -0,0 +1,96 @@
+import pytest
+import uuid
+import json
+import os
+from io import BytesIO
+from httpx import AsyncClient
+from PIL import Image as PILImage
+
+from app.derivatives import DiskLRUCache
+
+
+def _png(width: int, height: int) -> bytes:
+    buf = BytesIO()
+    PILImage.new("RGB", (width, height), color="blue").save(buf, "PNG")
+    return buf.getvalue()
+
+
+async def _create_image(test_client: AsyncClient, content: bytes, suffix: str = ".png") -> str:
+    image_key = f"test_image_{uuid.uuid4().hex}{suffix}"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, content, "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    return image_key
+
+
+@pytest.mark.asyncio
+async def test_disk_lru_cache_evicts_least_recently_used(tmp_path):
+    """Test that the cache stays within its byte budget by dropping the coldest entry."""
+    cache = DiskLRUCache(str(tmp_path), max_bytes=250)
+
+    await cache.put("aa01", b"x" * 100)
+    await cache.put("aa02", b"x" * 100)
+    assert cache.get("aa01")  # aa01 is now the most recently used
+    await cache.put("aa03", b"x" * 100)
+
+    assert cache.get("aa02") is None
+    assert cache.get("aa01") and cache.get("aa03")
+    assert cache.total_bytes == 200
+
+    # A new instance picks up what is already on disk
+    assert DiskLRUCache(str(tmp_path), max_bytes=250).total_bytes == 200
+
+
+@pytest.mark.asyncio
+async def test_thumbnail_is_downscaled_cached_and_revalidated(test_client: AsyncClient, db_session):
+    """Test that thumbnails fit the requested box and carry a strong, reusable ETag."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    image_key = await _create_image(test_client, _png(800, 600))
+
+    response = await test_client.get(f"/images/{image_key}/thumbnail", params={"w": 100, "h": 100})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    with PILImage.open(BytesIO(response.content)) as thumb:
+        assert thumb.size == (100, 75)
+    etag = response.headers["etag"]
+    assert not etag.startswith("W/")
+    # By key it follows transforms, so it is revalidated; the URL by content is immutable
+    assert response.headers["cache-control"] == "no-cache"
+    content_location = response.headers["content-location"]
+    assert "sha256=" in content_location
+    response = await test_client.get(content_location)
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert response.headers["etag"] == etag
+
+    # Served again from the cache with the same validator
+    response = await test_client.get(f"/images/{image_key}/thumbnail", params={"w": 100, "h": 100})
+    assert response.status_code == 200
+    assert response.headers["etag"] == etag
+
+    response = await test_client.get(
+        f"/images/{image_key}/thumbnail", params={"w": 100, "h": 100}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # Different parameters are a different derivative
+    response = await test_client.get(f"/images/{image_key}/thumbnail", params={"w": 50, "h": 50, "format": "webp"})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    response = await test_client.get(f"/images/{image_key}/thumbnail", params={"sha256": "0" * 64})
+    assert response.status_code == 404
@@ -4,7 +4,11 @@ from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from src.app.models import User  # adjust import as needed
+import hashlib
 import json
+import os
+from io import BytesIO
+from PIL import Image as PILImage
 
 @pytest.fixture
 async def create_test_user(db_session: AsyncSession):
@@ -87,6 +91,494 @@ async def test_create_image(test_client: AsyncClient, create_test_user):
     assert data["annotations"][0]["instrument"] == "instr1"
 
 
+@pytest.mark.asyncio
+async def test_list_images_keyset_pagination(test_client: AsyncClient, create_test_user):
+    """Test that GET /images filters server-side and pages through a stable cursor."""
+
+    # A client_id unique to this test so the filter isolates our rows
+    client_id = f"client_{uuid.uuid4().hex}"
+    for day in (1, 2, 3):
+        image_form_data = {
+            "client_id": client_id,
+            "created_at": f"2025-02-0{day}T00:00:00Z",
+            "hardware_id": None,
+            "ml_tag": "TEST",
+            "location_id": None,
+            "user_id": create_test_user.id,
+            "annotations": [
+                {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+            ]
+        }
+        files = {
+            "image_file": (f"test_image_{uuid.uuid4().hex}.png", b"fake image data", "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    # First page: two images plus a cursor for the rest
+    response = await test_client.get("/images", params={"client_id": client_id, "limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [img["created_at"][:10] for img in first_page] == ["2025-02-01", "2025-02-02"]
+    assert all(img["image_key"].startswith("/static/images/") for img in first_page)
+    cursor = response.headers["X-Next-Cursor"]
+
+    # Second page: the remaining image and no further cursor
+    response = await test_client.get("/images", params={"client_id": client_id, "limit": 2, "cursor": cursor})
+    assert response.status_code == 200
+    second_page = response.json()
+    assert [img["created_at"][:10] for img in second_page] == ["2025-02-03"]
+    assert "X-Next-Cursor" not in response.headers
+
+    # The page size is capped
+    response = await test_client.get("/images", params={"limit": 100000})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_export_images_ndjson(test_client: AsyncClient, create_test_user):
+    """Test that the streaming export yields one image per line with its annotations."""
+
+    client_id = f"client_{uuid.uuid4().hex}"
+    image_form_data = {
+        "client_id": client_id,
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": create_test_user.id,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}},
+            {"index": 1, "instrument": "instr2", "polygon": {"points": [[2, 2], [3, 3]]}},
+        ]
+    }
+    for _ in range(2):
+        files = {
+            "image_file": (f"test_image_{uuid.uuid4().hex}.png", b"fake image data", "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    response = await test_client.get("/images/export", params={"client_id": client_id})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 2
+    assert [a["instrument"] for a in rows[0]["annotations"]] == ["instr1", "instr2"]
+
+    # The JSON flavour carries the same records as a single array
+    response = await test_client.get("/images/export", params={"client_id": client_id, "format": "json"})
+    assert response.status_code == 200
+    assert response.json() == rows
+
+
+@pytest.mark.asyncio
+async def test_create_image_rejects_oversized_upload(test_client: AsyncClient, create_test_user, monkeypatch):
+    """Test that uploads over MAX_UPLOAD_BYTES are rejected with 413 and leave nothing on disk."""
+    from app import uploads
+    from app.main import UPLOAD_DIR
+
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1024)
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": create_test_user.id,
+    }
+    files = {
+        "image_file": (image_key, b"x" * 4096, "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+
+    response = await test_client.post("/images", files=files)
+
+    assert response.status_code == 413
+    assert not os.path.exists(os.path.join(UPLOAD_DIR, image_key))
+    assert not [name for name in os.listdir(UPLOAD_DIR) if name.startswith(".upload-")]
+
+
+@pytest.mark.asyncio
+async def test_upload_size_limit_middleware_uses_content_length():
+    """Test that a declared Content-Length over the limit is refused without reading the body."""
+    from app.uploads import UploadSizeLimitMiddleware
+
+    async def endpoint(scope, receive, send):
+        raise AssertionError("the wrapped app must not be called")
+
+    sent = []
+
+    async def receive():
+        raise AssertionError("the body must not be read")
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = UploadSizeLimitMiddleware(endpoint, max_body_bytes=10)
+    scope = {"type": "http", "method": "POST", "headers": [(b"content-length", b"11")]}
+    await middleware(scope, receive, send)
+
+    assert sent[0]["status"] == 413
+
+
+
+@pytest.mark.asyncio
+async def test_identical_uploads_share_one_blob(test_client: AsyncClient, create_test_user):
+    """Test that the same bytes under two names are stored once and removed with the last reference."""
+    from app.main import blob_store
+
+    content = f"fake image data {uuid.uuid4().hex}".encode()
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": create_test_user.id,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    image_keys = [f"test_image_{uuid.uuid4().hex}.png" for _ in range(2)]
+    for image_key in image_keys:
+        files = {
+            "image_file": (image_key, content, "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    # Re-using a key is refused instead of overwriting the stored file
+    files = {
+        "image_file": (image_keys[0], b"other bytes", "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 409
+
+    # Both keys serve the same bytes from a single content-addressed file
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert await blob_store.exists(sha256)
+    for image_key in image_keys:
+        response = await test_client.get(f"/static/images/{image_key}")
+        assert response.status_code == 200
+        assert response.content == content
+
+    # The blob survives until its last reference is deleted
+    response = await test_client.delete(f"/images/{image_keys[0]}")
+    assert response.status_code == 200
+    assert await blob_store.exists(sha256)
+
+    response = await test_client.delete(f"/images/{image_keys[1]}")
+    assert response.status_code == 200
+    assert not await blob_store.exists(sha256)
+
+
+
+@pytest.mark.asyncio
+async def test_failed_image_create_removes_its_blob(test_client: AsyncClient, create_test_user, monkeypatch):
+    """Test that a file placed for an image whose transaction rolls back is not left behind."""
+    from app import main
+
+    async def failing_stat_deltas(db, deltas):
+        raise RuntimeError("simulated failure before commit")
+
+    monkeypatch.setattr(main, "apply_stat_deltas", failing_stat_deltas)
+    content = f"fake image data {uuid.uuid4().hex}".encode()
+    image_form_data = {
+        "client_id": "client01", "created_at": "2025-02-24T00:00:00Z", "hardware_id": None,
+        "ml_tag": "TRAIN", "location_id": None, "user_id": create_test_user.id, "annotations": [],
+    }
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    files = {
+        "image_file": (image_key, content, "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    with pytest.raises(RuntimeError):
+        await test_client.post("/images", files=files)
+
+    assert not await main.blob_store.exists(hashlib.sha256(content).hexdigest())
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_failed_image_delete_keeps_its_blob(test_client: AsyncClient, create_test_user, monkeypatch):
+    """Test that files are only removed once the delete has committed."""
+    from app import main
+    from app.models import Blob
+
+    content = f"fake image data {uuid.uuid4().hex}".encode()
+    image_form_data = {
+        "client_id": "client01", "created_at": "2025-02-24T00:00:00Z", "hardware_id": None,
+        "ml_tag": "TRAIN", "location_id": None, "user_id": create_test_user.id,
+        "annotations": [{"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}],
+    }
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    files = {
+        "image_file": (image_key, content, "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200
+
+    async def failing_tombstones(db, change, **kwargs):
+        raise RuntimeError("simulated failure before commit")
+
+    monkeypatch.setattr(main, "record_tombstones", failing_tombstones)
+    with pytest.raises(RuntimeError):
+        await test_client.delete(f"/images/{image_key}")
+
+    # Rolled back: the image is still there, and so is its file
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.status_code == 200
+    assert response.content == content
+
+    monkeypatch.undo()
+    response = await test_client.delete(f"/images/{image_key}")
+    assert response.status_code == 200
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert not await main.blob_store.exists(sha256)
+    async with main.async_session() as db:
+        assert await db.get(Blob, sha256) is None
+
+
+@pytest.mark.asyncio
+async def test_update_image_file_keeps_original_and_reuses_versions(test_client: AsyncClient, create_test_user, monkeypatch):
+    """Test that transforms are stored as versions computed from the untouched original."""
+    from app import main
+    from app.main import blob_store
+
+    # Computed in the request (see test_jobs.py for background transforms)
+    monkeypatch.setattr(main, "IMAGE_TRANSFORM_MODE", "sync")
+
+    buf = BytesIO()
+    PILImage.new("RGB", (100, 100), color="blue").save(buf, "JPEG")
+    original = buf.getvalue()
+    image_key = f"test_image_{uuid.uuid4().hex}.jpg"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": create_test_user.id,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, original, "image/jpeg"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    # Scaling twice by 0.5 does not compound: the second call reuses the first version
+    first = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.5, "quality": 80})
+    assert first.status_code == 200
+    assert first.headers["x-cache"] == "MISS"
+    second = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.5, "quality": 80})
+    assert second.headers["x-cache"] == "HIT"
+    assert second.headers["x-image-version"] == first.headers["x-image-version"]
+    assert second.content == first.content
+    with PILImage.open(BytesIO(second.content)) as img:
+        assert img.size == (50, 50)
+
+    # A different scale is computed from the original, not from the current version
+    latest = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.25, "quality": 80})
+    with PILImage.open(BytesIO(latest.content)) as img:
+        assert img.size == (25, 25)
+
+    # The latest version is served, and the original is still there to go back to
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.content == latest.content
+    versions = (await test_client.get(f"/images/{image_key}/versions")).json()
+    assert [(v["scale"], v["current"]) for v in versions] == [(0.5, False), (0.25, True)]
+
+    response = await test_client.put(f"/images/{image_key}/versions/current")
+    assert response.status_code == 200
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.content == original
+
+    # Deleting the image releases the original and every version
+    response = await test_client.delete(f"/images/{image_key}")
+    assert response.status_code == 200
+    assert not await blob_store.exists(hashlib.sha256(original).hexdigest())
+
+
+
+@pytest.mark.asyncio
+async def test_batch_annotations_upsert_and_delete(test_client: AsyncClient, create_test_user):
+    """Test upserting and deleting annotations across several images in one request."""
+    image_keys = []
+    for _ in range(2):
+        image_key = f"test_image_{uuid.uuid4().hex}.png"
+        image_form_data = {
+            "client_id": "client01",
+            "created_at": "2025-02-24T00:00:00Z",
+            "hardware_id": None,
+            "ml_tag": "TRAIN",
+            "location_id": None,
+            "user_id": create_test_user.id,
+            "annotations": [
+                {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+            ]
+        }
+        files = {
+            "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+        image_keys.append(image_key)
+
+    first, second = image_keys
+    batch = {
+        "upsert": [
+            # Updates the existing annotation 0 of the first image
+            {"image_key": first, "index": 0, "instrument": "scalpel", "polygon": {"points": [[2, 2], [3, 3]]}},
+            {"image_key": f"/static/images/{first}", "index": 1, "instrument": "forceps", "polygon": {"points": [[0, 1]]}},
+            {"image_key": second, "index": 5, "instrument": "clamp", "polygon": {"points": [[5, 5]]}},
+        ],
+        "delete": [
+            {"image_key": second, "index": 0},
+            {"image_key": second, "index": 99},
+        ],
+    }
+    response = await test_client.post("/annotations/batch", json=batch)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    body = response.json()
+    assert len(body["upserted"]) == 3
+    assert body["deleted"] == [{"image_key": second, "index": 0}]
+
+    response = await test_client.get(f"/images/{first}/annotations")
+    assert sorted((a["index"], a["instrument"]) for a in response.json()) == [(0, "scalpel"), (1, "forceps")]
+    response = await test_client.get(f"/images/{second}/annotations")
+    assert [(a["index"], a["instrument"]) for a in response.json()] == [(5, "clamp")]
+
+    # An unknown image rejects the whole batch
+    batch = {"upsert": [
+        {"image_key": first, "index": 2, "instrument": "instr", "polygon": {"points": []}},
+        {"image_key": f"missing_{uuid.uuid4().hex}.png", "index": 0, "instrument": "instr", "polygon": {"points": []}},
+    ]}
+    response = await test_client.post("/annotations/batch", json=batch)
+    assert response.status_code == 404
+    response = await test_client.get(f"/images/{first}/annotations")
+    assert len(response.json()) == 2
+
+    for image_key in image_keys:
+        await test_client.delete(f"/images/{image_key}")
+
+
+@pytest.mark.asyncio
+async def test_batch_annotations_at_the_batch_cap(test_client: AsyncClient, create_test_user):
+    """Test that a full batch on one image stays within the bind parameter limit."""
+    from app.main import ANNOTATION_BATCH_MAX
+
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    image_form_data = {
+        "client_id": "client01", "created_at": "2025-02-24T00:00:00Z", "hardware_id": None,
+        "ml_tag": "TRAIN", "location_id": None, "user_id": create_test_user.id,
+        "annotations": [{"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}],
+    }
+    files = {
+        "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    batch = {"upsert": [
+        {"image_key": image_key, "index": i, "instrument": "instr", "polygon": {"points": [[i, i], [i + 1, i + 1]]}}
+        for i in range(ANNOTATION_BATCH_MAX)
+    ]}
+    response = await test_client.post("/annotations/batch", json=batch)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    assert len(response.json()["upserted"]) == ANNOTATION_BATCH_MAX
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert len(response.json()) == ANNOTATION_BATCH_MAX
+
+    await test_client.delete(f"/images/{image_key}")
+
+
+@pytest.mark.asyncio
+async def test_db_pool_health_reports_checkouts(test_client: AsyncClient, create_test_user):
+    """Test that connection checkouts through the app's engine are measured."""
+    response = await test_client.get("/images", params={"limit": 1})
+    assert response.status_code == 200
+
+    stats = (await test_client.get("/health/db-pool")).json()
+    assert stats["profile"] == "server" and stats["pool"] == "TimedQueuePool"
+    assert stats["checkouts"] >= 1 and stats["wait_ms_p50"] is not None
+    assert 0 <= stats["saturation"] <= 1
+
+    from app.database import TimedNullPool, engine_options
+    assert engine_options("lambda")["poolclass"] is TimedNullPool
+
+
+
+@pytest.mark.asyncio
+async def test_list_images_etag_and_changes_feed(test_client: AsyncClient, create_test_user):
+    """Test that an unchanged list answers 304 and the changes feed returns only the delta."""
+    async def create(image_key):
+        image_form_data = {
+            "client_id": "client01",
+            "created_at": "2025-02-24T00:00:00Z",
+            "hardware_id": None,
+            "ml_tag": "TRAIN",
+            "location_id": None,
+            "user_id": create_test_user.id,
+            "annotations": [
+                {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+            ]
+        }
+        files = {
+            "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    kept, removed = f"test_image_{uuid.uuid4().hex}.png", f"test_image_{uuid.uuid4().hex}.png"
+    await create(kept)
+    await create(removed)
+
+    response = await test_client.get("/images", params={"user_id": create_test_user.id})
+    etag = response.headers["etag"]
+    assert etag.startswith("W/")
+    response = await test_client.get("/images", params={"user_id": create_test_user.id}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Change one annotation, add another, delete one image
+    await test_client.put("/annotations/update", json={
+        "image_key": kept, "annotation_index": 0, "instrument": "scalpel", "polygon": {"points": []},
+    })
+    await test_client.post(f"/images/{kept}/annotations", json={
+        "index": 1, "instrument": "forceps", "polygon": {"points": [[1, 1]]},
+    })
+    await test_client.delete(f"/images/{removed}")
+
+    response = await test_client.get("/images", params={"user_id": create_test_user.id}, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
+
+    response = await test_client.get("/images/changes", params={"since": etag})
+    assert response.status_code == 200
+    changes = response.json()
+    assert changes["images"] == []
+    assert sorted((a["image_key"], a["index"], a["instrument"]) for a in changes["annotations"]) == [
+        (kept, 0, "scalpel"), (kept, 1, "forceps")
+    ]
+    assert changes["deleted_images"] == [removed]
+
+    response = await test_client.get("/images/changes", params={"since": changes["token"]})
+    assert response.json()["annotations"] == [] and response.json()["deleted_images"] == []
+
+
 
 # import pytest
 # import uuid
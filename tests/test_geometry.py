@@ -0,0 +1,143 @@
+import pytest
+import uuid
+import json
+import numpy as np
+from httpx import AsyncClient
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from app import geometry
+from app.database import async_session
+from app.geometry import (
+    bounding_box, contains_points, pack_points, polygon_area, simplify, unpack_points,
+)
+from app.schemas import Polygon
+
+
+def test_polygon_validation_is_batched_and_strict():
+    """Test that points are validated as one array and malformed input is rejected."""
+    polygon = Polygon(points=[[0, 0], [1, 2.5]])
+    assert isinstance(polygon.points, np.ndarray) and polygon.points.shape == (2, 2)
+    assert polygon.model_dump() == {"points": [[0.0, 0.0], [1.0, 2.5]]}
+    assert Polygon(points=[]).points.shape == (0, 2)
+
+    for bad in ([[0, 0, 0]], [[0, "x"]], [[0, float("nan")]], "points"):
+        with pytest.raises(ValidationError):
+            Polygon(points=bad)
+
+
+def test_geometry_helpers():
+    """Test area, bounding box, simplification and point-in-polygon on a square."""
+    square = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=np.float32)
+    assert polygon_area(square) == 100.0
+    assert bounding_box(square) == (0.0, 0.0, 10.0, 10.0)
+    assert bounding_box(np.empty((0, 2))) is None
+
+    # Collinear midpoints and sub-tolerance wobble disappear
+    outline = np.array([[0, 0], [5, 0.01], [10, 0], [10, 5], [10, 10], [0, 10]], dtype=np.float64)
+    assert simplify(outline, tolerance=0.1).tolist() == [[0, 0], [10, 0], [10, 10], [0, 10]]
+
+    inside = contains_points(square, [[5, 5], [15, 5], [0.5, 9.5], [-1, -1]])
+    assert inside.tolist() == [True, False, True, False]
+
+    packed = pack_points(square)
+    assert len(packed) == square.size * 4
+    decoded = unpack_points(packed)
+    assert np.array_equal(decoded, square) and not decoded.flags.owndata
+
+
+@pytest.mark.asyncio
+async def test_packed_polygon_storage_roundtrip(test_client: AsyncClient, db_session, monkeypatch):
+    """Test that with packed storage polygons are stored as float32 bytes and read back unchanged."""
+    monkeypatch.setattr(geometry, "POLYGON_STORAGE", "packed")
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    points = [[float(i), float(i * 2)] for i in range(1000)]
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": points}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    assert response.json()["annotations"][0]["polygon"]["points"] == points
+
+    async with async_session() as session:
+        row = (await session.execute(
+            text("SELECT polygon, length(polygon_packed) AS size FROM annotation WHERE image_key = :key"),
+            {"key": image_key},
+        )).one()
+    assert row.polygon is None and row.size == len(points) * 2 * 4
+
+    response = await test_client.get(f"/images/{image_key}/annotations")
+    assert response.json()[0]["polygon"]["points"] == points
+
+    response = await test_client.get("/images/export", params={"client_id": "client01"})
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    record = next(r for r in exported if r["image_key"] == f"/static/images/{image_key}")
+    assert record["annotations"][0]["polygon"]["points"] == points
+
+    await test_client.delete(f"/images/{image_key}")
+
+
+@pytest.mark.asyncio
+async def test_annotation_search_uses_precomputed_box_and_area(test_client: AsyncClient, db_session):
+    """Test that annotations are found by instrument, region overlap and area range."""
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    instrument = f"instr_{uuid.uuid4().hex[:8]}"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": instrument, "polygon": {"points": [[0, 0], [10, 0], [10, 10], [0, 10]]}},
+            {"index": 1, "instrument": instrument, "polygon": {"points": [[100, 100], [102, 100], [102, 102]]}},
+        ]
+    }
+    files = {
+        "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    response = await test_client.get("/annotations/search", params={"instrument": instrument})
+    matches = response.json()
+    assert [m["index"] for m in matches] == [0, 1]
+    assert matches[0]["area"] == 100.0 and matches[1]["area"] == 2.0
+    assert (matches[1]["bbox_min_x"], matches[1]["bbox_max_y"]) == (100.0, 102.0)
+
+    region = {"min_x": 5, "min_y": 5, "max_x": 50, "max_y": 50}
+    response = await test_client.get("/annotations/search", params={"instrument": instrument, **region})
+    assert [m["index"] for m in response.json()] == [0]
+
+    response = await test_client.get("/annotations/search", params={"instrument": instrument, "max_area": 10})
+    assert [m["index"] for m in response.json()] == [1]
+
+    # Updates keep the derived columns in step with the polygon
+    response = await test_client.post("/annotations/batch", json={"upsert": [
+        {"image_key": image_key, "index": 1, "instrument": instrument,
+         "polygon": {"points": [[0, 0], [4, 0], [4, 4], [0, 4]]}},
+    ]})
+    assert response.status_code == 200, response.json()
+    response = await test_client.get("/annotations/search", params={"instrument": instrument, **region})
+    assert [(m["index"], m["area"]) for m in response.json()] == [(0, 100.0)]
+    response = await test_client.get("/annotations/search", params={"instrument": instrument, "max_x": 3, "min_x": 0, "min_y": 0, "max_y": 3})
+    assert [m["index"] for m in response.json()] == [0, 1]
+
+    response = await test_client.get("/annotations/search", params={"min_x": 0})
+    assert response.status_code == 400
+
+    await test_client.delete(f"/images/{image_key}")
@@ -0,0 +1,77 @@
+import pytest
+import asyncio
+import threading
+import uuid
+import json
+from io import BytesIO
+from fastapi import HTTPException
+from httpx import AsyncClient
+from PIL import Image as PILImage
+
+from app.image_pool import ImagePool
+
+
+@pytest.mark.asyncio
+async def test_image_pool_refuses_work_beyond_max_pending():
+    """Test that a saturated pool answers 503 instead of queueing unbounded work."""
+    pool = ImagePool(kind="thread", max_workers=1, max_pending=1)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(HTTPException) as excinfo:
+            await pool.run(sum, [1, 2])
+        assert excinfo.value.status_code == 503
+
+        release.set()
+        result, timing = await running
+        assert result is True
+        assert timing.run_ms >= 0 and timing.queued_ms >= 0
+
+        stats = pool.stats()
+        assert stats["completed"] == 1 and stats["rejected"] == 1 and stats["pending"] == 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_update_image_file_runs_in_pool(test_client: AsyncClient, db_session, monkeypatch):
+    """Test that resizing goes through the image pool and reports its timing."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    from app import main
+
+    # Computed in the request (see test_jobs.py for background transforms)
+    monkeypatch.setattr(main, "IMAGE_TRANSFORM_MODE", "sync")
+    buf = BytesIO()
+    PILImage.new("RGBA", (100, 100), color="blue").save(buf, "PNG")
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, buf.getvalue(), "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    response = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.5, "quality": 80})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert "transform;dur=" in response.headers["server-timing"]
+    with PILImage.open(BytesIO(response.content)) as img:
+        assert img.size == (50, 50)
+
+    response = await test_client.get("/health/image-pool")
+    assert response.json()["completed"] >= 1
@@ -0,0 +1,176 @@
+import pytest
+import uuid
+import json
+import hashlib
+from io import BytesIO
+from httpx import AsyncClient
+from PIL import Image as PILImage
+
+from app import main
+from app.derivatives import negotiate_format
+from app.responses import SendfileResponse
+
+
+async def _create_image(test_client: AsyncClient, content: bytes, extension: str = "jpg") -> str:
+    image_key = f"test_image_{uuid.uuid4().hex}.{extension}"
+    image_form_data = {
+        "client_id": "client01", "created_at": "2025-02-24T00:00:00Z", "hardware_id": None,
+        "ml_tag": "TRAIN", "location_id": None, "user_id": None,
+        "annotations": [{"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}],
+    }
+    files = {
+        "image_file": (image_key, content, "image/png" if extension == "png" else "image/jpeg"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    return image_key
+
+
+@pytest.mark.asyncio
+async def test_images_have_strong_etags_ranges_and_content_addressed_urls(test_client: AsyncClient, db_session, monkeypatch):
+    """Test revalidation, Range and HEAD by key, and immutable responses by content hash."""
+    monkeypatch.setattr(main, "IMAGE_TRANSFORM_MODE", "sync")
+    buf = BytesIO()
+    PILImage.new("RGB", (120, 90), color="orange").save(buf, "JPEG")
+    original = buf.getvalue()
+    original_hash = hashlib.sha256(original).hexdigest()
+    image_key = await _create_image(test_client, original)
+
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.content == original
+    assert response.headers["etag"] == f'"{original_hash}"'
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.headers["accept-ranges"] == "bytes"
+    content_location = response.headers["content-location"]
+    assert content_location == f"/static/images/{image_key}?sha256={original_hash}"
+
+    # A repeat view costs no body
+    response = await test_client.get(f"/static/images/{image_key}", headers={"If-None-Match": f'"{original_hash}"'})
+    assert response.status_code == 304 and response.content == b""
+
+    response = await test_client.get(f"/static/images/{image_key}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == original[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(original)}"
+    # A stale If-Range gets the whole (new) content instead of a mismatched range
+    response = await test_client.get(f"/static/images/{image_key}", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200 and response.content == original
+
+    response = await test_client.head(f"/static/images/{image_key}")
+    assert response.status_code == 200 and response.content == b""
+    assert response.headers["content-length"] == str(len(original))
+
+    response = await test_client.get(content_location)
+    assert response.content == original
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+    # After a transform the key serves (and revalidates to) the new bytes, while
+    # the content-addressed URL of the original still serves the original
+    latest = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.5, "quality": 80})
+    latest_hash = hashlib.sha256(latest.content).hexdigest()
+    response = await test_client.get(f"/static/images/{image_key}", headers={"If-None-Match": f'"{original_hash}"'})
+    assert response.status_code == 200 and response.content == latest.content
+    assert response.headers["etag"] == f'"{latest_hash}"'
+    assert (await test_client.get(content_location)).content == original
+
+    # Back to the original: the version stays reachable by its hash
+    await test_client.put(f"/images/{image_key}/versions/current")
+    response = await test_client.get(f"/static/images/{image_key}", params={"sha256": latest_hash})
+    assert response.status_code == 200 and response.content == latest.content
+    response = await test_client.get(f"/static/images/{image_key}", params={"sha256": "0" * 64})
+    assert response.status_code == 404
+
+    await test_client.delete(f"/images/{image_key}")
+
+
+@pytest.mark.asyncio
+async def test_images_are_transcoded_to_accepted_formats_and_tiers(test_client: AsyncClient, db_session):
+    """Test Accept negotiation to WebP, variant caching and quality tiers, with the original untouched."""
+    buf = BytesIO()
+    PILImage.effect_noise((400, 300), 40).convert("RGB").save(buf, "PNG")
+    original = buf.getvalue()
+    image_key = await _create_image(test_client, original, extension="png")
+
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.content == original
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["vary"] == "Accept"
+
+    accept = {"Accept": "image/webp,image/png,*/*;q=0.8"}
+    response = await test_client.get(f"/static/images/{image_key}", headers=accept)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["vary"] == "Accept"
+    assert len(response.content) < len(original) / 2
+    with PILImage.open(BytesIO(response.content)) as img:
+        assert img.format == "WEBP" and img.size == (400, 300)
+    etag = response.headers["etag"]
+    assert etag != f'"{hashlib.sha256(original).hexdigest()}"'
+    # Generated once: kept in the derivative cache under its ETag
+    assert main.derivative_cache.get(etag.strip('"')) is not None
+    repeat = await test_client.get(f"/static/images/{image_key}", headers=accept)
+    assert repeat.content == response.content and repeat.headers["etag"] == etag
+    response = await test_client.get(f"/static/images/{image_key}", headers={**accept, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = await test_client.get(f"/static/images/{image_key}", params={"tier": "preview"}, headers=accept)
+    with PILImage.open(BytesIO(response.content)) as img:
+        assert img.format == "WEBP" and img.size == (200, 150)
+    # Without a modern format, a tier keeps the original format
+    response = await test_client.get(f"/static/images/{image_key}", params={"tier": "low"})
+    assert response.headers["content-type"] == "image/png"
+    with PILImage.open(BytesIO(response.content)) as img:
+        assert img.size == (100, 75)
+    response = await test_client.get(f"/static/images/{image_key}", params={"tier": "huge"})
+    assert response.status_code == 400
+
+    response = await test_client.get(f"/static/images/{image_key}", headers={"Accept": "image/webp;q=0, */*"})
+    assert response.content == original
+    await test_client.delete(f"/images/{image_key}")
+
+
+def test_negotiate_format_follows_accept_quality_and_server_preference():
+    offered = ["avif", "webp"]
+    assert negotiate_format("image/avif,image/webp,*/*", offered) == "avif"
+    assert negotiate_format("image/webp,image/avif", offered) == "avif"
+    assert negotiate_format("image/webp;q=0.9, image/avif;q=0.5", offered) == "webp"
+    assert negotiate_format("image/avif;q=0,image/webp", ["avif", "webp"]) == "webp"
+    assert negotiate_format("image/*,*/*;q=0.8", offered) is None
+    assert negotiate_format(None, offered) is None
+
+
+@pytest.mark.asyncio
+async def test_sendfile_response_hands_files_to_the_server(tmp_path):
+    """Test that servers offering zero-copy extensions get the file rather than its bytes."""
+    path = tmp_path / "blob"
+    path.write_bytes(bytes(range(100)))
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def serve(extensions, headers=()):
+        messages = []
+
+        async def send(message):
+            if message["type"] == "http.response.zerocopysend":
+                # What the server would do with sendfile(2)
+                file = message["file"]
+                file.seek(message.get("offset") or 0)
+                message = {**message, "data": file.read(message.get("count") or -1)}
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "headers": list(headers), "extensions": extensions}
+        await SendfileResponse(str(path))(scope, receive, send)
+        return messages
+
+    messages = await serve({"http.response.pathsend": {}})
+    assert [m["type"] for m in messages] == ["http.response.start", "http.response.pathsend"]
+    assert messages[1]["path"] == str(path)
+
+    messages = await serve({"http.response.zerocopysend": {}}, [(b"range", b"bytes=5-9")])
+    assert messages[0]["status"] == 206
+    assert messages[1]["data"] == bytes(range(5, 10))
+
+    messages = await serve({})
+    assert messages[1]["type"] == "http.response.body" and messages[1]["body"] == bytes(range(100))
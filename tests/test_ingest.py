@@ -0,0 +1,222 @@
+import pytest
+import uuid
+import json
+import io
+import tarfile
+from httpx import AsyncClient
+
+
+def _image_form(filename: str, location_id=None, user_id=None, annotations=1) -> dict:
+    return {
+        "filename": filename,
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": "hw01",
+        "ml_tag": "TRAIN",
+        "location_id": location_id,
+        "user_id": user_id,
+        "annotations": [
+            {"index": i, "instrument": f"instr{i}", "polygon": {"points": [[0, 0], [i, i]]}}
+            for i in range(annotations)
+        ]
+    }
+
+
+@pytest.mark.asyncio
+async def test_bulk_ingest_multipart_reports_each_item(test_client: AsyncClient, db_session):
+    """Test that a multipart batch creates new images and reports existing, missing and stray files."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    run = uuid.uuid4().hex
+    names = [f"bulk_{run}_{i}.png" for i in range(4)]
+    location_id, user_id = f"loc_{run}", f"user_{run}"
+    shared = f"shared content {run}".encode()
+
+    # names[0] already exists
+    files = {
+        "image_file": (names[0], b"existing " + run.encode(), "image/png"),
+        "image_form": (None, json.dumps({k: v for k, v in _image_form(names[0]).items() if k != "filename"})),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    manifest = [
+        _image_form(names[0]),
+        _image_form(names[1], location_id=location_id, user_id=user_id, annotations=3),
+        _image_form(names[2], location_id=location_id, user_id=user_id),
+        _image_form(f"missing_{run}.png"),
+    ]
+    files = [
+        ("manifest", (None, json.dumps(manifest))),
+        ("image_files", (names[0], b"other bytes", "image/png")),
+        ("image_files", (names[1], shared, "image/png")),
+        ("image_files", (names[2], shared, "image/png")),
+        ("image_files", (names[3], b"not listed", "image/png")),
+    ]
+    response = await test_client.post("/images/bulk", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    body = response.json()
+
+    assert (body["created"], body["existing"], body["failed"]) == (2, 1, 2)
+    statuses = {r["filename"]: r["status"] for r in body["results"]}
+    assert statuses == {
+        names[0]: "exists",
+        names[1]: "created",
+        names[2]: "created",
+        f"missing_{run}.png": "error",
+        names[3]: "error",
+    }
+
+    response = await test_client.get(f"/images/{names[1]}/annotations")
+    assert [a["index"] for a in response.json()] == [0, 1, 2]
+
+    response = await test_client.get("/images", params={"location_id": location_id, "user_id": user_id})
+    assert sorted(image["image_key"] for image in response.json()) == [
+        f"/static/images/{names[1]}", f"/static/images/{names[2]}"
+    ]
+    response = await test_client.get(f"/static/images/{names[2]}")
+    assert response.content == shared
+
+    # The second image only added a reference: deleting one keeps the other's file
+    response = await test_client.delete(f"/images/{names[1]}")
+    assert response.status_code == 200
+    response = await test_client.get(f"/static/images/{names[2]}")
+    assert response.content == shared
+
+
+@pytest.mark.asyncio
+async def test_bulk_ingest_archive_with_manifest(test_client: AsyncClient, db_session):
+    """Test that a tar archive carrying its own manifest.json is ingested."""
+    run = uuid.uuid4().hex
+    names = [f"archive_{run}_{i}.png" for i in range(3)]
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        members = {name: f"{name} data".encode() for name in names}
+        members["manifest.json"] = json.dumps([_image_form(f"captures/{name}") for name in names]).encode()
+        for name, data in members.items():
+            info = tarfile.TarInfo(f"captures/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    files = {"archive": ("capture.tar.gz", buf.getvalue(), "application/gzip")}
+    response = await test_client.post("/images/bulk", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    body = response.json()
+    assert body["created"] == 3 and body["failed"] == 0
+    assert [r["image_key"] for r in body["results"]] == names
+
+    response = await test_client.get(f"/static/images/{names[0]}")
+    assert response.content == f"{names[0]} data".encode()
+
+    # Sending the same archive again creates nothing
+    response = await test_client.post("/images/bulk", files=files)
+    assert response.json()["existing"] == 3
+
+
+def _tar(members: dict) -> io.BytesIO:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return buf
+
+
+def test_stage_archive_caps_file_count_and_total_size(tmp_path):
+    """Test that many small members are refused by count and by total size, and nothing is left staged."""
+    from fastapi import HTTPException
+    from app.ingest import stage_archive
+
+    members = {f"{i}.png": b"x" * 100 for i in range(5)}
+    with pytest.raises(HTTPException) as excinfo:
+        stage_archive(_tar(members), str(tmp_path), max_files=4)
+    assert excinfo.value.status_code == 413
+    with pytest.raises(HTTPException) as excinfo:
+        stage_archive(_tar(members), str(tmp_path), max_total_bytes=450)
+    assert excinfo.value.status_code == 413 and "total" in excinfo.value.detail
+    assert list(tmp_path.iterdir()) == []
+
+    _, staged = stage_archive(_tar(members), str(tmp_path), max_files=5, max_total_bytes=500)
+    assert len(staged) == 5
+
+
+@pytest.mark.asyncio
+async def test_bulk_ingest_splits_statements_and_rejects_duplicate_indexes(test_client: AsyncClient, db_session, monkeypatch):
+    """Test batches larger than one statement's parameter budget, and a per-item error for repeated indexes."""
+    from app import database
+
+    # Two rows per multi-row INSERT, so every upsert of this batch is split
+    monkeypatch.setattr(database, "MAX_QUERY_PARAMETERS", 8)
+    run = uuid.uuid4().hex
+    names = [f"split_{run}_{i}.png" for i in range(5)]
+    manifest = [_image_form(name, location_id=f"loc_{run}_{i}", user_id=f"user_{run}_{i}")
+                for i, name in enumerate(names[:4])]
+    repeated = _image_form(names[4], annotations=2)
+    repeated["annotations"][1]["index"] = 0
+    manifest.append(repeated)
+    files = [("manifest", (None, json.dumps(manifest)))] + [
+        ("image_files", (name, f"{name} data".encode(), "image/png")) for name in names
+    ]
+    response = await test_client.post("/images/bulk", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    body = response.json()
+    assert (body["created"], body["failed"]) == (4, 2)
+    result = body["results"][4]
+    assert result["filename"] == names[4] and result["status"] == "error"
+    assert "index" in result["detail"]
+    for name in names[:4]:
+        response = await test_client.get(f"/static/images/{name}")
+        assert response.content == f"{name} data".encode()
+
+
+@pytest.mark.asyncio
+async def test_bulk_ingest_cleans_up_after_races_and_failures(test_client: AsyncClient, db_session, monkeypatch):
+    """Test that a key created concurrently is reported as existing, and that a failed batch leaves no files."""
+    import hashlib
+    from datetime import datetime
+    from app import ingest
+    from app.database import async_session
+    from app.main import blob_store
+    from app.models import Image
+    from app.stats import apply_stat_deltas, image_stat_deltas
+
+    run = uuid.uuid4().hex
+    names = [f"race_{run}_{i}.png" for i in range(2)]
+    files = [("manifest", (None, json.dumps([_image_form(name) for name in names])))] + [
+        ("image_files", (name, f"{name} data".encode(), "image/png")) for name in names
+    ]
+    hashes = [hashlib.sha256(f"{name} data".encode()).hexdigest() for name in names]
+    place_blobs = ingest.place_blobs
+
+    async def place_after_concurrent_insert(store, blobs):
+        # Another request creates names[0] between the lookup and the insert
+        async with async_session() as db:
+            image = Image(image_key=names[0], client_id="client01", created_at=datetime(2025, 2, 24))
+            await apply_stat_deltas(db, image_stat_deltas([image]))
+            db.add(image)
+            await db.commit()
+        await place_blobs(store, blobs)
+
+    monkeypatch.setattr(ingest, "place_blobs", place_after_concurrent_insert)
+    response = await test_client.post("/images/bulk", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+    assert [r["status"] for r in response.json()["results"]] == ["exists", "created"]
+    # The file placed for the image that lost the race is not left behind
+    assert not await blob_store.exists(hashes[0])
+    assert await blob_store.exists(hashes[1])
+    await test_client.delete(f"/images/{names[0]}")
+    await test_client.delete(f"/images/{names[1]}")
+    monkeypatch.undo()
+
+    async def failing_stat_deltas(db, deltas):
+        raise RuntimeError("simulated failure before commit")
+
+    monkeypatch.setattr(ingest, "apply_stat_deltas", failing_stat_deltas)
+    with pytest.raises(RuntimeError):
+        await test_client.post("/images/bulk", files=files)
+    for sha256 in hashes:
+        assert not await blob_store.exists(sha256)
+    response = await test_client.get(f"/static/images/{names[1]}")
+    assert response.status_code == 404
@@ -0,0 +1,135 @@
+import pytest
+import uuid
+import json
+from datetime import timedelta
+from io import BytesIO
+from httpx import AsyncClient
+from PIL import Image as PILImage
+from sqlalchemy import delete, func, update
+
+from app import jobs
+from app.database import async_session
+from app.jobs import JobWorker, claim_jobs, enqueue_job, job_handler
+from app.models import Job
+
+
+@pytest.mark.asyncio
+async def test_transform_is_queued_and_run_by_a_worker(test_client: AsyncClient, db_session):
+    """Test that a new transform answers 202 with a job that a worker then completes."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    buf = BytesIO()
+    PILImage.new("RGB", (100, 100), color="green").save(buf, "JPEG")
+    image_key = f"test_image_{uuid.uuid4().hex}.jpg"
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, buf.getvalue(), "image/jpeg"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    params = {"scale": 0.5, "quality": 80}
+    idempotency = {"Idempotency-Key": uuid.uuid4().hex}
+    response = await test_client.put(f"/images/{image_key}/file", params=params, headers=idempotency)
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued" and response.headers["location"] == f"/jobs/{job['id']}"
+
+    # A retried request returns the same job; the key cannot be reused for another request
+    response = await test_client.put(f"/images/{image_key}/file", params=params, headers=idempotency)
+    assert response.status_code == 202 and response.json()["id"] == job["id"]
+    response = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.25}, headers=idempotency)
+    assert response.status_code == 422
+
+    worker = JobWorker(async_session, concurrency=4)
+    while await worker.run_once():
+        pass
+
+    job = (await test_client.get(f"/jobs/{job['id']}")).json()
+    assert job["status"] == "succeeded" and job["attempts"] == 1
+    assert job["result"]["image_key"] == image_key
+    response = await test_client.get(f"/static/images/{image_key}")
+    with PILImage.open(BytesIO(response.content)) as img:
+        assert img.size == (50, 50)
+
+    # Once stored, the same transform is switched to straight away
+    response = await test_client.put(f"/images/{image_key}/file", params=params)
+    assert response.status_code == 200 and response.headers["x-cache"] == "HIT"
+    assert response.headers["x-image-version"] == str(job["result"]["version_id"])
+
+    assert (await test_client.get("/jobs/0")).status_code == 404
+    await test_client.delete(f"/images/{image_key}")
+
+
+@pytest.mark.asyncio
+async def test_failed_jobs_are_retried_then_given_up(db_session, monkeypatch):
+    """Test retries with backoff, permanent failure, and that claimed jobs are skipped by other workers."""
+    kind = f"test.flaky.{uuid.uuid4().hex[:8]}"
+    calls = []
+
+    @job_handler(kind)
+    async def flaky(params: dict) -> dict:
+        calls.append(params["n"])
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 0)
+    async with async_session() as db:
+        job, created = await enqueue_job(db, kind, {"n": 1})
+        job.max_attempts = 2
+        await db.commit()
+    assert created
+
+    # A claimed job is invisible to a second claim until it finishes
+    async with async_session() as db:
+        claimed = [j for j in await claim_jobs(db, 100) if j.kind == kind]
+    async with async_session() as db:
+        assert not [j for j in await claim_jobs(db, 100) if j.kind == kind]
+    worker = JobWorker(async_session)
+    await worker.run_job(claimed[0])
+
+    async with async_session() as db:
+        assert (await db.get(Job, job.id)).status == "queued"
+    while await worker.run_once():
+        pass
+    async with async_session() as db:
+        job = await db.get(Job, job.id)
+        assert (job.status, job.attempts, job.error) == ("failed", 2, "RuntimeError: boom")
+        await db.execute(delete(Job).where(Job.kind == kind))
+        await db.commit()
+    assert calls == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_expired_leases_are_retried_until_out_of_attempts(db_session):
+    """Test that a job whose worker died is claimed again, and failed once its attempts are used up."""
+    kind = f"test.crashing.{uuid.uuid4().hex[:8]}"
+    async with async_session() as db:
+        job, _ = await enqueue_job(db, kind, {})
+        job.max_attempts = 2
+        await db.commit()
+
+    for attempt in (1, 2):
+        async with async_session() as db:
+            claimed = [j for j in await claim_jobs(db, 100) if j.kind == kind]
+            assert [j.attempts for j in claimed] == [attempt]
+            # The worker dies without recording an outcome: the lease runs out
+            await db.execute(update(Job).where(Job.id == job.id).values(locked_until=func.now() - timedelta(seconds=1)))
+            await db.commit()
+
+    async with async_session() as db:
+        assert not [j for j in await claim_jobs(db, 100) if j.kind == kind]
+        job = await db.get(Job, job.id)
+        assert (job.status, job.attempts, job.locked_until) == ("failed", 2, None)
+        assert "Lease expired" in job.error
+        await db.execute(delete(Job).where(Job.kind == kind))
+        await db.commit()
@@ -0,0 +1,64 @@
+import pytest
+import json
+import logging
+import sys
+from httpx import AsyncClient
+
+from app import logs
+from app.logs import JsonFormatter, RequestIdFilter, _QueueHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(RequestIdFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def captured():
+    handler = ListHandler()
+    for name in ("app.access", "app.sql"):
+        logging.getLogger(name).addHandler(handler)
+    yield handler
+    for name in ("app.access", "app.sql"):
+        logging.getLogger(name).removeHandler(handler)
+
+
+def test_queued_records_render_as_json():
+    """Test that a record prepared for the queue keeps its message, extras and traceback."""
+    logger = logging.getLogger("app.test")
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        record = logger.makeRecord("app.test", logging.ERROR, __file__, 1, "Failed %s", ("job",),
+                                   sys.exc_info(), extra={"job_id": 7})
+    prepared = _QueueHandler(None).prepare(record)
+    entry = json.loads(JsonFormatter().format(prepared))
+
+    assert entry["message"] == "Failed job" and entry["level"] == "ERROR" and entry["job_id"] == 7
+    assert entry["exception"].endswith("ValueError: bad value")
+    assert "request_id" not in entry
+
+
+@pytest.mark.asyncio
+async def test_request_ids_and_sampled_sql_logging(test_client: AsyncClient, db_session, captured, monkeypatch):
+    """Test that request IDs are echoed and stamped on the request's records, including sampled SQL."""
+    monkeypatch.setattr(logs, "SQL_LOG_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(logging.getLogger("app.sql"), "level", logging.INFO)
+
+    response = await test_client.get("/stats/summary", headers={"X-Request-ID": "req-123"})
+    assert response.headers["x-request-id"] == "req-123"
+    access = [r for r in captured.records if r.name == "app.access"]
+    assert [(r.request_id, r.route, r.status) for r in access] == [("req-123", "/stats/summary", 200)]
+    statements = [r for r in captured.records if r.name == "app.sql"]
+    assert statements and all(r.request_id == "req-123" and r.statement for r in statements)
+
+    # A malformed ID is replaced rather than copied into logs and headers
+    monkeypatch.setattr(logs, "SQL_LOG_SAMPLE_RATE", 0.0)
+    response = await test_client.get("/health", headers={"X-Request-ID": "no spaces allowed"})
+    generated = response.headers["x-request-id"]
+    assert len(generated) == 32 and captured.records[-1].request_id == generated
@@ -0,0 +1,71 @@
+import pytest
+import uuid
+import json
+from io import BytesIO
+from httpx import AsyncClient
+from PIL import Image as PILImage
+
+from app import main
+from app.metrics import Counter, Histogram, db_queries_per_request, image_op_duration
+
+
+def test_histogram_and_counter_render_prometheus_text():
+    """Test cumulative buckets, sum and count, and label escaping."""
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, route="/a")
+    counter = Counter("hits_total", "Hits.", ("path",))
+    counter.inc(path='say "hi"')
+    counter.inc(2, path='say "hi"')
+
+    assert histogram.render().splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 4.25',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+    assert counter.render().splitlines()[-1] == 'hits_total{path="say \\"hi\\""} 3'
+
+
+@pytest.mark.asyncio
+async def test_requests_queries_and_image_work_are_measured(test_client: AsyncClient, db_session, monkeypatch):
+    """Test per-route request metrics, SQL counts, Server-Timing and Pillow phases on /metrics."""
+    monkeypatch.setattr(main, "IMAGE_TRANSFORM_MODE", "sync")
+    queries_before = db_queries_per_request.count(method="POST", route="/images")
+    decodes_before = image_op_duration.count(op="transform_image", phase="decode")
+
+    buf = BytesIO()
+    PILImage.new("RGB", (80, 60), color="purple").save(buf, "JPEG")
+    image_key = f"test_image_{uuid.uuid4().hex}.jpg"
+    image_form_data = {
+        "client_id": "client01", "created_at": "2025-02-24T00:00:00Z", "hardware_id": None,
+        "ml_tag": "TRAIN", "location_id": None, "user_id": None,
+        "annotations": [{"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}],
+    }
+    response = await test_client.post("/images", files={
+        "image_file": (image_key, buf.getvalue(), "image/jpeg"),
+        "image_form": (None, json.dumps(image_form_data)),
+    })
+    assert response.status_code == 200, response.text
+    assert 'db;desc="' in response.headers["server-timing"]
+
+    response = await test_client.put(f"/images/{image_key}/file", params={"scale": 0.5, "quality": 70})
+    assert response.status_code == 200
+    await test_client.get("/images", params={"client_id": "client01", "limit": 5})
+
+    assert db_queries_per_request.count(method="POST", route="/images") == queries_before + 1
+    assert image_op_duration.count(op="transform_image", phase="decode") == decodes_before + 1
+
+    response = await test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/images",status="200"}' in text
+    assert 'http_request_duration_seconds_bucket{method="PUT",route="/images/{image_key:path}/file",le="+Inf"}' in text
+    assert 'image_op_bytes_written_count{op="transform_image"}' in text
+    assert "db_query_duration_seconds_count" in text
+
+    await test_client.delete(f"/images/{image_key}")
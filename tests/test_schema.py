@@ -0,0 +1,60 @@
+import pytest
+import uuid
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import DATABASE_URL
+from app.schema import upgrade_schema
+
+# Tables as the first release created them, before any column was added
+LEGACY_DDL = [
+    "CREATE TYPE mltagenum AS ENUM ('TRAIN', 'TEST', 'LIVE')",
+    'CREATE TABLE location (id VARCHAR PRIMARY KEY, address VARCHAR NOT NULL, country VARCHAR NOT NULL, town VARCHAR NOT NULL)',
+    'CREATE TABLE "user" (id VARCHAR PRIMARY KEY, first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL, role VARCHAR NOT NULL)',
+    "CREATE TABLE image (image_key VARCHAR PRIMARY KEY, client_id VARCHAR NOT NULL,"
+    " created_at TIMESTAMP WITH TIME ZONE NOT NULL, hardware_id VARCHAR, ml_tag mltagenum,"
+    ' location_id VARCHAR REFERENCES location (id), user_id VARCHAR REFERENCES "user" (id))',
+    "CREATE TABLE annotation (image_key VARCHAR REFERENCES image (image_key), index INTEGER,"
+    " instrument VARCHAR NOT NULL, polygon JSON, PRIMARY KEY (image_key, index))",
+]
+
+
+@pytest.mark.asyncio
+async def test_upgrade_schema_brings_a_legacy_database_up_to_date(db_session):
+    """Test that the schema step adds the new columns and indexes to existing tables and backfills them."""
+    schema = f"legacy_{uuid.uuid4().hex}"
+    engine = create_async_engine(DATABASE_URL, connect_args={"server_settings": {"search_path": schema}})
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+            for statement in LEGACY_DDL:
+                await conn.execute(text(statement))
+            await conn.execute(text(
+                "INSERT INTO image (image_key, client_id, created_at) VALUES ('old.png', 'client01', now())"
+            ))
+            await conn.execute(text(
+                "INSERT INTO annotation VALUES ('old.png', 0, 'instr1', '{\"points\": [[0, 0], [4, 0], [4, 2]]}')"
+            ))
+
+        # Twice: every step must be safe to repeat
+        for _ in range(2):
+            async with engine.begin() as conn:
+                await upgrade_schema(conn)
+
+        async with engine.connect() as conn:
+            image = (await conn.execute(text(
+                "SELECT content_hash, current_version_id, change_seq FROM image"
+            ))).one()
+            assert tuple(image) == (None, None, 0)
+            annotation = (await conn.execute(text(
+                "SELECT bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y, area, change_seq FROM annotation"
+            ))).one()
+            assert tuple(annotation) == (0, 0, 4, 2, 4.0, 0)
+            indexes = set((await conn.execute(text(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = :schema"
+            ), {"schema": schema})).scalars())
+            assert {"ix_image_created_at_key", "ix_image_change_seq", "ix_annotation_bbox"} <= indexes
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+        await engine.dispose()
@@ -0,0 +1,87 @@
+import pytest
+import uuid
+import json
+from httpx import AsyncClient
+
+from app.database import async_session
+from app.stats import rebuild_stats
+
+
+def counts(summary: dict, dimension: str) -> dict:
+    return {group["key"]: group["count"] for group in summary["dimensions"].get(dimension, [])}
+
+
+@pytest.mark.asyncio
+async def test_summary_follows_writes_and_matches_a_rebuild(test_client: AsyncClient, db_session):
+    """Test that every write keeps the summary current and that it equals a full recount."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    hardware_id = f"hw_{uuid.uuid4().hex[:8]}"
+    instrument = f"instr_{uuid.uuid4().hex[:8]}"
+    image_keys = [f"test_image_{uuid.uuid4().hex}.png" for _ in range(2)]
+    before = (await test_client.get("/stats/summary")).json()
+
+    for image_key, ml_tag in zip(image_keys, ["TRAIN", "TEST"]):
+        image_form_data = {
+            "client_id": "client01",
+            "created_at": "2025-02-24T00:00:00Z",
+            "hardware_id": hardware_id,
+            "ml_tag": ml_tag,
+            "location_id": None,
+            "user_id": None,
+            "annotations": [
+                {"index": 0, "instrument": instrument, "polygon": {"points": [[0, 0], [2, 0], [2, 2], [0, 2]]}}
+            ]
+        }
+        files = {
+            "image_file": (image_key, f"fake image data {image_key}".encode(), "image/png"),
+            "image_form": (None, json.dumps(image_form_data)),
+        }
+        response = await test_client.post("/images", files=files)
+        assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    summary = (await test_client.get("/stats/summary")).json()
+    assert summary["images"] == before["images"] + 2
+    assert counts(summary, "hardware_id")[hardware_id] == 2
+    assert counts(summary, "instrument")[instrument] == 2
+    assert counts(summary, "ml_tag")["TRAIN"] == counts(before, "ml_tag").get("TRAIN", 0) + 1
+
+    # Filtered counts are computed with GROUP BY
+    response = await test_client.get("/stats/images", params={"group_by": "ml_tag", "hardware_id": hardware_id})
+    assert sorted((g["key"], g["count"]) for g in response.json()) == [("TEST", 1), ("TRAIN", 1)]
+    response = await test_client.get("/stats/images", params={"group_by": "hardware_id"})
+    assert {"key": hardware_id, "count": 2} in response.json()
+    response = await test_client.get("/stats/instruments", params={"hardware_id": hardware_id})
+    assert response.json() == [{"instrument": instrument, "annotations": 2, "images": 2, "total_area": 8.0}]
+
+    # Re-labelling, adding and deleting annotations move the instrument counts
+    renamed = f"{instrument}_b"
+    response = await test_client.post("/annotations/batch", json={
+        "upsert": [
+            {"image_key": image_keys[0], "index": 0, "instrument": renamed, "polygon": {"points": [[0, 0]]}},
+            {"image_key": image_keys[0], "index": 1, "instrument": renamed, "polygon": {"points": [[0, 0]]}},
+        ],
+        "delete": [{"image_key": image_keys[1], "index": 0}],
+    })
+    assert response.status_code == 200, response.json()
+    response = await test_client.put("/annotations/update", json={
+        "image_key": image_keys[0], "annotation_index": 1, "instrument": instrument,
+        "polygon": {"points": [[0, 0]]},
+    })
+    assert response.status_code == 200
+    summary = (await test_client.get("/stats/summary")).json()
+    assert counts(summary, "instrument")[instrument] == 1
+    assert counts(summary, "instrument")[renamed] == 1
+
+    async with async_session() as session:
+        await rebuild_stats(session)
+    assert (await test_client.get("/stats/summary")).json() == summary
+
+    for image_key in image_keys:
+        await test_client.delete(f"/images/{image_key}")
+    summary = (await test_client.get("/stats/summary")).json()
+    assert summary["images"] == before["images"]
+    assert hardware_id not in counts(summary, "hardware_id")
+    assert instrument not in counts(summary, "instrument") and renamed not in counts(summary, "instrument")
+
+    response = await test_client.get("/stats/images", params={"group_by": "instrument"})
+    assert response.status_code == 422
@@ -0,0 +1,104 @@
+import pytest
+import uuid
+import json
+import os
+import tempfile
+from httpx import AsyncClient
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from app.storage import BlobStore, S3Storage
+
+BUCKET = "scalpel-test-bucket"
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    """Fixture to provide an S3Storage backed by moto's in-process S3 stand-in."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, prefix="uploads/", client=client)
+
+
+def _staged_file(data: bytes) -> str:
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.mark.asyncio
+async def test_s3_storage_roundtrip(s3_storage):
+    """Test storing, reading, presigning and deleting an object through the S3 backend."""
+    from boto3.s3.transfer import TransferConfig
+
+    # Force a multipart upload with the smallest part size S3 allows
+    s3_storage.transfer_config = TransferConfig(multipart_threshold=5 * 1024 * 1024,
+                                                multipart_chunksize=5 * 1024 * 1024)
+    data = os.urandom(6 * 1024 * 1024)
+    path = _staged_file(data)
+
+    await s3_storage.put_file("ab/cd/object", path)
+
+    assert not os.path.exists(path), "the staged file is consumed"
+    assert await s3_storage.exists("ab/cd/object")
+    assert await s3_storage.read_bytes("ab/cd/object") == data
+    assert s3_storage.local_path("ab/cd/object") is None
+
+    url = await s3_storage.url("ab/cd/object", "image/png")
+    assert BUCKET in url and "uploads/ab/cd/object" in url and "Signature" in url
+
+    await s3_storage.delete("ab/cd/object")
+    assert not await s3_storage.exists("ab/cd/object")
+
+
+@pytest.mark.asyncio
+async def test_image_reads_redirect_to_presigned_url(test_client: AsyncClient, db_session, s3_storage, monkeypatch):
+    """Test that with S3 storage images are uploaded to the bucket and served by redirect."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    from app import main
+
+    monkeypatch.setattr(main, "storage", s3_storage)
+    monkeypatch.setattr(main, "blob_store", BlobStore(s3_storage))
+
+    image_key = f"test_image_{uuid.uuid4().hex}.png"
+    content = f"fake image data {uuid.uuid4().hex}".encode()
+    image_form_data = {
+        "client_id": "client01",
+        "created_at": "2025-02-24T00:00:00Z",
+        "hardware_id": None,
+        "ml_tag": "TRAIN",
+        "location_id": None,
+        "user_id": None,
+        "annotations": [
+            {"index": 0, "instrument": "instr1", "polygon": {"points": [[0, 0], [1, 1]]}}
+        ]
+    }
+    files = {
+        "image_file": (image_key, content, "image/png"),
+        "image_form": (None, json.dumps(image_form_data)),
+    }
+    response = await test_client.post("/images", files=files)
+    assert response.status_code == 200, f"Response failed: {response.json()}"
+
+    response = await test_client.get(f"/static/images/{image_key}")
+    assert response.status_code == 307
+    assert BUCKET in response.headers["location"]
+
+    # No transcoding through the API: variants are not made from remote storage
+    response = await test_client.get(
+        f"/static/images/{image_key}", params={"tier": "preview"}, headers={"Accept": "image/webp,image/*"},
+    )
+    assert response.status_code == 307
+    assert BUCKET in response.headers["location"]
+    assert "vary" not in response.headers
+
+    response = await test_client.delete(f"/images/{image_key}")
+    assert response.status_code == 200
+    objects = s3_storage.client.list_objects_v2(Bucket=BUCKET).get("Contents", [])
+    assert objects == []
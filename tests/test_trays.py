@@ -0,0 +1,83 @@
+import pytest
+import uuid
+from httpx import AsyncClient
+
+from app.tray_models import VendorTrayManufacturer
+from app.trays import build_tray_index
+
+
+def test_tray_index_maps_names_and_aliases_to_instruments():
+    """Test that the index covers every instrument source and prefers names over aliases."""
+    tray = VendorTrayManufacturer(
+        type="t1",
+        version=3,
+        aliases={"Scalpel Handle #3": ["handle 3", "BP3"], "Forceps": "tweezers", "Needle Holder": ["forceps"]},
+        additional_instruments={"Retractor": {}},
+        levels={"top": ["Mayo Scissors"], "bottom": "Towel Clamp"},
+        subgroups={"cutting": ["Scalpel Handle #3"], "meta": {"not": "a list"}},
+    )
+    index = build_tray_index(tray)
+    assert index.version == 3
+    assert index.resolve("  bp3 ") == "Scalpel Handle #3"
+    assert index.resolve("HANDLE   3") == "Scalpel Handle #3"
+    assert index.resolve("Tweezers") == "Forceps"
+    # An instrument's own name beats another instrument's alias
+    assert index.resolve("forceps") == "Forceps"
+    assert index.resolve("mayo scissors") == "Mayo Scissors"
+    assert index.resolve("towel clamp") == "Towel Clamp"
+    assert index.resolve("retractor") == "Retractor"
+    assert index.resolve("spoon") is None
+
+
+@pytest.mark.asyncio
+async def test_tray_crud_and_cached_resolution(test_client: AsyncClient, db_session):
+    """Test tray CRUD and that lookups reuse the cached index until the tray changes."""
+    # db_session keeps this test on the session event loop shared with the app's engine
+    tray_type = f"tray_{uuid.uuid4().hex[:8]}"
+    tray = {"type": tray_type, "manufacturer": "Acme", "aliases": {"Scalpel": ["blade"]}}
+    response = await test_client.post("/trays", json=tray)
+    assert response.status_code == 200, response.json()
+    assert response.json()["version"] == 1
+    assert (await test_client.post("/trays", json=tray)).status_code == 409
+
+    health = (await test_client.get("/health/tray-index")).json()
+    params = [("name", "Blade"), ("name", "scalpel"), ("name", "spoon")]
+    response = await test_client.get(f"/trays/{tray_type}/resolve", params=params)
+    assert [m["instrument"] for m in response.json()["matches"]] == ["Scalpel", "Scalpel", None]
+    response = await test_client.get(f"/trays/{tray_type}/resolve", params=params)
+    after = (await test_client.get("/health/tray-index")).json()
+    assert (after["builds"] - health["builds"], after["hits"] - health["hits"]) == (1, 1)
+
+    tray["aliases"] = {"Scalpel": ["blade"], "Spoon": ["curette"]}
+    response = await test_client.put(f"/trays/{tray_type}", json=tray)
+    assert response.status_code == 200 and response.json()["version"] == 2
+    response = await test_client.get(f"/trays/{tray_type}/resolve", params={"name": "curette"})
+    assert response.json()["version"] == 2
+    assert response.json()["matches"] == [{"name": "curette", "instrument": "Spoon"}]
+
+    response = await test_client.get(f"/trays/{tray_type}")
+    assert response.json()["aliases"] == tray["aliases"]
+    assert tray_type in [t["type"] for t in (await test_client.get("/trays")).json()]
+    assert (await test_client.put(f"/trays/{tray_type}", json={**tray, "type": "other"})).status_code == 400
+
+    assert (await test_client.delete(f"/trays/{tray_type}")).status_code == 200
+    assert (await test_client.get(f"/trays/{tray_type}/resolve", params={"name": "blade"})).status_code == 404
+    assert (await test_client.get(f"/trays/{tray_type}")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_concurrent_tray_create_is_a_conflict(test_client: AsyncClient, db_session, monkeypatch):
+    """Test that a tray created between the existence check and the insert gives 409, not 500."""
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    tray = {"type": f"tray_{uuid.uuid4().hex[:8]}", "manufacturer": "Acme"}
+    assert (await test_client.post("/trays", json=tray)).status_code == 200
+
+    async def not_found(self, *args, **kwargs):
+        return None  # The check runs before the other request commits
+
+    monkeypatch.setattr(AsyncSession, "get", not_found)
+    response = await test_client.post("/trays", json=tray)
+    monkeypatch.undo()
+    assert response.status_code == 409
+    assert (await test_client.delete(f"/trays/{tray['type']}")).status_code == 200